@@ -1,8 +1,20 @@
-from fastapi import FastAPI, HTTPException
+import os
+import sys
+import time
+
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import socket
-import struct
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from src.proto import smart_city_pb2
+from .gateway_client import AsyncGatewayClient
+from .response_cache import ResponseCache
+from .device_events import DeviceEventHub, DEVICE_INFO_FIELDS, device_info_to_dict, device_update_to_dict, format_sse
+
+# Histórico e agregados são lidos com os mesmos módulos que o gateway usa para gravá-los
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'gateway'))
+from history import HistoryStore, SENSOR_METRICS
+from rollup import RollupStore, RESOLUTIONS
 
 app = FastAPI()
 
@@ -17,162 +29,322 @@ app.add_middleware(
 
 GATEWAY_HOST = "127.0.0.1"
 GATEWAY_API_PORT = 12345
+GATEWAY_POOL_SIZE = 4          # Conexões persistentes mantidas com o gateway
+GATEWAY_TIMEOUT = 5            # Prazo padrão de cada requisição (conexão + envio + resposta)
+GATEWAY_COMMAND_TIMEOUT = 12   # Prazo de comandos: o gateway aguarda o dispositivo (MQTT até 10 s)
+GATEWAY_BULK_COMMAND_TIMEOUT = 120  # Prazo de comandos em massa (vários dispositivos, paralelismo limitado)
 
-# Utilitários de serialização varint (delimited Protobuf)
-# Encapsular mensagens Protobuf em tamanhos prefixadoss de forma a garantir 
-# que o receptor saiba o tamanho da mensagem antes de tentar ler os dados.
-
-def encode_varint(value: int) -> bytes:
-    result = b""
-    while True:
-        bits = value & 0x7F
-        value >>= 7
-        if value:
-            result += struct.pack("B", bits | 0x80)
-        else:
-            result += struct.pack("B", bits)
-            break
-    return result
-
-def read_varint(stream):
-    shift = 0
-    result = 0
-    while True:
-        b = stream.read(1)
-        if not b:
-            raise EOFError("Stream fechado inesperadamente ao ler varint.")
-        b = ord(b)
-        result |= (b & 0x7f) << shift
-        if not (b & 0x80):
-            return result
-        shift += 7
-        if shift >= 64:
-            raise ValueError("Varint muito longo.")
-
-def write_delimited_message(sock, message):
-    data = message.SerializeToString()
-    sock.sendall(encode_varint(len(data)) + data)
-
-def read_delimited_message(sock):
-    reader = sock.makefile('rb')
-    size = read_varint(reader)
-    
-    return reader.read(size)
+# Histórico gravado pelo gateway (mesmo diretório de HISTORY_DIR em smart_city_gateway.py)
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data', 'history')
+HISTORY_DEFAULT_WINDOW = 3600  # Segundos consultados quando start não é informado
+HISTORY_MAX_POINTS = 10000     # Máximo de amostras por métrica em uma resposta
+ROLLUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data', 'rollups')
+
+# Cache de respostas (por processo); comandos invalidam o dispositivo afetado
+CACHE_TTL_DEVICES = 2.0        # Segundos de validade de /devices
+CACHE_TTL_DEVICE_DATA = 1.0    # Segundos de validade de /device/data
+CACHE_MAX_ENTRIES = 4096       # Entradas mantidas (LRU)
+
+DEVICES_MAX_PAGE_SIZE = 1000   # Maior `limit` aceito em /devices (igual a LIST_DEVICES_MAX_PAGE_SIZE do gateway)
+
+# Push de eventos (SSE / WebSocket) a partir de uma única assinatura com o gateway
+EVENTS_CLIENT_QUEUE_SIZE = 256  # Eventos pendentes por cliente antes de descartar os mais antigos
+EVENTS_HEARTBEAT = 15           # Segundos entre heartbeats quando não há eventos
+
+# Conexões asyncio de longa duração com o gateway, compartilhadas por todas as rotas
+gateway_client = AsyncGatewayClient(GATEWAY_HOST, GATEWAY_API_PORT, pool_size=GATEWAY_POOL_SIZE, timeout=GATEWAY_TIMEOUT)
+# Leitura direta dos segmentos mapeados em memória (não passa pelo gateway)
+sensor_history = HistoryStore(HISTORY_DIR, readonly=True)
+sensor_rollups = RollupStore(ROLLUP_DIR, readonly=True)
+response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES)
+event_hub = DeviceEventHub(GATEWAY_HOST, GATEWAY_API_PORT, queue_size=EVENTS_CLIENT_QUEUE_SIZE)
+
+def invalidate_on_event(event: dict):
+    """Eventos do gateway tornam as respostas em cache do dispositivo obsoletas"""
+    response_cache.invalidate(("device_data", event["id"]))
+    if event["event"] != "device_updated":
+        response_cache.invalidate_group("devices")
+
+event_hub.add_listener(invalidate_on_event)
+
+@app.on_event("shutdown")
+async def close_gateway_client():
+    await event_hub.close()
+    await gateway_client.close()
 
 # Envia uma mensagem Protobuf para o gateway e espera uma resposta, tuda a comunicação é feita por essa função.
-def send_protobuf_request(request_msg: smart_city_pb2.ClientRequest) -> smart_city_pb2.GatewayResponse | smart_city_pb2.DeviceUpdate:
+# A espera não ocupa threads: o event loop atende outras requisições até a resposta chegar ou o prazo vencer.
+async def send_protobuf_request(request_msg: smart_city_pb2.ClientRequest, timeout: float | None = None) -> smart_city_pb2.GatewayResponse | smart_city_pb2.DeviceUpdate:
     try:
-        envelope = smart_city_pb2.SmartCityMessage(
-            message_type=smart_city_pb2.MessageType.CLIENT_REQUEST,
-            client_request=request_msg
-        )
-        with socket.create_connection((GATEWAY_HOST, GATEWAY_API_PORT), timeout=5) as sock:
-            write_delimited_message(sock, envelope)
-            data = read_delimited_message(sock)
-
-            response_envelope = smart_city_pb2.SmartCityMessage()
-            response_envelope.ParseFromString(data)
-            print(f"Recebido envelope: {response_envelope}")
-
-            if response_envelope.message_type == smart_city_pb2.MessageType.GATEWAY_RESPONSE:
-                return response_envelope.gateway_response
-            
-            #elif response_envelope.message_type == smart_city_pb2.MessageType.DEVICE_UPDATE:
-                #return response_envelope.device_update
-            
-            else:
-                raise HTTPException(status_code=500, detail=f"Tipo de mensagem inesperado: {response_envelope.message_type}")
-
+        response_envelope = await gateway_client.request(request_msg, timeout)
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"Gateway não respondeu no prazo: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na comunicação com o gateway: {e}")
 
+    if response_envelope.message_type == smart_city_pb2.MessageType.GATEWAY_RESPONSE:
+        return response_envelope.gateway_response
+    
+    #elif response_envelope.message_type == smart_city_pb2.MessageType.DEVICE_UPDATE:
+        #return response_envelope.device_update
+    
+    raise HTTPException(status_code=500, detail=f"Tipo de mensagem inesperado: {response_envelope.message_type}")
+
+
+async def send_device_command(device_id: str, command_type: str, command_value: str = ""):
+    """Envia um comando ao dispositivo e invalida as respostas em cache que dependem dele"""
+    cmd = smart_city_pb2.DeviceCommand(device_id=device_id, command_type=command_type, command_value=command_value)
+    req = smart_city_pb2.ClientRequest(
+        type=smart_city_pb2.ClientRequest.SEND_DEVICE_COMMAND,
+        target_device_id=device_id,
+        command=cmd
+    )
+    try:
+        res = await send_protobuf_request(req, GATEWAY_COMMAND_TIMEOUT)
+    finally:
+        # Mesmo em falha/timeout o estado do dispositivo pode ter mudado
+        response_cache.invalidate(("device_data", device_id))
+        response_cache.invalidate_group("devices")
+    return {"status": res.command_status, "message": res.message}
+
+
+def split_param(value: str | None) -> list[str]:
+    """Parâmetro com vários valores separados por vírgula"""
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+def parse_device_filters(device_type: str | None, status: str | None) -> tuple[tuple, tuple]:
+    """Nomes de DeviceType/DeviceStatus separados por vírgula -> valores dos enums"""
+    try:
+        types = tuple(sorted(smart_city_pb2.DeviceType.Value(name) for name in split_param(device_type)))
+        statuses = tuple(sorted(smart_city_pb2.DeviceStatus.Value(name) for name in split_param(status)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Filtro inválido: {e}")
+    return types, statuses
 
 @app.get("/devices")
-def list_devices():
-    req = smart_city_pb2.ClientRequest(type=smart_city_pb2.ClientRequest.LIST_DEVICES)
-    res = send_protobuf_request(req)
-    return [
-        {
-            "id": d.device_id,
-            "type": smart_city_pb2.DeviceType.Name(d.type),
-            "ip": d.ip_address,
-            "port": d.port,
-            "status": smart_city_pb2.DeviceStatus.Name(d.initial_state),
-            "is_sensor": d.is_sensor,
-            "is_actuator": d.is_actuator
-        }
-        for d in res.devices
-    ]
+async def list_devices(limit: int | None = None, cursor: str = "",
+                       device_type: str | None = Query(None, alias="type"),
+                       status: str | None = None, is_sensor: bool | None = None, is_actuator: bool | None = None,
+                       subnet: str | None = None, fields: str | None = None):
+    """Dispositivos registrados no gateway.
+
+    Sem `limit` responde a lista completa (formato original). Com `limit`
+    responde uma página {"devices", "next_cursor", "total"}; a próxima página
+    é pedida com cursor=next_cursor. `type` e `status` aceitam vários nomes
+    separados por vírgula (ex.: type=RELAY,ALARM); `subnet` filtra por rede
+    CIDR (ex.: 192.168.1.0/24); `fields` restringe os campos de cada
+    dispositivo (ex.: fields=status,ip). Filtros e paginação são aplicados no
+    gateway, sobre os índices do registro de dispositivos.
+    """
+    types, statuses = parse_device_filters(device_type, status)
+    field_names = tuple(sorted(set(split_param(fields))))
+    unknown = [name for name in field_names if name not in DEVICE_INFO_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(unknown)} (use {', '.join(DEVICE_INFO_FIELDS)})")
+    if limit is not None and not 1 <= limit <= DEVICES_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit deve estar entre 1 e {DEVICES_MAX_PAGE_SIZE}")
+
+    page = await response_cache.get_or_load(
+        ("devices", limit, cursor, types, statuses, is_sensor, is_actuator, subnet, field_names), CACHE_TTL_DEVICES,
+        lambda: load_devices(limit or 0, cursor, types, statuses, is_sensor, is_actuator, subnet, field_names)
+    )
+    if limit is None:
+        return page["devices"]
+    return page
+
+async def load_devices(limit: int = 0, cursor: str = "", types=(), statuses=(), is_sensor: bool | None = None,
+                       is_actuator: bool | None = None, subnet: str | None = None, fields=()):
+    req = smart_city_pb2.ClientRequest(
+        type=smart_city_pb2.ClientRequest.LIST_DEVICES,
+        page_size=limit,
+        page_cursor=cursor,
+        filter_types=types,
+        filter_statuses=statuses,
+        filter_subnet=subnet or "",
+        field_mask=[DEVICE_INFO_FIELDS[name] for name in fields]
+    )
+    if is_sensor is not None:
+        req.filter_is_sensor = is_sensor
+    if is_actuator is not None:
+        req.filter_is_actuator = is_actuator
+    res = await send_protobuf_request(req)
+    if res.type == smart_city_pb2.GatewayResponse.ERROR:
+        raise HTTPException(status_code=400, detail=res.message)
+    return {
+        "devices": [device_info_to_dict(d, fields) for d in res.devices],
+        "next_cursor": res.next_page_cursor or None,
+        "total": res.total_devices,
+    }
 
 @app.get("/device/data")
-def get_device_status(device_id: str):
+async def get_device_status(device_id: str):
+    return await response_cache.get_or_load(
+        ("device_data", device_id), CACHE_TTL_DEVICE_DATA, lambda: load_device_status(device_id)
+    )
+
+async def load_device_status(device_id: str):
     req = smart_city_pb2.ClientRequest(
         type=smart_city_pb2.ClientRequest.GET_DEVICE_STATUS,
         target_device_id=device_id
     )
-    res = send_protobuf_request(req)
-
-    print(res.device_status)
+    res = await send_protobuf_request(req)
 
     if res.type == smart_city_pb2.GatewayResponse.DEVICE_STATUS_UPDATE:
-        d = res.device_status
-        response = {
-            "id": d.device_id,
-            "type": smart_city_pb2.DeviceType.Name(d.type),
-            "status": smart_city_pb2.DeviceStatus.Name(d.current_status),
-            "custom_config_status": d.custom_config_status,
-        }
-
-        if d.HasField("temperature_humidity"):
-            response["temperature"] = d.temperature_humidity.temperature
-            response["humidity"] = d.temperature_humidity.humidity
-
-        if hasattr(d, "frequency_ms") and d.frequency_ms > 0:
-            response["frequency_ms"] = d.frequency_ms
-
-        return response
+        return device_update_to_dict(res.device_status)
 
     raise HTTPException(status_code=404, detail=res.message or "Dispositivo não encontrado")
 
 
 @app.put("/device/relay")
-def control_relay(device_id: str, action: str):
+async def control_relay(device_id: str, action: str):
     if action not in ["TURN_ON", "TURN_OFF"]:
         raise HTTPException(status_code=400, detail="Inválido. Use TURN_ON ou TURN_OFF.")
     
-    cmd = smart_city_pb2.DeviceCommand(device_id=device_id, command_type=action)
-    req = smart_city_pb2.ClientRequest(
-        type=smart_city_pb2.ClientRequest.SEND_DEVICE_COMMAND,
-        target_device_id=device_id,
-        command=cmd
-    )
-    res = send_protobuf_request(req)
-    return {"status": res.command_status, "message": res.message}
+    return await send_device_command(device_id, action)
 
 @app.put("/device/sensor/state")
-def change_sensor_state(device_id: str, state: str):
+async def change_sensor_state(device_id: str, state: str):
     if state not in ["TURN_ACTIVE", "TURN_IDLE"]:
         raise HTTPException(status_code=400, detail="Inválido. Use TURN_ACTIVE ou TURN_IDLE.")
     
-    cmd = smart_city_pb2.DeviceCommand(device_id=device_id, command_type=state)
-    req = smart_city_pb2.ClientRequest(
-        type=smart_city_pb2.ClientRequest.SEND_DEVICE_COMMAND,
-        target_device_id=device_id,
-        command=cmd
-    )
-    res = send_protobuf_request(req)
-    return {"status": res.command_status, "message": res.message}
+    return await send_device_command(device_id, state)
 
 @app.put("/device/sensor/frequency")
-def set_sensor_frequency(device_id: str, frequency: int):
+async def set_sensor_frequency(device_id: str, frequency: int):
     if frequency < 1000 or frequency > 60000:
         raise HTTPException(status_code=400, detail="Frequência incorreto.")
     
-    cmd = smart_city_pb2.DeviceCommand(device_id=device_id, command_type="SET_FREQ", command_value=str(frequency))
+    return await send_device_command(device_id, "SET_FREQ", str(frequency))
+
+class BulkCommand(BaseModel):
+    """Corpo de POST /devices/command: alvos por lista de ids ou pelos mesmos filtros de /devices"""
+    command: str
+    value: str = ""
+    device_ids: list[str] = []
+    type: str | None = None
+    status: str | None = None
+    is_sensor: bool | None = None
+    is_actuator: bool | None = None
+    subnet: str | None = None
+    max_parallelism: int = 0  # 0 = padrão do gateway
+
+BULK_COMMANDS = ("TURN_ON", "TURN_OFF", "TURN_ACTIVE", "TURN_IDLE", "SET_FREQ")
+
+@app.post("/devices/command")
+async def bulk_device_command(body: BulkCommand):
+    """Mesmo comando para vários dispositivos, executado em paralelo pelo gateway.
+
+    Uma única ida e volta ao gateway; a resposta traz o status e a latência
+    de cada dispositivo.
+    """
+    if body.command not in BULK_COMMANDS:
+        raise HTTPException(status_code=400, detail=f"Comando inválido. Use um de: {', '.join(BULK_COMMANDS)}.")
+    if body.command == "SET_FREQ" and not (body.value.isdigit() and 1000 <= int(body.value) <= 60000):
+        raise HTTPException(status_code=400, detail="Frequência incorreto.")
+    if body.max_parallelism < 0:
+        raise HTTPException(status_code=400, detail="max_parallelism não pode ser negativo")
+    types, statuses = parse_device_filters(body.type, body.status)
+
     req = smart_city_pb2.ClientRequest(
-        type=smart_city_pb2.ClientRequest.SEND_DEVICE_COMMAND,
-        target_device_id=device_id,
-        command=cmd
+        type=smart_city_pb2.ClientRequest.BULK_DEVICE_COMMAND,
+        command=smart_city_pb2.DeviceCommand(command_type=body.command, command_value=body.value),
+        target_device_ids=body.device_ids,
+        filter_types=types,
+        filter_statuses=statuses,
+        filter_subnet=body.subnet or "",
+        max_parallelism=body.max_parallelism
     )
-    res = send_protobuf_request(req)
-    return {"status": res.command_status, "message": res.message}
+    if body.is_sensor is not None:
+        req.filter_is_sensor = body.is_sensor
+    if body.is_actuator is not None:
+        req.filter_is_actuator = body.is_actuator
+    try:
+        res = await send_protobuf_request(req, GATEWAY_BULK_COMMAND_TIMEOUT)
+    finally:
+        response_cache.invalidate_group("device_data")
+        response_cache.invalidate_group("devices")
+
+    if res.type == smart_city_pb2.GatewayResponse.ERROR:
+        raise HTTPException(status_code=400, detail=res.message)
+    return {
+        "status": res.command_status,
+        "message": res.message,
+        "results": [
+            {
+                "device_id": r.device_id,
+                "status": r.command_status,
+                "message": r.message,
+                "latency_ms": round(r.latency_ms, 1),
+            }
+            for r in res.command_results
+        ],
+    }
+
+@app.get("/cache/metrics")
+async def get_cache_metrics():
+    return response_cache.get_metrics()
+
+@app.get("/events")
+async def stream_events(request: Request, device_id: str = "", type: str = ""):
+    """Server-sent events com as mudanças de dispositivos (filtros: prefixo de device_id e tipo)"""
+    subscription = event_hub.subscribe(device_id, type)
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                event = await subscription.get(EVENTS_HEARTBEAT)
+                # Comentário SSE mantém proxies e o navegador cientes de que a conexão está viva
+                yield format_sse(event) if event is not None else ": heartbeat\n\n"
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/ws/events")
+async def websocket_events(websocket: WebSocket, device_id: str = "", type: str = ""):
+    """Mesmos eventos de /events, como mensagens JSON em um WebSocket"""
+    await websocket.accept()
+    subscription = event_hub.subscribe(device_id, type)
+    try:
+        while True:
+            event = await subscription.get(EVENTS_HEARTBEAT)
+            await websocket.send_json(event if event is not None else {"event": "heartbeat"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        event_hub.unsubscribe(subscription)
+
+@app.get("/events/metrics")
+async def get_event_metrics():
+    return event_hub.get_metrics()
+
+# Rota síncrona de propósito: lê arquivos (listdir/mmap), então roda no pool de threads
+@app.get("/device/history")
+def get_device_history(device_id: str, metric: str | None = None, start: float | None = None,
+                       end: float | None = None, limit: int = HISTORY_MAX_POINTS, resolution: str = "raw"):
+    if metric is not None and metric not in SENSOR_METRICS:
+        raise HTTPException(status_code=400, detail=f"Métrica inválida. Use uma de: {', '.join(SENSOR_METRICS)}.")
+    if resolution != "raw" and resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Resolução inválida. Use raw, {', '.join(RESOLUTIONS)}.")
+    if end is None:
+        end = time.time()
+    if start is None:
+        start = end - HISTORY_DEFAULT_WINDOW
+    if start > end:
+        raise HTTPException(status_code=400, detail="Intervalo inválido: start maior que end.")
+    limit = max(1, min(limit, HISTORY_MAX_POINTS))
+
+    metrics = [metric] if metric else sensor_history.metrics(device_id)
+    if not metrics:
+        raise HTTPException(status_code=404, detail="Sem histórico para o dispositivo.")
+
+    series = {}
+    for name in metrics:
+        if resolution == "raw":
+            timestamps, values = sensor_history.query(device_id, name, start, end, limit)
+            series[name] = [[ts, value] for ts, value in zip(timestamps, values)]
+        else:
+            # Agregados pré-calculados: custo proporcional ao número de baldes
+            series[name] = sensor_rollups.query(device_id, name, resolution, start, end, limit)
+    return {"id": device_id, "resolution": resolution, "start": start, "end": end, "series": series}
@@ -0,0 +1,230 @@
+"""
+Distribuição de eventos de dispositivos para navegadores (SSE / WebSocket)
+
+Em vez de cada aba do dashboard consultar /device/data periodicamente, a API
+mantém UMA assinatura com o gateway (ClientRequest SUBSCRIBE, conexão TCP
+aberta recebendo DeviceEvent) e repassa cada evento a todos os clientes
+conectados em /events (SSE) ou /ws/events (WebSocket).
+
+- A assinatura com o gateway é aberta no primeiro cliente e reconectada com
+  backoff exponencial se cair
+- Cada cliente tem uma fila limitada; se ele não consome a tempo, os eventos
+  mais antigos são descartados (o próximo evento traz o estado atual)
+- Filtros por prefixo de device_id e por tipo são aplicados aqui, então uma
+  única assinatura serve clientes com filtros diferentes
+"""
+
+import asyncio
+import json
+import logging
+from typing import Callable
+
+from src.proto import smart_city_pb2
+from src.proto.framing import AsyncDelimitedReader, encode_delimited
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIENT_QUEUE_SIZE = 256
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 15.0
+
+_EVENT_NAMES = {
+    smart_city_pb2.DeviceEvent.EventType.DEVICE_UPDATED: "device_updated",
+    smart_city_pb2.DeviceEvent.EventType.DEVICE_REGISTERED: "device_registered",
+    smart_city_pb2.DeviceEvent.EventType.DEVICE_OFFLINE: "device_offline",
+}
+
+
+# Campos de um dispositivo em /devices -> campos de DeviceInfo (máscara de campos do LIST_DEVICES)
+DEVICE_INFO_FIELDS = {
+    "id": "device_id",
+    "type": "type",
+    "ip": "ip_address",
+    "port": "port",
+    "status": "initial_state",
+    "is_sensor": "is_sensor",
+    "is_actuator": "is_actuator",
+}
+
+
+def device_info_to_dict(d: smart_city_pb2.DeviceInfo, fields=None) -> dict:
+    """Formato de um dispositivo em /devices (opcionalmente só os campos em `fields`)"""
+    data = {
+        "id": d.device_id,
+        "type": smart_city_pb2.DeviceType.Name(d.type),
+        "ip": d.ip_address,
+        "port": d.port,
+        "status": smart_city_pb2.DeviceStatus.Name(d.initial_state),
+        "is_sensor": d.is_sensor,
+        "is_actuator": d.is_actuator
+    }
+    if fields:
+        data = {name: value for name, value in data.items() if name == "id" or name in fields}
+    return data
+
+
+def device_update_to_dict(d: smart_city_pb2.DeviceUpdate) -> dict:
+    """Formato do estado de um dispositivo em /device/data"""
+    response = {
+        "id": d.device_id,
+        "type": smart_city_pb2.DeviceType.Name(d.type),
+        "status": smart_city_pb2.DeviceStatus.Name(d.current_status),
+        "custom_config_status": d.custom_config_status,
+    }
+
+    if d.HasField("temperature_humidity"):
+        response["temperature"] = d.temperature_humidity.temperature
+        response["humidity"] = d.temperature_humidity.humidity
+
+    if d.frequency_ms > 0:
+        response["frequency_ms"] = d.frequency_ms
+
+    return response
+
+
+def device_event_to_dict(event: smart_city_pb2.DeviceEvent) -> dict:
+    data = {
+        "event": _EVENT_NAMES.get(event.type, "unknown"),
+        "sequence": event.sequence,
+        "timestamp_ms": event.timestamp_ms,
+    }
+    if event.HasField("update"):
+        data["data"] = device_update_to_dict(event.update)
+    if event.HasField("device"):
+        data["device"] = device_info_to_dict(event.device)
+    data["id"] = event.update.device_id or event.device.device_id
+    data["type"] = smart_city_pb2.DeviceType.Name(event.update.type or event.device.type)
+    return data
+
+
+class Subscription:
+    """Fila de eventos de um cliente (SSE ou WebSocket)"""
+
+    def __init__(self, device_id_prefix: str = "", device_type: str = "", queue_size: int = DEFAULT_CLIENT_QUEUE_SIZE):
+        self.device_id_prefix = device_id_prefix
+        self.device_type = device_type
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def matches(self, event: dict) -> bool:
+        if self.device_id_prefix and not event["id"].startswith(self.device_id_prefix):
+            return False
+        if self.device_type and event["type"] != self.device_type:
+            return False
+        return True
+
+    def offer(self, event: dict):
+        if self.queue.full():
+            # Cliente lento: descartar o mais antigo em vez de travar os demais
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> dict | None:
+        """Próximo evento, ou None se nada chegar em `timeout` (hora do heartbeat)"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class DeviceEventHub:
+    """Uma assinatura com o gateway repassada a muitos clientes"""
+
+    def __init__(self, host: str, port: int, queue_size: int = DEFAULT_CLIENT_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self._subscribers: set[Subscription] = set()
+        self._listeners: list[Callable[[dict], None]] = []
+        self._task: asyncio.Task | None = None
+        self.connected = False
+        self.events_received = 0
+        self.reconnects = 0
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Chamado para cada evento recebido (ex.: invalidar o cache de respostas)"""
+        self._listeners.append(listener)
+
+    def subscribe(self, device_id_prefix: str = "", device_type: str = "") -> Subscription:
+        subscription = Subscription(device_id_prefix, device_type, self.queue_size)
+        self._subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._upstream_loop())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def _broadcast(self, event: dict):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"Erro no ouvinte de eventos: {e}")
+        for subscription in self._subscribers:
+            if subscription.matches(event):
+                subscription.offer(event)
+
+    async def _upstream_loop(self):
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                await self._consume_upstream()
+                delay = RECONNECT_MIN_DELAY
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Assinatura de eventos do gateway perdida: {e}; nova tentativa em {delay:.1f}s")
+            self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _consume_upstream(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            envelope = smart_city_pb2.SmartCityMessage(
+                message_type=smart_city_pb2.MessageType.CLIENT_REQUEST,
+                client_request=smart_city_pb2.ClientRequest(type=smart_city_pb2.ClientRequest.SUBSCRIBE)
+            )
+            writer.write(encode_delimited(envelope))
+            await writer.drain()
+
+            async for data in AsyncDelimitedReader(reader):
+                message = smart_city_pb2.SmartCityMessage()
+                message.ParseFromString(data)
+                if message.message_type == smart_city_pb2.MessageType.GATEWAY_RESPONSE:
+                    response = message.gateway_response
+                    if response.type != smart_city_pb2.GatewayResponse.ResponseType.SUBSCRIBED:
+                        raise ConnectionError(f"Gateway recusou a assinatura: {response.message}")
+                    self.connected = True
+                    logger.info("Assinatura de eventos do gateway ativa")
+                elif message.message_type == smart_city_pb2.MessageType.DEVICE_EVENT:
+                    self.events_received += 1
+                    self._broadcast(device_event_to_dict(message.device_event))
+        finally:
+            writer.close()
+
+    def get_metrics(self) -> dict:
+        return {
+            'connected': self.connected,
+            'subscribers': len(self._subscribers),
+            'events_received': self.events_received,
+            'reconnects': self.reconnects,
+            'dropped': sum(s.dropped for s in self._subscribers),
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+
+def format_sse(event: dict) -> str:
+    """Serializa um evento no formato text/event-stream"""
+    return f"id: {event['sequence']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
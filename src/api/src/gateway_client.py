@@ -0,0 +1,153 @@
+"""
+Cliente TCP asyncio do Gateway com conexões persistentes e multiplexadas
+
+Mantém um pequeno conjunto de sockets de longa duração com o gateway. Cada
+requisição recebe um request_id; uma tarefa leitora por conexão entrega cada
+GatewayResponse ao chamador correspondente, de modo que várias requisições
+podem estar em andamento na mesma conexão (pipelining).
+
+As respostas completam asyncio.Futures no event loop das rotas async da API,
+sem ocupar uma thread do pool do Uvicorn durante a ida e volta ao gateway, e
+cada requisição tem seu próprio prazo (conexão + envio + resposta).
+
+O prazo também segue para o gateway em ClientRequest.deadline_ms, para que
+ele (e a ponte gRPC, via deadline do RPC) desista do dispositivo quando a API
+já não vai mais esperar pela resposta.
+"""
+
+import asyncio
+import itertools
+import socket
+import time
+
+from src.proto import smart_city_pb2
+from src.proto.framing import AsyncDelimitedReader, encode_delimited
+
+DEADLINE_MARGIN = 0.05  # Segundos descontados do prazo enviado ao gateway (a resposta de "prazo esgotado" ainda chega a tempo)
+
+
+def build_request_envelope(request_msg: smart_city_pb2.ClientRequest, request_id: int,
+                           timeout: float | None = None) -> smart_city_pb2.SmartCityMessage:
+    request_msg.request_id = request_id
+    if timeout is not None and not request_msg.deadline_ms:
+        request_msg.deadline_ms = max(1, int((timeout - DEADLINE_MARGIN) * 1000))
+    return smart_city_pb2.SmartCityMessage(
+        message_type=smart_city_pb2.MessageType.CLIENT_REQUEST,
+        client_request=request_msg
+    )
+
+
+class AsyncGatewayConnection:
+    """Conexão persistente asyncio com o gateway, com respostas correlacionadas por request_id"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.pending: dict[int, asyncio.Future] = {}
+        self.closed = False
+        self.last_used = time.monotonic()
+        self.read_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> 'AsyncGatewayConnection':
+        reader, writer = await asyncio.open_connection(host, port)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer)
+
+    async def _read_loop(self):
+        error: Exception = ConnectionError("Conexão com o gateway encerrada")
+        try:
+            async for data in AsyncDelimitedReader(self.reader):
+                envelope = smart_city_pb2.SmartCityMessage()
+                envelope.ParseFromString(data)
+                future = self.pending.pop(envelope.gateway_response.request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(envelope)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if not self.closed:
+                error = ConnectionError(f"Conexão com o gateway encerrada: {e}")
+        finally:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    async def request(self, request_id: int, envelope: smart_city_pb2.SmartCityMessage) -> smart_city_pb2.SmartCityMessage:
+        if self.closed:
+            raise ConnectionError("Conexão com o gateway encerrada")
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self.writer.write(encode_delimited(envelope))
+            await self.writer.drain()
+            self.last_used = time.monotonic()
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def close(self):
+        self.closed = True
+        self.read_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (OSError, asyncio.CancelledError):
+            pass
+
+
+class AsyncGatewayClient:
+    """Pool de conexões asyncio persistentes com o gateway, usadas em round-robin"""
+
+    def __init__(self, host: str, port: int, pool_size: int = 4, timeout: float = 5, idle_timeout: float = 60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._connections: list[AsyncGatewayConnection | None] = [None] * pool_size
+        self._locks: list[asyncio.Lock] | None = None  # Criados no event loop do primeiro uso
+        self._next_slot = itertools.count()
+        self._next_request_id = itertools.count(1)
+
+    async def _get_connection(self, slot: int) -> AsyncGatewayConnection:
+        conn = self._connections[slot]
+        if conn is not None and not conn.closed and time.monotonic() - conn.last_used <= self.idle_timeout:
+            return conn
+        if self._locks is None:
+            self._locks = [asyncio.Lock() for _ in self._connections]
+        async with self._locks[slot]:
+            conn = self._connections[slot]
+            # O gateway fecha conexões ociosas; reabrir antes disso evita corrida
+            if conn is not None and (conn.closed or time.monotonic() - conn.last_used > self.idle_timeout):
+                await conn.close()
+                conn = None
+            if conn is None:
+                conn = await AsyncGatewayConnection.open(self.host, self.port)
+                self._connections[slot] = conn
+            return conn
+
+    async def _request(self, request_id: int, envelope: smart_city_pb2.SmartCityMessage) -> smart_city_pb2.SmartCityMessage:
+        slot = next(self._next_slot) % len(self._connections)
+        conn = await self._get_connection(slot)
+        return await conn.request(request_id, envelope)
+
+    async def request(self, request_msg: smart_city_pb2.ClientRequest, timeout: float | None = None) -> smart_city_pb2.SmartCityMessage:
+        """Envia uma ClientRequest e aguarda a resposta dentro do prazo (padrão: self.timeout)"""
+        if timeout is None:
+            timeout = self.timeout
+        request_id = next(self._next_request_id)
+        envelope = build_request_envelope(request_msg, request_id, timeout)
+        try:
+            return await asyncio.wait_for(self._request(request_id, envelope), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Gateway não respondeu em {timeout}s")
+
+    async def close(self):
+        for slot, conn in enumerate(self._connections):
+            if conn is not None:
+                await conn.close()
+            self._connections[slot] = None
@@ -0,0 +1,105 @@
+"""
+Cache de respostas da API com TTL, coalescência de requisições e LRU
+
+O dashboard consulta /devices e /device/data repetidamente, e cada chamada
+vira uma ida e volta ao gateway (e, para atuadores, gRPC + TCP até o relé).
+ResponseCache guarda o resultado de cada rota por alguns segundos:
+
+- TTL por entrada (cada rota escolhe o seu)
+- single-flight: requisições idênticas simultâneas aguardam a mesma carga em
+  vez de gerar várias idas ao gateway
+- limite de entradas com remoção da menos usada recentemente (LRU)
+- invalidate(): remove a entrada e impede que uma carga iniciada antes da
+  invalidação (ex.: antes de um comando) grave um resultado desatualizado;
+  invalidate_group() faz o mesmo para todas as chaves (tuplas) que começam
+  com o mesmo nome de rota, ex.: todas as páginas/filtros de /devices
+
+Feito para o event loop da API: não usa locks, todas as operações acontecem
+na mesma thread.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class ResponseCache:
+    """Cache em memória de resultados de rotas async"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, tuple[float, Any]]' = OrderedDict()  # chave -> (expira_em, valor)
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._generation: dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: Hashable, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Retorna o valor em cache ou executa `loader` uma única vez para todos que pedirem a mesma chave"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            # shield: o cancelamento de um cliente não cancela a carga dos demais
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        generation = self._generation.get(key, 0)
+        future = asyncio.ensure_future(loader())
+        self._inflight[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        # Não gravar se a chave foi invalidada durante a carga
+        if self._generation.get(key, 0) == generation:
+            self._store(key, value, ttl)
+        return value
+
+    def _store(self, key: Hashable, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Descarta a entrada e qualquer carga em andamento para a chave"""
+        self.invalidations += 1
+        self._generation[key] = self._generation.get(key, 0) + 1
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def invalidate_group(self, group: Hashable):
+        """Invalida todas as chaves-tupla cujo primeiro elemento é `group`"""
+        for key in [k for k in list(self._entries) + list(self._inflight) if isinstance(k, tuple) and k[:1] == (group,)]:
+            self.invalidate(key)
+
+    def clear(self):
+        for key in list(self._entries) + list(self._inflight):
+            self.invalidate(key)
+
+    def get_metrics(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
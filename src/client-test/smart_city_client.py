@@ -79,6 +79,26 @@ class SmartCityRestClient:
             logger.error(f"Erro ao enviar comando: {e}")
             return False
 
+    def send_bulk_command(self, command_type, command_value="", **targets):
+        """Um único pedido à API; o gateway executa o comando nos dispositivos em paralelo"""
+        try:
+            resp = requests.post(
+                f"{self.api_url}/devices/command",
+                json={"command": command_type, "value": command_value, **targets}
+            )
+            resp.raise_for_status()
+            result = resp.json()
+            if not result["results"]:
+                logger.info("Nenhum dispositivo encontrado.")
+                return False
+            for r in result["results"]:
+                logger.info(f"{r['device_id']}: {r['status']} em {r['latency_ms']} ms - {r['message']}")
+            logger.info(result["message"])
+            return result["status"] == "SUCCESS"
+        except Exception as e:
+            logger.error(f"Erro ao enviar comando em massa: {e}")
+            return False
+
     def get_device_status(self, device_id):
         try:
             resp = requests.get(f"{self.api_url}/device/data", params={"device_id": device_id})
@@ -128,35 +148,9 @@ def relay_menu(client):
             else:
                 logger.warning("ID do relé não pode ser vazio.")
         elif choice == '4':
-            try:
-                resp = requests.get(f"{API_URL}/devices")
-                resp.raise_for_status()
-                devices = resp.json()
-                relays = [d for d in devices if d['type'] == "RELAY"]
-                if not relays:
-                    logger.info("Nenhum atuador do tipo RELAY encontrado.")
-                else:
-                    for relay in relays:
-                        logger.info(f"Enviando TURN_ON para {relay['id']}...")
-                        client.send_device_command(relay['id'], "TURN_ON")
-                    logger.info(f"Comando TURN_ON enviado para {len(relays)} atuadores.")
-            except Exception as e:
-                logger.error("Não foi possível obter a lista de dispositivos.")
+            client.send_bulk_command("TURN_ON", type="RELAY")
         elif choice == '5':
-            try:
-                resp = requests.get(f"{API_URL}/devices")
-                resp.raise_for_status()
-                devices = resp.json()
-                relays = [d for d in devices if d['type'] == "RELAY"]
-                if not relays:
-                    logger.info("Nenhum atuador do tipo RELAY encontrado.")
-                else:
-                    for relay in relays:
-                        logger.info(f"Enviando TURN_OFF para {relay['id']}...")
-                        client.send_device_command(relay['id'], "TURN_OFF")
-                    logger.info(f"Comando TURN_OFF enviado para {len(relays)} atuadores.")
-            except Exception as e:
-                logger.error("Não foi possível obter a lista de dispositivos.")
+            client.send_bulk_command("TURN_OFF", type="RELAY")
         elif choice == '6':
             break
         else:
@@ -22,6 +22,8 @@ public class RelayActuator {
 
     private static final String MULTICAST_GROUP = "224.1.1.1";
     private static final int MULTICAST_PORT = 5007;
+    // Conexão TCP ociosa é fechada após este tempo (a ponte gRPC reaproveita conexões)
+    private static final int TCP_IDLE_TIMEOUT_MS = 120000;
 
     private String deviceId;
     private SmartCity.DeviceStatus currentStatus;
@@ -133,44 +135,15 @@ public class RelayActuator {
     private void handleTcpCommand(Socket clientSocket) {
         try (InputStream input = clientSocket.getInputStream();
              OutputStream output = clientSocket.getOutputStream()) {
-            SmartCity.SmartCityMessage envelope = SmartCity.SmartCityMessage.parseDelimitedFrom(input);
-            boolean responded = false;
-            if (envelope != null && envelope.hasClientRequest()) {
-                SmartCity.ClientRequest req = envelope.getClientRequest();
-                if (req.hasCommand()) {
-                    SmartCity.DeviceCommand command = req.getCommand();
-                    LOGGER.info("Relé Atuador " + deviceId + " recebeu comando TCP: " + command.getCommandType());
-                    SmartCity.DeviceStatus oldStatus = currentStatus;
-                    if (command.getCommandType().equals("TURN_ON") && currentStatus == SmartCity.DeviceStatus.OFF) {
-                        currentStatus = SmartCity.DeviceStatus.ON;
-                        LOGGER.info("RELÉ " + deviceId + " LIGADO!");
-                    } else if (command.getCommandType().equals("TURN_OFF") && currentStatus == SmartCity.DeviceStatus.ON) {
-                        currentStatus = SmartCity.DeviceStatus.OFF;
-                        LOGGER.info("RELÉ " + deviceId + " DESLIGADO.");
-                    }
-                    if (currentStatus != oldStatus) {
-                        sendStatusUpdate();
-                    }
-                    responded = true;
-                }
-                // Sempre responde com DeviceUpdate, seja comando ou GET_DEVICE_STATUS
-                if (responded || req.getType() == SmartCity.ClientRequest.RequestType.GET_DEVICE_STATUS) {
-                    SmartCity.DeviceUpdate statusUpdate = SmartCity.DeviceUpdate.newBuilder()
-                            .setDeviceId(deviceId)
-                            .setType(SmartCity.DeviceType.RELAY)
-                            .setCurrentStatus(currentStatus)
-                            .build();
-                    SmartCity.SmartCityMessage responseEnvelope = SmartCity.SmartCityMessage.newBuilder()
-                            .setMessageType(SmartCity.MessageType.DEVICE_UPDATE)
-                            .setDeviceUpdate(statusUpdate)
-                            .build();
-                    responseEnvelope.writeDelimitedTo(output);
-                    output.flush();
-                    LOGGER.info("Relé Atuador " + deviceId + " respondeu status via TCP.");
-                }
-            } else {
-                LOGGER.warning("Envelope SmartCityMessage inválido ou sem client request recebido para o relé " + deviceId);
+            clientSocket.setSoTimeout(TCP_IDLE_TIMEOUT_MS);
+            clientSocket.setTcpNoDelay(true);
+            // Atende várias mensagens na mesma conexão até o cliente fechá-la
+            SmartCity.SmartCityMessage envelope;
+            while ((envelope = SmartCity.SmartCityMessage.parseDelimitedFrom(input)) != null) {
+                handleTcpMessage(envelope, output);
             }
+        } catch (SocketTimeoutException e) {
+            LOGGER.fine("Conexão TCP ociosa encerrada no relé " + deviceId);
         } catch (IOException e) {
             LOGGER.log(Level.WARNING, "Erro ao lidar com comando TCP: " + e.getMessage(), e);
         } finally {
@@ -180,6 +153,46 @@ public class RelayActuator {
         }
     }
 
+    private void handleTcpMessage(SmartCity.SmartCityMessage envelope, OutputStream output) throws IOException {
+        boolean responded = false;
+        if (envelope.hasClientRequest()) {
+            SmartCity.ClientRequest req = envelope.getClientRequest();
+            if (req.hasCommand()) {
+                SmartCity.DeviceCommand command = req.getCommand();
+                LOGGER.info("Relé Atuador " + deviceId + " recebeu comando TCP: " + command.getCommandType());
+                SmartCity.DeviceStatus oldStatus = currentStatus;
+                if (command.getCommandType().equals("TURN_ON") && currentStatus == SmartCity.DeviceStatus.OFF) {
+                    currentStatus = SmartCity.DeviceStatus.ON;
+                    LOGGER.info("RELÉ " + deviceId + " LIGADO!");
+                } else if (command.getCommandType().equals("TURN_OFF") && currentStatus == SmartCity.DeviceStatus.ON) {
+                    currentStatus = SmartCity.DeviceStatus.OFF;
+                    LOGGER.info("RELÉ " + deviceId + " DESLIGADO.");
+                }
+                if (currentStatus != oldStatus) {
+                    sendStatusUpdate();
+                }
+                responded = true;
+            }
+            // Sempre responde com DeviceUpdate, seja comando ou GET_DEVICE_STATUS
+            if (responded || req.getType() == SmartCity.ClientRequest.RequestType.GET_DEVICE_STATUS) {
+                SmartCity.DeviceUpdate statusUpdate = SmartCity.DeviceUpdate.newBuilder()
+                        .setDeviceId(deviceId)
+                        .setType(SmartCity.DeviceType.RELAY)
+                        .setCurrentStatus(currentStatus)
+                        .build();
+                SmartCity.SmartCityMessage responseEnvelope = SmartCity.SmartCityMessage.newBuilder()
+                        .setMessageType(SmartCity.MessageType.DEVICE_UPDATE)
+                        .setDeviceUpdate(statusUpdate)
+                        .build();
+                responseEnvelope.writeDelimitedTo(output);
+                output.flush();
+                LOGGER.info("Relé Atuador " + deviceId + " respondeu status via TCP.");
+            }
+        } else {
+            LOGGER.warning("Envelope SmartCityMessage inválido ou sem client request recebido para o relé " + deviceId);
+        }
+    }
+
     private void sendStatusUpdate() {
         if (gatewayIp == null) {
             LOGGER.fine("Relé Atuador " + deviceId + ": Gateway ainda não descoberto, não enviando status.");
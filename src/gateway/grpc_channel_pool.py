@@ -0,0 +1,174 @@
+"""
+Canal gRPC compartilhado do Gateway
+
+Mantém um único canal HTTP/2 de longa duração com o servidor ponte gRPC,
+reutilizado por todas as threads do gateway, em vez de abrir um canal (e
+fazer o handshake) a cada comando de atuador.
+
+- Keepalive HTTP/2 para detectar conexões mortas sem tráfego
+- Backoff exponencial de reconexão configurado no próprio canal
+- Acompanhamento do estado de conectividade (saúde do canal)
+- Métricas de reutilização do canal e de latência por RPC
+"""
+
+import collections
+import logging
+import threading
+import time
+
+import grpc
+
+logger = logging.getLogger(__name__)
+
+# Opções do canal: keepalive e backoff de reconexão
+DEFAULT_CHANNEL_OPTIONS = [
+    # A ponte precisa aceitar pings sem chamadas (GRPC_SERVER_OPTIONS em actuator_bridge_server.py)
+    ('grpc.keepalive_time_ms', 30000),           # Ping a cada 30 s sem tráfego
+    ('grpc.keepalive_timeout_ms', 10000),        # Sem resposta ao ping em 10 s = conexão morta
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.initial_reconnect_backoff_ms', 500),
+    ('grpc.min_reconnect_backoff_ms', 500),
+    ('grpc.max_reconnect_backoff_ms', 10000),
+]
+
+LATENCY_WINDOW = 1024  # Amostras mantidas por método para os percentis
+
+
+class RpcLatencyStats:
+    """Latências recentes de um método gRPC"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.samples = collections.deque(maxlen=window)
+
+    def record(self, elapsed_ms, ok):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.samples.append(elapsed_ms)
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': self.total_ms / self.calls if self.calls else 0.0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': ordered[-1] if ordered else 0.0,
+        }
+
+
+class GrpcChannelPool:
+    """Canal e stub gRPC compartilhados, criados sob demanda e recriados se o canal for fechado"""
+
+    def __init__(self, target, stub_class, options=None):
+        self.target = target
+        self.stub_class = stub_class
+        self.options = options if options is not None else DEFAULT_CHANNEL_OPTIONS
+        self._lock = threading.Lock()
+        self._channel = None
+        self._stub = None
+        self._state = None
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.channels_created = 0
+        self.state_changes = 0
+
+    def _on_state_change(self, state):
+        if state != self._state:
+            previous = self._state
+            self._state = state
+            self.state_changes += 1
+            level = logging.WARNING if state == grpc.ChannelConnectivity.TRANSIENT_FAILURE else logging.INFO
+            logger.log(level, f"Canal gRPC {self.target}: {previous.name if previous else 'NOVO'} -> {state.name}")
+
+    def _open(self):
+        channel = grpc.insecure_channel(self.target, options=self.options)
+        channel.subscribe(self._on_state_change, try_to_connect=True)
+        self._channel = channel
+        self._stub = self.stub_class(channel)
+        self.channels_created += 1
+        logger.info(f"Canal gRPC aberto para {self.target} (canais criados: {self.channels_created})")
+
+    def get_stub(self):
+        """Retorna o stub compartilhado, abrindo o canal na primeira chamada"""
+        stub = self._stub
+        if stub is not None and self._state != grpc.ChannelConnectivity.SHUTDOWN:
+            return stub
+        with self._lock:
+            if self._stub is None or self._state == grpc.ChannelConnectivity.SHUTDOWN:
+                self._close_locked()
+                self._open()
+            return self._stub
+
+    def call(self, method_name, request, timeout=None):
+        """Executa um RPC unário no stub compartilhado registrando a latência"""
+        stub = self.get_stub()
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = getattr(stub, method_name)(request, timeout=timeout)
+            ok = True
+            return response
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._stats_lock:
+                stats = self._stats.get(method_name)
+                if stats is None:
+                    stats = self._stats[method_name] = RpcLatencyStats()
+                stats.record(elapsed_ms, ok)
+
+    def is_healthy(self):
+        """Canal aberto e sem falha de conexão em andamento"""
+        return self._state in (grpc.ChannelConnectivity.READY, grpc.ChannelConnectivity.IDLE)
+
+    def wait_until_ready(self, timeout):
+        """Bloqueia até o canal estar pronto; retorna False se expirar"""
+        self.get_stub()
+        try:
+            grpc.channel_ready_future(self._channel).result(timeout=timeout)
+            return True
+        except grpc.FutureTimeoutError:
+            return False
+
+    def get_metrics(self):
+        """Métricas de reutilização do canal e de latência por método"""
+        with self._stats_lock:
+            methods = {name: stats.snapshot() for name, stats in self._stats.items()}
+        total_calls = sum(m['calls'] for m in methods.values())
+        return {
+            'target': self.target,
+            'state': self._state.name if self._state else 'NOT_CONNECTED',
+            'channels_created': self.channels_created,
+            'state_changes': self.state_changes,
+            'rpc_calls': total_calls,
+            'channel_reuse_ratio': 1 - self.channels_created / total_calls if total_calls else 0.0,
+            'methods': methods,
+        }
+
+    def _close_locked(self):
+        if self._channel is not None:
+            try:
+                self._channel.unsubscribe(self._on_state_change)
+                self._channel.close()
+            except Exception:
+                pass
+        self._channel = None
+        self._stub = None
+        self._state = None
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
@@ -0,0 +1,435 @@
+"""
+Histórico de leituras de sensores (série temporal somente de anexação)
+
+Cada série (dispositivo, métrica) é guardada em arquivos de segmento de
+capacidade fixa, mapeados em memória (mmap):
+
+    <diretório>/<device_id>/<métrica>/<início_ms>.seg
+
+    [cabeçalho 16 B][timestamps: capacidade x float64][valores: capacidade x float64]...
+
+(Leituras brutas têm uma coluna de valores; os agregados de rollup.py usam o
+mesmo formato com várias colunas: mínimo, máximo, soma e contagem.)
+
+As colunas são contíguas, então as anexações copiam lotes inteiros com uma
+atribuição de fatia (array('d') -> memoryview) e as consultas por intervalo
+fazem busca binária direto na coluna de timestamps, sem desserializar nada.
+O contador de amostras no cabeçalho é escrito depois dos dados, de modo que
+outro processo (a API) pode ler os mesmos arquivos com segurança enquanto o
+gateway escreve. Um segmento cheio é selado e nunca mais alterado; a retenção
+apaga segmentos inteiros cujas amostras são todas mais antigas que o limite.
+
+O módulo usa apenas a biblioteca padrão: o gateway escreve com HistoryStore e
+a API abre o mesmo diretório com HistoryStore(..., readonly=True).
+"""
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+SEGMENT_MAGIC = b'SCTS'
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = '.seg'
+HEADER = struct.Struct('<4sHHII')  # magic, versão, colunas de valores, capacidade, contagem
+COUNT_OFFSET = 12
+
+DEFAULT_SEGMENT_CAPACITY = 4096  # Amostras por segmento (64 KB por arquivo)
+DEFAULT_RETENTION = 7 * 24 * 3600  # Segundos de histórico mantidos
+DEFAULT_MAX_OPEN_SEGMENTS = 1024  # Segmentos ativos mapeados ao mesmo tempo (LRU)
+DEFAULT_QUERY_LIMIT = 10000
+
+# Campos numéricos das leituras (chaves de last_data) guardados no histórico
+SENSOR_METRICS = (
+    'temperature', 'humidity', 'air_quality_index',
+    'current', 'voltage', 'power',
+    'frequency_ms', 'frame_rate', 'target_temperature',
+)
+
+
+def sample_values(data: dict) -> Dict[str, float]:
+    """Extrai as métricas numéricas de uma leitura de sensor"""
+    values = {}
+    for metric in SENSOR_METRICS:
+        value = data.get(metric)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[metric] = float(value)
+    return values
+
+
+def group_by_series(samples: Iterable[Tuple[str, float, Dict[str, float]]]) -> Dict[Tuple[str, str], Tuple[array, array]]:
+    """Agrupa amostras (device_id, timestamp, {métrica: valor}) em colunas por série
+
+    Os timestamps de cada série saem em ordem: uma leitura mais antiga que a
+    anterior do lote (relógios dos sensores) fica com o instante da anterior.
+    """
+    columns: Dict[Tuple[str, str], Tuple[array, array]] = {}
+    for device_id, timestamp, values in samples:
+        for metric, value in values.items():
+            key = (device_id, metric)
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = (array('d'), array('d'))
+            elif timestamp < column[0][-1]:
+                timestamp = column[0][-1]
+            column[0].append(timestamp)
+            column[1].append(value)
+    return columns
+
+
+def _escape(name: str) -> str:
+    # quote() não escapa '.', o que permitiria '..' como nome de diretório
+    return quote(name, safe='').replace('.', '%2E')
+
+
+def _segment_name(start: float) -> str:
+    return f"{int(start * 1000):016d}{SEGMENT_SUFFIX}"
+
+
+def _segment_start(filename: str) -> float:
+    return int(filename[:-len(SEGMENT_SUFFIX)]) / 1000
+
+
+def _segment_size(capacity: int, columns: int) -> int:
+    return HEADER.size + capacity * 8 * (1 + columns)
+
+
+class Segment:
+    """Arquivo de segmento mapeado em memória com colunas de timestamps e valores"""
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        with open(path, 'r+b' if writable else 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, version, columns, capacity, _ = HEADER.unpack_from(self.mm, 0)
+        if (magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or not columns
+                or len(self.mm) != _segment_size(capacity, columns)):
+            self.mm.close()
+            raise ValueError(f"Segmento de histórico inválido: {path}")
+        self.capacity = capacity
+        self._view = memoryview(self.mm)
+        size = capacity * 8
+        self.timestamps = self._view[HEADER.size:HEADER.size + size].cast('d')
+        self.columns = [
+            self._view[HEADER.size + size * (i + 1):HEADER.size + size * (i + 2)].cast('d')
+            for i in range(columns)
+        ]
+        self.values = self.columns[0]
+
+    @classmethod
+    def create(cls, path: str, capacity: int, columns: int = 1) -> 'Segment':
+        with open(path, 'wb') as f:
+            f.truncate(_segment_size(capacity, columns))
+            f.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, columns, capacity, 0))
+        return cls(path, writable=True)
+
+    @property
+    def count(self) -> int:
+        return struct.unpack_from('<I', self.mm, COUNT_OFFSET)[0]
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def last_timestamp(self) -> Optional[float]:
+        count = self.count
+        return self.timestamps[count - 1] if count else None
+
+    def append(self, timestamps: array, columns: List[array], offset: int = 0) -> int:
+        """Copia linhas a partir de `offset` (uma array por coluna de valores); retorna quantas couberam"""
+        count = self.count
+        n = min(len(timestamps) - offset, self.capacity - count)
+        if n <= 0:
+            return 0
+        self.timestamps[count:count + n] = timestamps[offset:offset + n]
+        for target, source in zip(self.columns, columns):
+            target[count:count + n] = source[offset:offset + n]
+        # Publicar a contagem só depois dos dados (leitores concorrentes)
+        struct.pack_into('<I', self.mm, COUNT_OFFSET, count + n)
+        return n
+
+    def set_last(self, row):
+        """Sobrescreve os valores da última linha (agregado ainda em andamento)"""
+        index = self.count - 1
+        for column, value in zip(self.columns, row):
+            column[index] = value
+
+    def range(self, start: float, end: float) -> Tuple[List[float], List[List[float]]]:
+        """Linhas com start <= timestamp <= end: (timestamps, [valores de cada coluna])"""
+        count = self.count
+        lo = bisect.bisect_left(self.timestamps, start, 0, count)
+        hi = bisect.bisect_right(self.timestamps, end, lo, count)
+        return self.timestamps[lo:hi].tolist(), [column[lo:hi].tolist() for column in self.columns]
+
+    def close(self):
+        self.timestamps.release()
+        for column in self.columns:
+            column.release()
+        self._view.release()
+        self.mm.close()
+
+
+class HistoryStore:
+    """Armazenamento de séries temporais por dispositivo e métrica"""
+
+    def __init__(self, directory: str, segment_capacity: int = DEFAULT_SEGMENT_CAPACITY,
+                 retention: float = DEFAULT_RETENTION, max_open_segments: int = DEFAULT_MAX_OPEN_SEGMENTS,
+                 readonly: bool = False, columns: int = 1):
+        self.directory = directory
+        self.segment_capacity = segment_capacity
+        self.columns = columns
+        self.retention = retention
+        self.max_open_segments = max_open_segments
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._active: 'OrderedDict[Tuple[str, str], Segment]' = OrderedDict()
+        self.samples_written = 0
+        self.segments_created = 0
+        self.segments_removed = 0
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+
+    def _series_dir(self, device_id: str, metric: str) -> str:
+        return os.path.join(self.directory, _escape(device_id), _escape(metric))
+
+    @staticmethod
+    def _list_segments(series_dir: str) -> List[str]:
+        try:
+            return sorted(name for name in os.listdir(series_dir) if name.endswith(SEGMENT_SUFFIX))
+        except FileNotFoundError:
+            return []
+
+    # === Escrita ===
+    def _cache(self, key: Tuple[str, str], segment: Segment):
+        self._active[key] = segment
+        while len(self._active) > self.max_open_segments:
+            _, evicted = self._active.popitem(last=False)
+            evicted.close()
+
+    def _latest_segment(self, key: Tuple[str, str]) -> Optional[Segment]:
+        """Último segmento da série (mesmo se cheio), retomado do disco se necessário"""
+        segment = self._active.get(key)
+        if segment is not None:
+            self._active.move_to_end(key)
+            return segment
+        names = self._list_segments(self._series_dir(*key))
+        if not names:
+            return None
+        # Retomar o último segmento da série (ex.: depois de reiniciar o gateway)
+        try:
+            segment = Segment(os.path.join(self._series_dir(*key), names[-1]), writable=True)
+        except ValueError:
+            return None  # Segmento corrompido (ex.: queda durante a criação): começar outro
+        self._cache(key, segment)
+        return segment
+
+    def _writable_segment(self, key: Tuple[str, str], first_timestamp: float) -> Segment:
+        segment = self._latest_segment(key)
+        if segment is not None and not segment.full:
+            return segment
+        if segment is not None:
+            # Segmento cheio: selar e abrir o próximo
+            del self._active[key]
+            segment.close()
+
+        series_dir = self._series_dir(*key)
+        names = self._list_segments(series_dir)
+        os.makedirs(series_dir, exist_ok=True)
+        start = first_timestamp
+        if names:
+            start = max(start, _segment_start(names[-1]) + 0.001)
+        segment = Segment.create(os.path.join(series_dir, _segment_name(start)), self.segment_capacity, self.columns)
+        self.segments_created += 1
+        self._cache(key, segment)
+        return segment
+
+    def _append_series(self, key: Tuple[str, str], timestamps: array, values: array):
+        offset = 0
+        while offset < len(timestamps):
+            segment = self._writable_segment(key, timestamps[offset])
+            last = segment.last_timestamp()
+            if last is not None and timestamps[offset] < last:
+                # Série somente de anexação: relógio voltou, manter a ordem
+                for i in range(offset, len(timestamps)):
+                    if timestamps[i] < last:
+                        timestamps[i] = last
+            offset += segment.append(timestamps, [values], offset)
+
+    def append_many(self, samples: Iterable[Tuple[str, float, Dict[str, float]]]) -> int:
+        """Anexa amostras (device_id, timestamp, {métrica: valor}); retorna quantos valores foram gravados"""
+        if self.readonly:
+            raise PermissionError("HistoryStore aberto somente para leitura")
+        columns = group_by_series(samples)
+        written = 0
+        with self._lock:
+            for key, (timestamps, values) in columns.items():
+                self._append_series(key, timestamps, values)
+                written += len(timestamps)
+            self.samples_written += written
+        return written
+
+    def append(self, device_id: str, timestamp: float, values: Dict[str, float]) -> int:
+        return self.append_many([(device_id, timestamp, values)])
+
+    def upsert_rows(self, rows: Iterable[Tuple[str, str, float, Tuple[float, ...]]]):
+        """Grava linhas (device_id, métrica, timestamp, valores) de séries com várias colunas.
+
+        Se o timestamp for igual ao da última linha da série, ela é sobrescrita
+        (agregado em andamento); caso contrário a linha é anexada.
+        """
+        if self.readonly:
+            raise PermissionError("HistoryStore aberto somente para leitura")
+        with self._lock:
+            for device_id, metric, timestamp, row in rows:
+                key = (device_id, metric)
+                segment = self._latest_segment(key)
+                if segment is not None and segment.last_timestamp() == timestamp:
+                    segment.set_last(row)
+                    continue
+                segment = self._writable_segment(key, timestamp)
+                segment.append(array('d', (timestamp,)), [array('d', (value,)) for value in row])
+                self.samples_written += 1
+
+    def last_row(self, device_id: str, metric: str) -> Optional[Tuple[float, Tuple[float, ...]]]:
+        """Última linha gravada de uma série: (timestamp, valores), ou None"""
+        with self._lock:
+            segment = self._latest_segment((device_id, metric))
+            if segment is None or not segment.count:
+                return None
+            index = segment.count - 1
+            return segment.timestamps[index], tuple(column[index] for column in segment.columns)
+
+    # === Leitura ===
+    def devices(self) -> List[str]:
+        try:
+            return sorted(unquote(name) for name in os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+
+    def metrics(self, device_id: str) -> List[str]:
+        try:
+            return sorted(unquote(name) for name in os.listdir(os.path.join(self.directory, _escape(device_id))))
+        except FileNotFoundError:
+            return []
+
+    def query(self, device_id: str, metric: str, start: float, end: float,
+              limit: int = DEFAULT_QUERY_LIMIT) -> Tuple[List[float], List[float]]:
+        """Amostras de uma série no intervalo [start, end], em ordem cronológica (até `limit`)"""
+        timestamps, columns = self.query_rows(device_id, metric, start, end, limit)
+        return timestamps, columns[0] if columns else []
+
+    def query_rows(self, device_id: str, metric: str, start: float, end: float,
+                   limit: int = DEFAULT_QUERY_LIMIT) -> Tuple[List[float], List[List[float]]]:
+        """Linhas de uma série no intervalo [start, end]: (timestamps, [valores de cada coluna])"""
+        series_dir = self._series_dir(device_id, metric)
+        names = self._list_segments(series_dir)
+        starts = [_segment_start(name) for name in names]
+        timestamps: List[float] = []
+        columns: List[List[float]] = []
+        for i, name in enumerate(names):
+            if starts[i] > end:
+                break
+            # Um segmento cobre [seu início, início do próximo)
+            if i + 1 < len(names) and starts[i + 1] < start:
+                continue
+            try:
+                segment = Segment(os.path.join(series_dir, name))
+            except (FileNotFoundError, ValueError):
+                continue  # Removido pela retenção ou ainda sendo criado
+            try:
+                ts, cols = segment.range(start, end)
+            finally:
+                segment.close()
+            timestamps.extend(ts)
+            if not columns:
+                columns = [[] for _ in cols]
+            for target, source in zip(columns, cols):
+                target.extend(source)
+            if len(timestamps) >= limit:
+                del timestamps[limit:]
+                for column in columns:
+                    del column[limit:]
+                break
+        return timestamps, columns
+
+    # === Retenção ===
+    def enforce_retention(self, now: Optional[float] = None) -> int:
+        """Apaga segmentos cujas amostras são todas anteriores a now - retention"""
+        if now is None:
+            now = time.time()
+        cutoff = now - self.retention
+        removed = 0
+        for device_name in self._safe_listdir(self.directory):
+            device_dir = os.path.join(self.directory, device_name)
+            for metric_name in self._safe_listdir(device_dir):
+                series_dir = os.path.join(device_dir, metric_name)
+                key = (unquote(device_name), unquote(metric_name))
+                names = self._list_segments(series_dir)
+                for i, name in enumerate(names):
+                    path = os.path.join(series_dir, name)
+                    if i + 1 < len(names):
+                        expired = _segment_start(names[i + 1]) <= cutoff
+                    else:
+                        expired = self._last_timestamp(path) < cutoff
+                    if not expired:
+                        break
+                    with self._lock:
+                        active = self._active.get(key)
+                        if active is not None and active.path == path:
+                            del self._active[key]
+                            active.close()
+                        os.remove(path)
+                    removed += 1
+                with self._lock:
+                    self._remove_if_empty(series_dir)
+            with self._lock:
+                self._remove_if_empty(device_dir)
+        self.segments_removed += removed
+        return removed
+
+    @staticmethod
+    def _last_timestamp(path: str) -> float:
+        try:
+            segment = Segment(path)
+        except (FileNotFoundError, ValueError):
+            return math.inf
+        try:
+            last = segment.last_timestamp()
+        finally:
+            segment.close()
+        return last if last is not None else math.inf
+
+    @staticmethod
+    def _safe_listdir(path: str) -> List[str]:
+        try:
+            return os.listdir(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    @staticmethod
+    def _remove_if_empty(path: str):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def get_metrics(self) -> dict:
+        return {
+            'samples_written': self.samples_written,
+            'segments_created': self.segments_created,
+            'segments_removed': self.segments_removed,
+            'open_segments': len(self._active),
+        }
+
+    def close(self):
+        with self._lock:
+            for segment in self._active.values():
+                segment.close()
+            self._active.clear()
@@ -0,0 +1,157 @@
+"""
+Pipeline de ingestão de dados de sensores MQTT
+
+O callback on_message do paho roda na única thread de rede do cliente MQTT;
+qualquer trabalho pesado nele atrasa todas as mensagens seguintes. Aqui o
+callback apenas enfileira o payload bruto numa fila limitada, e um conjunto de
+workers retira as mensagens em micro-lotes e as aplica de uma vez (um lock por
+partição do registro por lote, em vez de um por mensagem).
+
+Cada worker tem sua própria fila: submit(item, key) envia as mensagens de uma
+mesma chave (o sensor) sempre para a mesma fila, então as leituras de um
+sensor são aplicadas na ordem de chegada mesmo com vários workers.
+
+Quando a fila (de uma partição) enche, a política de descarte decide o que acontece:
+- "drop_oldest": descarta a leitura mais antiga da fila (padrão; para
+  telemetria a leitura mais nova é a mais útil)
+- "drop_newest": descarta a leitura que está chegando
+- "block": bloqueia a thread do paho por até block_timeout segundos,
+  propagando a contrapressão até o broker
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class IngestPipeline:
+    """Filas limitadas (uma por worker) + workers que processam as mensagens em micro-lotes"""
+
+    def __init__(self, apply_batch: Callable[[List[Any]], None], workers: int = 2, queue_size: int = 10000,
+                 batch_size: int = 256, drop_policy: str = DROP_OLDEST, block_timeout: float = 0.5,
+                 name: str = "ingest"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Política de descarte inválida: {drop_policy} (use {', '.join(DROP_POLICIES)})")
+        self.apply_batch = apply_batch
+        self.workers = workers
+        self.batch_size = batch_size
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.name = name
+        self.queue_size = queue_size
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._stats_lock = threading.Lock()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_batch = 0
+        self.max_depth = 0
+
+    def start(self):
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, args=(self._queues[i],), name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Pipeline de ingestão '{self.name}' iniciado: {self.workers} workers, fila de {self.queue_size}, "
+                    f"lotes de até {self.batch_size}, política {self.drop_policy}")
+
+    def stop(self, timeout: float = 2.0):
+        self._running = False
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, item, key=None) -> bool:
+        """Enfileira uma mensagem (chamado na thread do paho); False se foi descartada
+
+        Mensagens com a mesma `key` vão para a mesma partição e são aplicadas em ordem.
+        """
+        self.received += 1
+        partition = self._queues[hash(key) % self.workers]
+        try:
+            if self.drop_policy == BLOCK:
+                partition.put(item, timeout=self.block_timeout)
+            else:
+                partition.put_nowait(item)
+        except queue.Full:
+            if self.drop_policy != DROP_OLDEST:
+                self._count_drop()
+                return False
+            # Abrir espaço descartando a leitura mais antiga
+            try:
+                partition.get_nowait()
+                self._count_drop()
+            except queue.Empty:
+                pass
+            try:
+                partition.put_nowait(item)
+            except queue.Full:
+                self._count_drop()
+                return False
+        depth = partition.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def _count_drop(self):
+        with self._stats_lock:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Ingestão '{self.name}' saturada: {self.dropped} mensagens descartadas ({self.drop_policy})")
+
+    def _worker(self, partition):
+        while self._running:
+            try:
+                first = partition.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            # Esvaziar o que já está na fila, até o tamanho do lote
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(partition.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.apply_batch(batch)
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                logger.error(f"Erro ao processar lote de {len(batch)} mensagens em '{self.name}': {e}")
+            with self._stats_lock:
+                self.processed += len(batch)
+                self.batches += 1
+                if len(batch) > self.max_batch:
+                    self.max_batch = len(batch)
+
+    def get_metrics(self):
+        """Contadores de vazão e de contrapressão"""
+        with self._stats_lock:
+            return {
+                'received': self.received,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'batches': self.batches,
+                'avg_batch': self.processed / self.batches if self.batches else 0.0,
+                'max_batch': self.max_batch,
+                'queue_depth': sum(partition.qsize() for partition in self._queues),
+                'max_queue_depth': self.max_depth,  # Maior profundidade de uma partição
+                'queue_size': self.queue_size,
+                'drop_policy': self.drop_policy,
+            }
@@ -0,0 +1,128 @@
+"""
+Correlação de comandos MQTT com suas respostas
+
+Cada comando publicado para um sensor leva um request_id; a resposta chega
+depois em smart_city/commands/sensors/<id>/response. Em vez de guardar as
+respostas num dicionário consultado periodicamente, quem envia o comando
+registra um futuro para o request_id e o handler MQTT o completa diretamente
+quando a resposta chega, acordando o chamador na hora.
+
+Funciona com threads (concurrent.futures.Future) e com asyncio
+(asyncio.Future, completado de forma thread-safe a partir da thread do paho).
+Entradas abandonadas são expiradas por um heap de prazos com remoção
+preguiçosa, de modo que cada limpeza custa O(expirados) e não O(pendentes).
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _PendingEntry:
+    __slots__ = ('future', 'loop', 'deadline')
+
+    def __init__(self, future, loop, deadline):
+        self.future = future
+        self.loop = loop
+        self.deadline = deadline
+
+
+class PendingRequests:
+    """Tabela request_id -> futuro aguardando resposta"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._deadlines = []  # heap de (prazo, seq, request_id, entrada)
+        self._seq = itertools.count()
+        self.completed = 0
+        self.expired = 0
+        self.late_responses = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _add(self, request_id, future, loop, timeout):
+        entry = _PendingEntry(future, loop, time.monotonic() + timeout)
+        with self._lock:
+            self._pending[request_id] = entry
+            heapq.heappush(self._deadlines, (entry.deadline, next(self._seq), request_id, entry))
+        return future
+
+    def register(self, request_id, timeout):
+        """Registra um request_id e retorna um Future para aguardar em uma thread"""
+        return self._add(request_id, Future(), None, timeout)
+
+    def register_async(self, request_id, timeout):
+        """Registra um request_id e retorna um asyncio.Future do loop em execução"""
+        loop = asyncio.get_running_loop()
+        return self._add(request_id, loop.create_future(), loop, timeout)
+
+    def discard(self, request_id):
+        """Remove um request_id (ex.: o chamador desistiu por timeout)"""
+        with self._lock:
+            self._pending.pop(request_id, None)
+
+    @staticmethod
+    def _resolve(entry, result=None, exception=None):
+        def apply():
+            if entry.future.done():
+                return
+            if exception is not None:
+                entry.future.set_exception(exception)
+            else:
+                entry.future.set_result(result)
+
+        if entry.loop is not None:
+            entry.loop.call_soon_threadsafe(apply)
+        else:
+            apply()
+
+    def complete(self, request_id, response):
+        """Entrega a resposta ao chamador; retorna False se ninguém aguarda mais esse request_id"""
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+            if entry is None:
+                self.late_responses += 1
+                return False
+            self.completed += 1
+        self._resolve(entry, result=response)
+        return True
+
+    def expire(self, now=None):
+        """Expira entradas com prazo vencido; retorna quantas foram expiradas"""
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, _, request_id, entry = heapq.heappop(self._deadlines)
+                # Entradas já completadas ou descartadas ficam no heap até vencer
+                if self._pending.get(request_id) is entry:
+                    del self._pending[request_id]
+                    expired.append(entry)
+            self.expired += len(expired)
+        for entry in expired:
+            self._resolve(entry, exception=TimeoutError("Prazo da requisição MQTT expirado"))
+        return len(expired)
+
+    def wait(self, request_id, future, timeout):
+        """Aguarda um Future registrado com register(); retorna None no timeout"""
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None
+        finally:
+            self.discard(request_id)
+
+    async def wait_async(self, request_id, future, timeout):
+        """Aguarda um asyncio.Future registrado com register_async(); retorna None no timeout"""
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except Exception:
+            return None
+        finally:
+            self.discard(request_id)
@@ -0,0 +1,140 @@
+"""
+Agregados (rollups) do histórico de sensores em 1 minuto, 1 hora e 1 dia
+
+Cada leitura que chega ao histórico também atualiza, de forma incremental, o
+balde corrente de cada resolução da série (mínimo, máximo, soma e contagem).
+Os lotes do pipeline de ingestão são processados por série: as amostras de um
+mesmo balde são agregadas de uma vez (min/max/fsum sobre a fatia da coluna) e
+só a linha resultante é gravada.
+
+Os agregados usam o mesmo formato de segmento de history.py, com quatro
+colunas de valores, um diretório por resolução:
+
+    <diretório>/<resolução>/<device_id>/<métrica>/<início_ms>.seg
+
+A linha do balde em andamento é sobrescrita no lugar até o balde fechar, de
+modo que a API (outro processo) vê o agregado parcial sem esperar o fim do
+período. Consultas custam O(baldes) em vez de O(amostras). Os baldes diários
+seguem o dia UTC.
+"""
+
+import bisect
+import math
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from history import HistoryStore, DEFAULT_QUERY_LIMIT, group_by_series
+
+# Resolução -> (segundos por balde, linhas por segmento, retenção padrão em segundos)
+RESOLUTIONS = {
+    '1m': (60, 1440, 7 * 24 * 3600),          # 1 segmento por dia
+    '1h': (3600, 720, 90 * 24 * 3600),        # 1 segmento a cada 30 dias
+    '1d': (86400, 366, 2 * 365 * 24 * 3600),  # 1 segmento por ano
+}
+
+ROLLUP_COLUMNS = ('min', 'max', 'sum', 'count')
+
+
+class RollupStore:
+    """Mantém e consulta os agregados por resolução de cada série"""
+
+    def __init__(self, directory: str, retention: Optional[Dict[str, float]] = None, readonly: bool = False):
+        self.directory = directory
+        self.readonly = readonly
+        retention = retention or {}
+        self._stores = {
+            name: HistoryStore(os.path.join(directory, name), segment_capacity=capacity,
+                               retention=retention.get(name, default_retention),
+                               readonly=readonly, columns=len(ROLLUP_COLUMNS))
+            for name, (_, capacity, default_retention) in RESOLUTIONS.items()
+        }
+        self._lock = threading.Lock()
+        # (resolução, device_id, métrica) -> [início do balde, mín, máx, soma, contagem]
+        self._current: Dict[Tuple[str, str, str], List[float]] = {}
+        self.samples_aggregated = 0
+
+    def _bucket_state(self, resolution: str, device_id: str, metric: str) -> Optional[List[float]]:
+        key = (resolution, device_id, metric)
+        state = self._current.get(key)
+        if state is None:
+            # Continuar o balde gravado antes de um reinício do gateway
+            last = self._stores[resolution].last_row(device_id, metric)
+            if last is not None:
+                state = self._current[key] = [last[0], *last[1]]
+        return state
+
+    def add_many(self, samples: Iterable[Tuple[str, float, Dict[str, float]]]) -> int:
+        """Incorpora amostras (device_id, timestamp, {métrica: valor}); retorna quantos valores foram agregados"""
+        if self.readonly:
+            raise PermissionError("RollupStore aberto somente para leitura")
+        columns = group_by_series(samples)
+        rows: Dict[str, List[Tuple[str, str, float, Tuple[float, ...]]]] = {name: [] for name in RESOLUTIONS}
+        aggregated = 0
+        with self._lock:
+            for (device_id, metric), (timestamps, values) in columns.items():
+                aggregated += len(timestamps)
+                for resolution, (seconds, _, _) in RESOLUTIONS.items():
+                    state = self._bucket_state(resolution, device_id, metric)
+                    i = 0
+                    n = len(timestamps)
+                    while i < n:
+                        bucket = timestamps[i] - timestamps[i] % seconds
+                        if state is not None and bucket < state[0]:
+                            bucket = state[0]  # Relógio voltou: somar ao balde corrente
+                        # Amostras do lote que caem no mesmo balde (group_by_series entrega os timestamps em ordem)
+                        j = bisect.bisect_left(timestamps, bucket + seconds, i + 1, n) if i + 1 < n else n
+                        chunk = values[i:j]
+                        low, high, total, count = min(chunk), max(chunk), math.fsum(chunk), j - i
+                        if state is not None and state[0] == bucket:
+                            state[1] = min(state[1], low)
+                            state[2] = max(state[2], high)
+                            state[3] += total
+                            state[4] += count
+                        else:
+                            state = self._current[(resolution, device_id, metric)] = [bucket, low, high, total, count]
+                        # Uma linha por balde tocado pelo lote (o último continua em andamento)
+                        rows[resolution].append((device_id, metric, state[0], tuple(state[1:])))
+                        i = j
+            self.samples_aggregated += aggregated
+            # Ainda sob o lock: dois workers não podem gravar versões do mesmo balde fora de ordem
+            for resolution, resolution_rows in rows.items():
+                self._stores[resolution].upsert_rows(resolution_rows)
+        return aggregated
+
+    def query(self, device_id: str, metric: str, resolution: str, start: float, end: float,
+              limit: int = DEFAULT_QUERY_LIMIT) -> List[dict]:
+        """Baldes de uma série cujo início está em [start, end]"""
+        if resolution not in self._stores:
+            raise ValueError(f"Resolução inválida: {resolution} (use {', '.join(RESOLUTIONS)})")
+        seconds = RESOLUTIONS[resolution][0]
+        # Incluir o balde que contém `start`
+        start -= start % seconds
+        timestamps, columns = self._stores[resolution].query_rows(device_id, metric, start, end, limit)
+        if not timestamps:
+            return []
+        lows, highs, totals, counts = columns
+        return [
+            {
+                'start': bucket,
+                'min': low,
+                'max': high,
+                'mean': total / count if count else None,
+                'count': int(count),
+            }
+            for bucket, low, high, total, count in zip(timestamps, lows, highs, totals, counts)
+        ]
+
+    def enforce_retention(self, now: Optional[float] = None) -> int:
+        return sum(store.enforce_retention(now) for store in self._stores.values())
+
+    def get_metrics(self) -> dict:
+        return {
+            'samples_aggregated': self.samples_aggregated,
+            'open_buckets': len(self._current),
+            'resolutions': {name: store.get_metrics() for name, store in self._stores.items()},
+        }
+
+    def close(self):
+        for store in self._stores.values():
+            store.close()
@@ -0,0 +1,119 @@
+"""
+Decodificação dos payloads de telemetria publicados pelos sensores via MQTT
+
+Os sensores podem publicar em dois formatos:
+- JSON (legado): smart_city/sensors/<id>, ex.: {"device_id": ..., "temperature": ...}
+- Protobuf: smart_city/sensors_pb/<id>, uma mensagem DeviceUpdate serializada
+  (o firmware ESP8266 já usa nanopb; o payload fica menor e a decodificação
+  é mais barata que json.loads)
+
+O formato é detectado pelo conteúdo: um objeto JSON sempre começa com '{'
+(0x7B), que como tag protobuf seria o campo 15 com wire type 3 (grupo, não
+usado em proto3), então não há ambiguidade com um DeviceUpdate. O tópico serve
+apenas como preferência: se a decodificação no formato esperado falhar, o
+outro formato é tentado, de modo que dispositivos antigos continuam
+funcionando mesmo publicando no namespace novo e vice-versa.
+
+Os dois formatos são convertidos para o mesmo dicionário (as chaves do JSON
+legado), que é o que o gateway guarda em DeviceRecord.last_data.
+"""
+
+import json
+
+from google.protobuf.message import DecodeError
+
+import smart_city_pb2
+
+FORMAT_JSON = "json"
+FORMAT_PROTOBUF = "protobuf"
+
+_JSON_WHITESPACE = b' \t\r\n'
+
+
+def detect_format(payload) -> str:
+    """Identifica o formato de um payload de sensor pelo primeiro byte significativo"""
+    first = payload[:1]
+    if first == b'{':
+        return FORMAT_JSON
+    if first and first in _JSON_WHITESPACE and payload.lstrip(_JSON_WHITESPACE)[:1] == b'{':
+        # Pode ser JSON com espaços iniciais; 0x0A também é a tag de device_id em
+        # protobuf, por isso decode_sensor_payload tenta o outro formato se falhar
+        return FORMAT_JSON
+    return FORMAT_PROTOBUF
+
+
+def device_update_to_data(update) -> dict:
+    """Converte um DeviceUpdate no dicionário equivalente ao JSON legado"""
+    data = {'device_id': update.device_id}
+    if update.current_status:
+        try:
+            data['status'] = smart_city_pb2.DeviceStatus.Name(update.current_status)
+        except ValueError:
+            pass
+
+    kind = update.WhichOneof('data')
+    if kind == 'temperature_humidity':
+        data['temperature'] = update.temperature_humidity.temperature
+        data['humidity'] = update.temperature_humidity.humidity
+    elif kind == 'frequency_ms':
+        data['frequency_ms'] = update.frequency_ms
+    elif kind == 'air_quality':
+        data['air_quality_index'] = update.air_quality.air_quality_index
+    elif kind == 'current_sensor':
+        data['current'] = update.current_sensor.current
+        data['voltage'] = update.current_sensor.voltage
+        data['power'] = update.current_sensor.power
+    elif kind == 'camera':
+        data['resolution'] = update.camera.resolution
+        data['frame_rate'] = update.camera.frame_rate
+    elif kind == 'ac_ir_status':
+        data['brand'] = update.ac_ir_status.brand
+        data['mode'] = update.ac_ir_status.mode
+        data['target_temperature'] = update.ac_ir_status.temperature
+        data['ac_power'] = update.ac_ir_status.power
+        data['fan_speed'] = update.ac_ir_status.fan_speed
+
+    if update.custom_config_status:
+        data['custom_config_status'] = update.custom_config_status
+    if update.timestamp_ms:
+        data['timestamp'] = update.timestamp_ms
+    data['version'] = "mqtt-pb"
+    return data
+
+
+def decode_protobuf(payload) -> dict:
+    update = smart_city_pb2.DeviceUpdate()
+    update.ParseFromString(payload)
+    return device_update_to_data(update)
+
+
+def decode_json(payload) -> dict:
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        raise ValueError("Payload JSON não é um objeto")
+    return data
+
+
+_DECODERS = {FORMAT_JSON: decode_json, FORMAT_PROTOBUF: decode_protobuf}
+
+
+def decode_sensor_payload(payload, expected_format=None):
+    """Decodifica um payload de sensor em JSON ou protobuf.
+
+    Retorna (dados, formato). `expected_format` (derivado do tópico) só define
+    a ordem das tentativas quando a detecção pelo conteúdo é ambígua.
+    Levanta ValueError se nenhum dos formatos servir.
+    """
+    detected = detect_format(payload)
+    first = detected
+    if expected_format == FORMAT_PROTOBUF and detected == FORMAT_JSON and payload[:1] != b'{':
+        first = FORMAT_PROTOBUF
+    second = FORMAT_JSON if first == FORMAT_PROTOBUF else FORMAT_PROTOBUF
+
+    try:
+        return _DECODERS[first](payload), first
+    except (ValueError, DecodeError) as first_error:
+        try:
+            return _DECODERS[second](payload), second
+        except (ValueError, DecodeError):
+            raise ValueError(f"Payload de sensor inválido ({first}): {first_error}") from first_error
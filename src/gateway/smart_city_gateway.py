@@ -2,6 +2,8 @@
 # src/gateway/smart_city_gateway.py - SMART CITY GATEWAY WITH MQTT AND GRPC
 # Unified gateway: MQTT for sensors, gRPC for actuators
 
+import asyncio
+import select
 import socket
 import struct
 import threading
@@ -22,6 +24,16 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'proto'))
 import smart_city_pb2
 import actuator_service_pb2
 import actuator_service_pb2_grpc
+from framing import DelimitedReader, AsyncDelimitedReader, encode_delimited
+from circuit_breaker import DeviceCircuitBreakers
+from grpc_channel_pool import GrpcChannelPool
+from mqtt_correlation import PendingRequests
+from ingest import IngestPipeline
+from sensor_codec import decode_sensor_payload, FORMAT_PROTOBUF
+from history import HistoryStore, sample_values
+from rollup import RollupStore
+from state import DeviceRecord, DeviceRegistry, DEVICE_ONLINE, DEVICE_OFFLINE
+from subscriptions import SubscriptionManager, ThreadSubscriber, AsyncSubscriber
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -33,79 +45,90 @@ MULTICAST_PORT = 5007
 GATEWAY_TCP_PORT = 12345       # Porta TCP para registro de dispositivos
 GATEWAY_UDP_PORT = 12346       # Porta UDP para dados de sensores (legado)
 API_TCP_PORT = 12347           # Porta TCP para API externa
+GATEWAY_TCP_MODE = "asyncio"   # "asyncio" (event loop único) ou "threaded" (thread por conexão, legado)
+GATEWAY_TCP_BACKLOG = 1024     # Fila de conexões pendentes do listen() na porta TCP
+GATEWAY_TCP_MAX_CONCURRENCY = 512  # Máximo de conexões processadas simultaneamente no modo asyncio
+GATEWAY_TCP_WORKERS = 32       # Threads para requisições bloqueantes (gRPC/MQTT) no modo asyncio
+GATEWAY_TCP_IDLE_TIMEOUT = 120 # Segundos sem mensagens antes de fechar uma conexão persistente
+GATEWAY_TCP_MAX_INFLIGHT_PER_CONN = 64  # Requisições em paralelo por conexão (pipelining)
+LIST_DEVICES_MAX_PAGE_SIZE = 1000     # Limite de page_size em LIST_DEVICES paginado
+BULK_COMMAND_WORKERS = 64              # Threads compartilhadas pelos comandos em massa (BULK_DEVICE_COMMAND)
+BULK_COMMAND_DEFAULT_PARALLELISM = 16  # Comandos simultâneos por requisição quando max_parallelism = 0
+BULK_COMMAND_MAX_PARALLELISM = 64      # Limite de max_parallelism pedido pelo cliente
+BULK_COMMAND_MAX_DEVICES = 5000        # Máximo de dispositivos em um comando em massa
+GATEWAY_SUBSCRIBER_BUFFER = 1024       # Eventos pendentes por assinante (SUBSCRIBE) antes de descartar os mais antigos
+GATEWAY_SUBSCRIBER_SLOW_TIMEOUT = 10   # Segundos com o buffer cheio até desconectar um assinante lento
 GRPC_SERVER_HOST = "127.0.0.1"  # <--- Substitua pelo IP real do seu servidor gRPC
 GRPC_SERVER_PORT = 50051
+GRPC_COMMAND_TIMEOUT = 10        # Deadline máximo de um RPC de atuador (o efetivo se adapta à latência de cada um)
+GRPC_COMMAND_MIN_TIMEOUT = 1.0   # Piso do deadline adaptativo (inclui a fila e o TCP na ponte)
+ACTUATOR_BREAKER_FAILURE_THRESHOLD = 3  # Falhas seguidas até recusar comandos ao atuador sem chamar a ponte
+ACTUATOR_BREAKER_OPEN_TIMEOUT = 5       # Segundos até a sonda (dobra a cada sonda que falha, até 60 s)
+GRPC_STARTUP_READY_TIMEOUT = 3  # Segundos aguardando a conexão com a ponte na inicialização
+METRICS_LOG_INTERVAL = 60  # Segundos entre logs de métricas (canal gRPC, ingestão MQTT)
 
 # Configurações MQTT
 MQTT_BROKER_HOST = "127.0.0.1"  # <--- Substitua pelo IP real do seu broker MQTT
 MQTT_BROKER_PORT = 1883
 MQTT_COMMAND_TOPIC_PREFIX = "smart_city/commands/sensors/"
 MQTT_RESPONSE_TOPIC_PREFIX = "smart_city/commands/sensors/"
-MQTT_SENSOR_DATA_TOPIC_PREFIX = "smart_city/sensors/"
+MQTT_SENSOR_DATA_TOPIC_PREFIX = "smart_city/sensors/"         # Telemetria em JSON (legado)
+MQTT_SENSOR_PROTO_TOPIC_PREFIX = "smart_city/sensors_pb/"     # Telemetria como DeviceUpdate serializado
+MQTT_COMMAND_TIMEOUT = 10  # Segundos aguardando a resposta de um comando MQTT
+MQTT_INGEST_WORKERS = 2          # Workers que aplicam os dados de sensores ao registro
+MQTT_INGEST_QUEUE_SIZE = 10000   # Mensagens de sensores aguardando processamento
+MQTT_INGEST_BATCH_SIZE = 256     # Máximo de mensagens aplicadas por lote
+MQTT_INGEST_DROP_POLICY = "drop_oldest"  # "drop_oldest", "drop_newest" ou "block"
+
+# Histórico de leituras de sensores (lido diretamente pela API, sem passar pelo TCP do gateway)
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'history')
+HISTORY_RETENTION = 7 * 24 * 3600     # Segundos de histórico mantidos
+HISTORY_SEGMENT_CAPACITY = 4096       # Amostras por arquivo de segmento
+HISTORY_RETENTION_CHECK_INTERVAL = 300  # Segundos entre execuções da retenção
+READING_MAX_CLOCK_SKEW = 60           # Segundos no futuro aceitos no timestamp de uma leitura
+# Agregados mín/máx/média por 1m, 1h e 1d, mantidos incrementalmente a cada lote
+ROLLUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'rollups')
+ROLLUP_RETENTION = {'1m': 7 * 24 * 3600, '1h': 90 * 24 * 3600, '1d': 2 * 365 * 24 * 3600}
+
+# Tempo sem atividade (registro, dados ou resposta) até o dispositivo ser considerado offline
+DEVICE_DEFAULT_TTL = 15
+DEVICE_TTL_BY_TYPE = {
+    # Ex.: smart_city_pb2.DeviceType.TEMPERATURE_SENSOR: 70,  (sensores com frequência de até 60 s)
+}
 
 # === ESTRUTURAS DE DADOS ===
-connected_devices: Dict[str, Dict[str, Any]] = {}
-device_lock = threading.Lock()
+def device_ttl(record):
+    """TTL de inatividade do dispositivo, conforme o tipo"""
+    return DEVICE_TTL_BY_TYPE.get(record.type, DEVICE_DEFAULT_TTL)
+
+device_registry = DeviceRegistry(ttl_for=device_ttl)  # device_id -> DeviceRecord (locks por partição, leituras sem lock)
 mqtt_client = None
-mqtt_responses: Dict[str, Dict[str, Any]] = {}  # request_id -> response_data
-mqtt_response_lock = threading.Lock()
+mqtt_pending = PendingRequests()  # request_id -> futuro do chamador aguardando a resposta
+sensor_history = None  # HistoryStore, criado em main() (abre arquivos em HISTORY_DIR)
+sensor_rollups = None  # RollupStore, criado em main()
+device_subscriptions = SubscriptionManager()  # Conexões TCP que enviaram SUBSCRIBE
+bulk_command_executor = ThreadPoolExecutor(max_workers=BULK_COMMAND_WORKERS, thread_name_prefix="bulk-command")
+# Circuito e deadline adaptativo por atuador, para falhar rápido com relés fora do ar
+actuator_breakers = DeviceCircuitBreakers(
+    failure_threshold=ACTUATOR_BREAKER_FAILURE_THRESHOLD, open_timeout=ACTUATOR_BREAKER_OPEN_TIMEOUT,
+    min_timeout=GRPC_COMMAND_MIN_TIMEOUT, max_timeout=GRPC_COMMAND_TIMEOUT
+)
+# Canal gRPC único com o servidor ponte, compartilhado por todas as threads
+grpc_channel_pool = GrpcChannelPool(f'{GRPC_SERVER_HOST}:{GRPC_SERVER_PORT}', actuator_service_pb2_grpc.ActuatorServiceStub)
 
 # === FUNÇÕES AUXILIARES ===
-def encode_varint(value):
-    """Codifica um inteiro como varint protobuf"""
-    result = b''
-    while value >= 0x80:
-        result += bytes([value & 0x7F | 0x80])
-        value >>= 7
-    result += bytes([value])
-    return result
-
-def decode_varint(data, offset=0):
-    """Decodifica um varint protobuf"""
-    result = 0
-    shift = 0
-    i = offset
-    while i < len(data):
-        byte = data[i]
-        result |= (byte & 0x7F) << shift
-        if (byte & 0x80) == 0:
-            return result, i + 1
-        shift += 7
-        i += 1
-    raise ValueError("Invalid varint")
-
-def read_delimited_message_bytes(sock_file):
-    """Lê uma mensagem protobuf com delimitador de tamanho"""
-    # Ler varint byte por byte
-    size = 0
-    shift = 0
-    bytes_read = 0
-    
-    while True:
-        byte_data = sock_file.read(1)
-        if not byte_data:
-            return None
-        
-        byte = byte_data[0]
-        size |= (byte & 0x7F) << shift
-        bytes_read += 1
-        
-        if (byte & 0x80) == 0:
-            break
-        
-        shift += 7
-        if bytes_read > 5:  # Proteção contra loop infinito
-            raise ValueError("Varint too long")
-    
-    # Ler dados da mensagem
-    message_data = sock_file.read(size)
-    if len(message_data) != size:
-        raise ValueError(f"Expected {size} bytes, got {len(message_data)}")
-    
+def parse_envelope(message_data):
+    """Decodifica os bytes de uma mensagem delimitada em SmartCityMessage"""
     envelope = smart_city_pb2.SmartCityMessage()
     envelope.ParseFromString(message_data)
     return envelope
 
+def parse_device_status(status_name):
+    """Converte o nome de um DeviceStatus (ex.: "ON") no valor do enum; None se inválido"""
+    if isinstance(status_name, str) and hasattr(smart_city_pb2.DeviceStatus, status_name):
+        return getattr(smart_city_pb2.DeviceStatus, status_name)
+    return None
+
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
@@ -133,6 +156,7 @@ def setup_mqtt():
             logger.info(f"Gateway conectado ao broker MQTT: {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}")
             # Inscrever nos tópicos de dados de sensores
             client.subscribe(f"{MQTT_SENSOR_DATA_TOPIC_PREFIX}+")
+            client.subscribe(f"{MQTT_SENSOR_PROTO_TOPIC_PREFIX}+")
             # Inscrever nos tópicos de resposta de comandos
             client.subscribe(f"{MQTT_RESPONSE_TOPIC_PREFIX}+/response")
             logger.info("Inscrito nos tópicos MQTT de sensores e respostas")
@@ -141,15 +165,15 @@ def setup_mqtt():
     
     def on_message(client, userdata, msg):
         topic = msg.topic
-        payload = msg.payload.decode('utf-8')
         
         try:
             if "/response" in topic:
-                # Resposta de comando
-                handle_mqtt_command_response(topic, payload)
+                # Resposta de comando (rápido: apenas acorda quem aguarda)
+                handle_mqtt_command_response(topic, msg.payload.decode('utf-8'))
             else:
-                # Dados de sensor
-                handle_mqtt_sensor_data(topic, payload)
+                # Dados de sensor: decodificação e atualização ficam com os workers;
+                # particionar pelo sensor (fim do tópico) mantém suas leituras em ordem
+                sensor_ingest.submit((topic, msg.payload, time.time()), key=topic.rsplit('/', 1)[-1])
         except Exception as e:
             logger.error(f"Erro ao processar mensagem MQTT de {topic}: {e}")
     
@@ -160,6 +184,8 @@ def setup_mqtt():
     mqtt_client.on_message = on_message
     mqtt_client.on_disconnect = on_disconnect
     
+    sensor_ingest.start()
+    
     # Conectar ao broker
     try:
         mqtt_client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
@@ -169,40 +195,81 @@ def setup_mqtt():
         logger.error(f"Erro ao conectar ao broker MQTT: {e}")
         return False
 
-def handle_mqtt_sensor_data(topic, payload):
-    """Processa dados de sensor recebidos via MQTT"""
+def decode_mqtt_sensor_data(topic, payload):
+    """Decodifica o payload (JSON ou protobuf DeviceUpdate) de um sensor; None se inválido"""
+    expected = FORMAT_PROTOBUF if topic.startswith(MQTT_SENSOR_PROTO_TOPIC_PREFIX) else None
     try:
-        data = json.loads(payload)
-        device_id = data.get('device_id')
-        
+        data, _ = decode_sensor_payload(payload, expected)
+    except ValueError as e:
+        logger.error(f"Erro ao decodificar dados de {topic}: {e}")
+        return None
+    
+    if not data.get('device_id'):
+        # O ID também está no tópico (smart_city/sensors*/<id>)
+        device_id = topic.rsplit('/', 1)[-1]
         if not device_id:
-            logger.warning(f"Dados MQTT sem device_id: {payload}")
-            return
-        
-        # Atualizar informações do dispositivo
-        with device_lock:
-            if device_id in connected_devices:
-                device = connected_devices[device_id]
-                device['last_seen'] = time.time()
-                device['last_data'] = data
-                
-                # Atualizar status se fornecido
-                if 'status' in data:
-                    try:
-                        status_name = data['status']
-                        if hasattr(smart_city_pb2.DeviceStatus, status_name):
-                            device['status'] = getattr(smart_city_pb2.DeviceStatus, status_name)
-                    except:
-                        pass
-                
-                logger.info(f"Dados MQTT atualizados para {device_id}: Temp={data.get('temperature', 'N/A')}, Hum={data.get('humidity', 'N/A')}")
-            else:
-                logger.warning(f"Recebidos dados MQTT de dispositivo não registrado: {device_id}")
+            logger.warning(f"Dados MQTT sem device_id: {payload!r}")
+            return None
+        data['device_id'] = device_id
+    return data
+
+def make_sensor_update(data, now):
+    """Cria a função que aplica uma leitura de sensor ao DeviceRecord"""
+    status = parse_device_status(data.get('status'))
     
-    except json.JSONDecodeError as e:
-        logger.error(f"Erro ao decodificar JSON de {topic}: {e}")
-    except Exception as e:
-        logger.error(f"Erro ao processar dados MQTT: {e}")
+    def apply(device):
+        device.last_seen = now
+        device.last_data = data
+        # Atualizar status se fornecido
+        if status is not None:
+            device.status = status
+    
+    return apply
+
+def reading_timestamp(data, received_at):
+    """Momento da leitura: o "timestamp" do payload (s ou ms) se plausível, senão o do recebimento"""
+    timestamp = data.get('timestamp')
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        if timestamp > 1e11:
+            timestamp /= 1000  # Milissegundos (System.currentTimeMillis() nos sensores Java)
+        # Relógio do sensor não sincronizado (ex.: millis() desde o boot) cai fora da janela
+        if received_at - HISTORY_RETENTION < timestamp <= received_at + READING_MAX_CLOCK_SKEW:
+            return timestamp
+    return received_at
+
+def handle_mqtt_sensor_batch(messages):
+    """Aplica um micro-lote de mensagens (topic, payload, recebido_em) de sensores ao registro"""
+    readings = []
+    latest = {}
+    for topic, payload, received_at in messages:
+        data = decode_mqtt_sensor_data(topic, payload)
+        if data is not None:
+            readings.append((data, reading_timestamp(data, received_at)))
+            # Apenas a leitura mais recente de cada sensor no lote importa para last_data
+            latest[data['device_id']] = data
+    if not latest:
+        return
+    
+    now = time.time()
+    missing = device_registry.update_many({device_id: make_sensor_update(data, now) for device_id, data in latest.items()})
+    for device_id in missing:
+        logger.warning(f"Recebidos dados MQTT de dispositivo não registrado: {device_id}")
+    if device_subscriptions.has_subscribers:
+        for device_id in latest.keys() - set(missing):
+            publish_device_update(device_id)
+    
+    # Todas as leituras do lote (não só a última) vão para o histórico e para os agregados
+    missing = set(missing)
+    samples = [(data['device_id'], timestamp, sample_values(data)) for data, timestamp in readings if data['device_id'] not in missing]
+    try:
+        sensor_history.append_many(samples)
+        sensor_rollups.add_many(samples)
+    except OSError as e:
+        logger.error(f"Erro ao gravar histórico de sensores: {e}")
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        for device_id, data in latest.items():
+            logger.debug(f"Dados MQTT atualizados para {device_id}: Temp={data.get('temperature', 'N/A')}, Hum={data.get('humidity', 'N/A')}")
 
 def handle_mqtt_command_response(topic, payload):
     """Processa respostas de comandos MQTT"""
@@ -212,22 +279,22 @@ def handle_mqtt_command_response(topic, payload):
         device_id = data.get('device_id')
         
         if request_id:
-            with mqtt_response_lock:
-                mqtt_responses[request_id] = data
+            # Acorda diretamente quem aguarda este request_id
+            if mqtt_pending.complete(request_id, data):
                 logger.info(f"Resposta MQTT recebida para request_id {request_id}: {data.get('message', 'N/A')}")
+            else:
+                logger.warning(f"Resposta MQTT tardia ou desconhecida para request_id {request_id}")
             
-            # Atualizar status do dispositivo na lista connected_devices
-            if device_id and 'status' in data:
-                with device_lock:
-                    if device_id in connected_devices:
-                        try:
-                            status_name = data['status']
-                            if hasattr(smart_city_pb2.DeviceStatus, status_name):
-                                connected_devices[device_id]['status'] = getattr(smart_city_pb2.DeviceStatus, status_name)
-                                connected_devices[device_id]['last_seen'] = time.time()
-                                logger.info(f"Status do dispositivo {device_id} atualizado para {status_name}")
-                        except Exception as e:
-                            logger.warning(f"Erro ao atualizar status do dispositivo {device_id}: {e}")
+            # Atualizar status do dispositivo no registro
+            status = parse_device_status(data.get('status'))
+            if device_id and status is not None:
+                def apply(device):
+                    device.status = status
+                    device.last_seen = time.time()
+                
+                if device_registry.update(device_id, apply):
+                    logger.info(f"Status do dispositivo {device_id} atualizado para {data['status']}")
+                    publish_device_update(device_id)
         else:
             logger.warning(f"Resposta MQTT sem request_id: {payload}")
     
@@ -236,10 +303,8 @@ def handle_mqtt_command_response(topic, payload):
     except Exception as e:
         logger.error(f"Erro ao processar resposta MQTT: {e}")
 
-def send_mqtt_command(device_id, command_type, command_value="", timeout=10):
-    """Envia comando via MQTT para sensor e aguarda resposta"""
-    request_id = str(uuid.uuid4())
-    
+def publish_mqtt_command(device_id, command_type, command_value, request_id):
+    """Publica um comando MQTT para o sensor; retorna True se o broker aceitou"""
     command_data = {
         "command_type": command_type,
         "command_value": command_value,
@@ -248,33 +313,65 @@ def send_mqtt_command(device_id, command_type, command_value="", timeout=10):
     }
     
     topic = f"{MQTT_COMMAND_TOPIC_PREFIX}{device_id}"
+    result = mqtt_client.publish(topic, json.dumps(command_data), qos=1)
+    
+    if result.rc != mqtt.MQTT_ERR_SUCCESS:
+        logger.error(f"Erro ao publicar comando MQTT para {device_id}: {result.rc}")
+        return False
+    
+    logger.info(f"Comando MQTT enviado para {device_id}: {command_type} (request_id: {request_id})")
+    return True
+
+def send_mqtt_command(device_id, command_type, command_value="", timeout=MQTT_COMMAND_TIMEOUT):
+    """Envia comando via MQTT para sensor e aguarda resposta"""
+    request_id = str(uuid.uuid4())
     
     try:
-        # Enviar comando
-        result = mqtt_client.publish(topic, json.dumps(command_data), qos=1)
-        
-        if result.rc != mqtt.MQTT_ERR_SUCCESS:
-            logger.error(f"Erro ao publicar comando MQTT para {device_id}: {result.rc}")
+        # Registrar antes de publicar: a resposta pode chegar antes do wait
+        future = mqtt_pending.register(request_id, timeout)
+        if not publish_mqtt_command(device_id, command_type, command_value, request_id):
+            mqtt_pending.discard(request_id)
             return None
         
-        logger.info(f"Comando MQTT enviado para {device_id}: {command_type} (request_id: {request_id})")
-        
-        # Aguardar resposta
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            with mqtt_response_lock:
-                if request_id in mqtt_responses:
-                    response = mqtt_responses.pop(request_id)
-                    return response
-            time.sleep(0.1)
+        response = mqtt_pending.wait(request_id, future, timeout)
+        if response is None:
+            logger.warning(f"Timeout aguardando resposta MQTT de {device_id} (request_id: {request_id})")
+        return response
         
-        logger.warning(f"Timeout aguardando resposta MQTT de {device_id} (request_id: {request_id})")
+    except Exception as e:
+        mqtt_pending.discard(request_id)
+        logger.error(f"Erro ao enviar comando MQTT para {device_id}: {e}")
         return None
+
+async def send_mqtt_command_async(device_id, command_type, command_value="", timeout=MQTT_COMMAND_TIMEOUT):
+    """Versão asyncio de send_mqtt_command: aguarda a resposta sem ocupar uma thread"""
+    request_id = str(uuid.uuid4())
+    
+    try:
+        future = mqtt_pending.register_async(request_id, timeout)
+        if not publish_mqtt_command(device_id, command_type, command_value, request_id):
+            mqtt_pending.discard(request_id)
+            return None
+        
+        response = await mqtt_pending.wait_async(request_id, future, timeout)
+        if response is None:
+            logger.warning(f"Timeout aguardando resposta MQTT de {device_id} (request_id: {request_id})")
+        return response
         
     except Exception as e:
+        mqtt_pending.discard(request_id)
         logger.error(f"Erro ao enviar comando MQTT para {device_id}: {e}")
         return None
 
+sensor_ingest = IngestPipeline(
+    handle_mqtt_sensor_batch,
+    workers=MQTT_INGEST_WORKERS,
+    queue_size=MQTT_INGEST_QUEUE_SIZE,
+    batch_size=MQTT_INGEST_BATCH_SIZE,
+    drop_policy=MQTT_INGEST_DROP_POLICY,
+    name="mqtt-sensores"
+)
+
 # === MULTICAST DISCOVERY ===
 def multicast_discovery():
     """Envia descoberta multicast periodicamente"""
@@ -318,126 +415,302 @@ def multicast_discovery():
         time.sleep(10)  # Enviar a cada 10 segundos
 
 # === REGISTRO DE DISPOSITIVOS ===
+def log_device_event(event, record):
+    """Ouvinte do registro: transições online/offline"""
+    if event == DEVICE_ONLINE:
+        logger.info(f"Dispositivo {record.id} ONLINE")
+    elif event == DEVICE_OFFLINE:
+        logger.info(f"Dispositivo {record.id} OFFLINE (sem atividade há {time.time() - record.last_seen:.0f}s), removido")
+
+device_registry.add_listener(log_device_event)
+
+# === EVENTOS PARA ASSINANTES ===
+DEVICE_INFO_FIELDS = ('device_id', 'type', 'ip_address', 'port', 'initial_state', 'is_actuator', 'is_sensor')
+
+def device_record_to_info(dev, fields=None):
+    """Dados de registro de um dispositivo como DeviceInfo (opcionalmente só os campos em `fields`)"""
+    values = {
+        'device_id': dev.id,
+        'type': dev.type,
+        'ip_address': dev.ip,
+        'port': dev.port,
+        'initial_state': dev.status,
+        'is_actuator': dev.is_actuator,
+        'is_sensor': dev.is_sensor,
+    }
+    if fields:
+        values = {name: value for name, value in values.items() if name == 'device_id' or name in fields}
+    return smart_city_pb2.DeviceInfo(**values)
+
+def build_device_update(dev):
+    """Estado conhecido de um dispositivo como DeviceUpdate (sensores: último dado MQTT)"""
+    if not dev.is_sensor:
+        return smart_city_pb2.DeviceUpdate(device_id=dev.id, type=dev.type, current_status=dev.status)
+    last_data = dev.last_data
+    status_enum = parse_device_status(last_data.get('status'))
+    if status_enum is None:
+        status_enum = smart_city_pb2.DeviceStatus.IDLE  # Valor padrão seguro
+    update = smart_city_pb2.DeviceUpdate(
+        device_id=dev.id,
+        type=dev.type,
+        current_status=status_enum,
+    )
+    if 'temperature' in last_data and 'humidity' in last_data:
+        update.temperature_humidity.temperature = float(last_data['temperature'])
+        update.temperature_humidity.humidity = float(last_data['humidity'])
+    return update
+
+def build_event_frame(event_type, sequence, update=None, device=None):
+    """Serializa um DeviceEvent no envelope (uma vez por evento, para todos os assinantes)"""
+    event = smart_city_pb2.DeviceEvent(type=event_type, sequence=sequence, timestamp_ms=int(time.time() * 1000))
+    if update is not None:
+        event.update.CopyFrom(update)
+    if device is not None:
+        event.device.CopyFrom(device)
+    envelope = smart_city_pb2.SmartCityMessage(
+        message_type=smart_city_pb2.MessageType.DEVICE_EVENT,
+        device_event=event
+    )
+    return encode_delimited(envelope)
+
+def publish_device_update(dev_id):
+    """Envia DEVICE_UPDATED com o estado atual do dispositivo aos assinantes"""
+    if not device_subscriptions.has_subscribers:
+        return
+    dev = device_registry.get(dev_id)
+    if dev is None:
+        return
+    device_subscriptions.publish(dev.type, dev.id, lambda sequence: build_event_frame(
+        smart_city_pb2.DeviceEvent.EventType.DEVICE_UPDATED, sequence, update=build_device_update(dev)))
+
+def publish_registry_event(event, record):
+    """Ouvinte do registro: registros novos e saídas por inatividade viram eventos"""
+    if not device_subscriptions.has_subscribers:
+        return
+    if event == DEVICE_ONLINE:
+        event_type = smart_city_pb2.DeviceEvent.EventType.DEVICE_REGISTERED
+    else:
+        event_type = smart_city_pb2.DeviceEvent.EventType.DEVICE_OFFLINE
+    device_subscriptions.publish(record.type, record.id, lambda sequence: build_event_frame(
+        event_type, sequence, update=build_device_update(record), device=device_record_to_info(record)))
+
+device_registry.add_listener(publish_registry_event)
+
+def new_subscriber(subscriber_class, name, client_request, *args):
+    """Cria o assinante com os filtros do ClientRequest SUBSCRIBE"""
+    return subscriber_class(
+        *args, name,
+        device_types=client_request.subscribe_types,
+        device_id_prefix=client_request.subscribe_id_prefix,
+        buffer_size=GATEWAY_SUBSCRIBER_BUFFER,
+        slow_timeout=GATEWAY_SUBSCRIBER_SLOW_TIMEOUT
+    )
+
+def subscribed_response(subscriber):
+    filters = []
+    if subscriber.device_types:
+        filters.append("tipos=" + ",".join(smart_city_pb2.DeviceType.Name(t) for t in sorted(subscriber.device_types)))
+    if subscriber.device_id_prefix:
+        filters.append(f"prefixo={subscriber.device_id_prefix}")
+    return smart_city_pb2.GatewayResponse(
+        type=smart_city_pb2.GatewayResponse.ResponseType.SUBSCRIBED,
+        message=f"Assinatura ativa ({', '.join(filters) or 'todos os dispositivos'})"
+    )
+
 def register_device(device_info):
     """Registra ou atualiza um dispositivo"""
-    with device_lock:
-        # Log extra para debug: mensagem completa
-        logger.info(f"[DEBUG] DeviceInfo completo recebido:\n{device_info}")
-        device_id = device_info.device_id
-        # Log extra para debug
-        logger.info(f"[DEBUG] DeviceInfo recebido: device_id={device_info.device_id} type={device_info.type} ip={device_info.ip_address}")
-        # Todos os sensores usam MQTT
-        is_mqtt_sensor = device_info.is_sensor
-        device_data = {
-            'id': device_id,
-            'type': device_info.type,
-            'ip': device_info.ip_address,
-            'port': device_info.port,
-            'status': device_info.initial_state,
-            'is_actuator': device_info.is_actuator,
-            'is_sensor': device_info.is_sensor,
-            'last_seen': time.time(),
-            'capabilities': dict(device_info.capabilities),
-            'is_mqtt_sensor': is_mqtt_sensor
-        }
+    # Log extra para debug: mensagem completa
+    logger.debug(f"[DEBUG] DeviceInfo completo recebido:\n{device_info}")
+    device_id = device_info.device_id
+    # Log extra para debug
+    logger.debug(f"[DEBUG] DeviceInfo recebido: device_id={device_info.device_id} type={device_info.type} ip={device_info.ip_address}")
+    # Todos os sensores usam MQTT
+    is_mqtt_sensor = device_info.is_sensor
+    record = DeviceRecord(
+        id=device_id,
+        type=device_info.type,
+        ip=device_info.ip_address,
+        port=device_info.port,
+        status=device_info.initial_state,
+        is_actuator=device_info.is_actuator,
+        is_sensor=device_info.is_sensor,
+        last_seen=time.time(),
+        capabilities=dict(device_info.capabilities),
+        is_mqtt_sensor=is_mqtt_sensor
+    )
+    if is_mqtt_sensor:
+        record.mqtt_command_topic = f"{MQTT_COMMAND_TOPIC_PREFIX}{device_id}"
+        record.mqtt_response_topic = f"{MQTT_COMMAND_TOPIC_PREFIX}{device_id}/response"
+    if device_registry.register(record):
         if is_mqtt_sensor:
-            device_data['mqtt_command_topic'] = f"{MQTT_COMMAND_TOPIC_PREFIX}{device_id}"
-            device_data['mqtt_response_topic'] = f"{MQTT_COMMAND_TOPIC_PREFIX}{device_id}/response"
             logger.info(f"Sensor MQTT registrado: {device_id}")
-        connected_devices[device_id] = device_data
-        logger.info(f"Dispositivo {device_id} ({smart_city_pb2.DeviceType.Name(device_info.type)}) registrado/atualizado. Status: {smart_city_pb2.DeviceStatus.Name(device_info.initial_state)}")
+        logger.info(f"Dispositivo {device_id} ({smart_city_pb2.DeviceType.Name(device_info.type)}) registrado. Status: {smart_city_pb2.DeviceStatus.Name(device_info.initial_state)}")
+    else:
+        logger.debug(f"Dispositivo {device_id} atualizado. Status: {smart_city_pb2.DeviceStatus.Name(device_info.initial_state)}")
+
+# === PRAZOS ===
+def request_deadline(req, received_at=None):
+    """Instante (time.monotonic()) em que o cliente deixa de esperar pela resposta, ou None sem prazo"""
+    if not req.deadline_ms:
+        return None
+    return (received_at if received_at is not None else time.monotonic()) + req.deadline_ms / 1000
+
+def remaining_time(deadline, limit):
+    """Tempo até o prazo, no máximo `limit` (sem prazo: `limit`)"""
+    if deadline is None:
+        return limit
+    return min(limit, deadline - time.monotonic())
+
+DEADLINE_EXPIRED = {"command_status": "FAILED", "message": "Prazo da requisição esgotado antes do envio ao dispositivo"}
 
 # === COMANDO PARA DISPOSITIVOS ===
-def send_command_to_device(dev_id, command_type, command_value=""):
-    """Envia comando para dispositivo (sensor ou atuador)"""
-    with device_lock:
-        if dev_id not in connected_devices:
-            return {"command_status": "FAILED", "message": f"Dispositivo {dev_id} não encontrado"}
-        
-        dev = connected_devices[dev_id]
+def mqtt_command_result(dev_id, response):
+    """Resultado do comando MQTT a partir da resposta do sensor (None: timeout ou erro)"""
+    if response:
+        if response.get('success', False):
+            # Atualizar estado do dispositivo
+            status = parse_device_status(response.get('status'))
+
+            def apply(device):
+                device.last_seen = time.time()
+                # Atualizar status se fornecido
+                if status is not None:
+                    device.status = status
+
+            device_registry.update(dev_id, apply)
+            if status is not None:
+                publish_device_update(dev_id)
+
+            return {
+                "command_status": "SUCCESS",
+                "message": f"Comando MQTT enviado para sensor: {response.get('message', 'OK')}"
+            }
+        else:
+            return {
+                "command_status": "FAILED", 
+                "message": f"Erro no sensor: {response.get('message', 'Unknown error')}"
+            }
+    else:
+        return {"command_status": "FAILED", "message": "Timeout ou erro na comunicação MQTT"}
+
+async def send_sensor_command_async(dev_id, command_type, command_value="", deadline=None):
+    """send_command_to_device para sensores no modo asyncio: a resposta MQTT é aguardada no event loop"""
+    logger.info(f"[GATEWAY] Enviando comando MQTT para sensor {dev_id}")
+    timeout = remaining_time(deadline, MQTT_COMMAND_TIMEOUT)
+    if timeout <= 0:
+        return DEADLINE_EXPIRED
+    return mqtt_command_result(dev_id, await send_mqtt_command_async(dev_id, command_type, command_value, timeout=timeout))
+
+def send_command_to_device(dev_id, command_type, command_value="", deadline=None):
+    """Envia comando para dispositivo (sensor ou atuador), desistindo no `deadline` do cliente"""
+    dev = device_registry.get(dev_id)
+    if dev is None:
+        return {"command_status": "FAILED", "message": f"Dispositivo {dev_id} não encontrado"}
     
     # Verificar se é sensor MQTT
-    if dev.get('is_sensor', False):
+    if dev.is_sensor:
         logger.info(f"[GATEWAY] Enviando comando MQTT para sensor {dev_id}")
         
-        response = send_mqtt_command(dev_id, command_type, command_value)
-        
-        if response:
-            if response.get('success', False):
-                # Atualizar estado do dispositivo
-                with device_lock:
-                    if dev_id in connected_devices:
-                        device = connected_devices[dev_id]
-                        device['last_seen'] = time.time()
-                        
-                        # Atualizar status se fornecido
-                        if 'status' in response:
-                            try:
-                                status_name = response['status']
-                                if hasattr(smart_city_pb2.DeviceStatus, status_name):
-                                    device['status'] = getattr(smart_city_pb2.DeviceStatus, status_name)
-                            except:
-                                pass
-                
-                return {
-                    "command_status": "SUCCESS",
-                    "message": f"Comando MQTT enviado para sensor: {response.get('message', 'OK')}"
-                }
-            else:
-                return {
-                    "command_status": "FAILED", 
-                    "message": f"Erro no sensor: {response.get('message', 'Unknown error')}"
-                }
-        else:
-            return {"command_status": "FAILED", "message": "Timeout ou erro na comunicação MQTT"}
+        timeout = remaining_time(deadline, MQTT_COMMAND_TIMEOUT)
+        if timeout <= 0:
+            return DEADLINE_EXPIRED
+        return mqtt_command_result(dev_id, send_mqtt_command(dev_id, command_type, command_value, timeout=timeout))
     
     # Lógica para atuadores gRPC
-    elif dev.get('is_actuator', False):
+    elif dev.is_actuator:
         # ATUADOR: Usar gRPC
         logger.info(f"[GATEWAY] Enviando comando gRPC para atuador {dev_id}")
-        return send_grpc_command(dev_id, command_type, command_value)
+        return send_grpc_command(dev_id, command_type, command_value, deadline)
     
     else:
         return {"command_status": "FAILED", "message": f"Tipo de dispositivo não suportado: {dev_id}"}
 
-def send_grpc_command(dev_id, command_type, command_value=""):
-    """Envia comando via gRPC para atuador"""
+# Comando recebido -> (RPC unário, operação em ExecutarLote)
+GRPC_COMMANDS = {
+    "LIGAR": ("LigarDispositivo", actuator_service_pb2.LIGAR),
+    "TURN_ON": ("LigarDispositivo", actuator_service_pb2.LIGAR),
+    "ON": ("LigarDispositivo", actuator_service_pb2.LIGAR),
+    "DESLIGAR": ("DesligarDispositivo", actuator_service_pb2.DESLIGAR),
+    "TURN_OFF": ("DesligarDispositivo", actuator_service_pb2.DESLIGAR),
+    "OFF": ("DesligarDispositivo", actuator_service_pb2.DESLIGAR),
+    "CONSULTAR": ("ConsultarEstado", actuator_service_pb2.CONSULTAR),
+    "STATUS": ("ConsultarEstado", actuator_service_pb2.CONSULTAR),
+    "GET_STATUS": ("ConsultarEstado", actuator_service_pb2.CONSULTAR),
+}
+
+def apply_grpc_response(dev_id, response):
+    """Atualiza o registro com a resposta da ponte e monta o resultado do comando"""
+    if response.status.upper() in ["ON", "OFF", "OK"]:
+        status = parse_device_status(response.status.upper())
+        
+        def apply(device):
+            device.last_seen = time.time()
+            if status is not None:
+                device.status = status
+        
+        device_registry.update(dev_id, apply)
+        if status is not None:
+            publish_device_update(dev_id)
+        return {
+            "command_status": "SUCCESS",
+            "message": f"Comando gRPC enviado para atuador: {response.message}",
+            "status": response.status  # Adicionar o status no resultado
+        }
+    else:
+        return {
+            "command_status": "FAILED",
+            "message": f"Erro no atuador: {response.message}"
+        }
+
+def record_actuator_result(dev_id, response, result, elapsed):
+    """Alimenta o circuito do atuador com o resultado de um comando via ponte
+    
+    Erros da própria ponte (fila do dispositivo cheia, circuito aberto lá,
+    prazo) não dizem nada sobre o relé: apenas devolvem a sonda.
+    """
+    if result["command_status"] == "SUCCESS":
+        actuator_breakers.record_success(dev_id, elapsed)
+    elif response.device_error:
+        actuator_breakers.record_failure(dev_id)
+    else:
+        actuator_breakers.release(dev_id)
+
+def send_grpc_command(dev_id, command_type, command_value="", deadline=None):
+    """Envia comando via gRPC para atuador (canal compartilhado)
+    
+    O deadline do RPC é o timeout adaptativo do atuador, encurtado pelo prazo
+    do cliente: a ponte recebe o mesmo prazo e abandona o I/O com o relé.
+    """
+    # Mapeamento do comando para o método correto
+    grpc_command = GRPC_COMMANDS.get(command_type.upper())
+    if grpc_command is None:
+        return {"command_status": "FAILED", "message": f"Comando gRPC desconhecido: {command_type}"}
+    # Buscar ip e port do dispositivo
+    dev = device_registry.get(dev_id)
+    if dev is None:
+        return {"command_status": "FAILED", "message": f"Dispositivo {dev_id} não encontrado"}
+    request = actuator_service_pb2.Request(device_id=dev_id, ip=dev.ip, port=dev.port)
+
+    adaptive_timeout = actuator_breakers.timeout_for(dev_id)
+    timeout = remaining_time(deadline, adaptive_timeout)
+    if timeout <= 0:
+        return DEADLINE_EXPIRED
+    # Só depois das validações: no HALF_OPEN allow() consome a única sonda
+    if not actuator_breakers.allow(dev_id):
+        return {"command_status": "FAILED", "message": f"Atuador {dev_id} sem resposta (circuito aberto); nova tentativa em breve"}
     try:
-        with grpc.insecure_channel(f'{GRPC_SERVER_HOST}:{GRPC_SERVER_PORT}') as channel:
-            stub = actuator_service_pb2_grpc.ActuatorServiceStub(channel)
-            # Buscar ip e port do dispositivo
-            with device_lock:
-                dev = connected_devices.get(dev_id)
-                ip = dev['ip'] if dev else ''
-                port = dev['port'] if dev else 0
-            request = actuator_service_pb2.Request(device_id=dev_id, ip=ip, port=port)
-
-            # Mapeamento do comando para o método correto
-            if command_type.upper() in ["LIGAR", "TURN_ON", "ON"]:
-                response = stub.LigarDispositivo(request)
-            elif command_type.upper() in ["DESLIGAR", "TURN_OFF", "OFF"]:
-                response = stub.DesligarDispositivo(request)
-            elif command_type.upper() in ["CONSULTAR", "STATUS", "GET_STATUS"]:
-                response = stub.ConsultarEstado(request)
-            else:
-                return {"command_status": "FAILED", "message": f"Comando gRPC desconhecido: {command_type}"}
-
-            if response.status.upper() in ["ON", "OFF", "OK"]:
-                with device_lock:
-                    if dev_id in connected_devices:
-                        connected_devices[dev_id]['last_seen'] = time.time()
-                        connected_devices[dev_id]['status'] = response.status
-                return {
-                    "command_status": "SUCCESS",
-                    "message": f"Comando gRPC enviado para atuador: {response.message}",
-                    "status": response.status  # Adicionar o status no resultado
-                }
-            else:
-                return {
-                    "command_status": "FAILED",
-                    "message": f"Erro no atuador: {response.message}"
-                }
+        start = time.perf_counter()
+        response = grpc_channel_pool.call(grpc_command[0], request, timeout=timeout)
+        result = apply_grpc_response(dev_id, response)
+        record_actuator_result(dev_id, response, result, time.perf_counter() - start)
+        return result
     except grpc.RpcError as e:
+        # Deadline estourado é o atuador (a menos que o prazo do cliente o tenha encurtado);
+        # ponte indisponível não é culpa dele
+        if e.code() == StatusCode.DEADLINE_EXCEEDED and timeout >= adaptive_timeout:
+            actuator_breakers.record_failure(dev_id)
+        else:
+            actuator_breakers.release(dev_id)
         logger.error(f"Erro gRPC ao enviar comando para {dev_id}: {e}")
         return {"command_status": "FAILED", "message": f"Erro gRPC: {e.details()}"}
     except Exception as e:
@@ -445,68 +718,331 @@ def send_grpc_command(dev_id, command_type, command_value=""):
         return {"command_status": "FAILED", "message": f"Erro interno: {str(e)}"}
 
 # === HANDLERS TCP ===
+def build_response_frame(response, request_id=0):
+    """Serializa um GatewayResponse no envelope, ecoando o request_id do cliente"""
+    response.request_id = request_id
+    resp_envelope = smart_city_pb2.SmartCityMessage(
+        message_type=smart_city_pb2.MessageType.GATEWAY_RESPONSE,
+        gateway_response=response
+    )
+    return encode_delimited(resp_envelope)
+
 def handle_tcp_connection(conn, addr):
-    """Gerencia uma conexão TCP individual"""
+    """Gerencia uma conexão TCP persistente (várias mensagens delimitadas por conexão)"""
     logger.info(f"Conexão TCP de {addr}")
     
     try:
         with conn:
-            sock_file = conn.makefile('rb')
-            envelope = read_delimited_message_bytes(sock_file)
+            conn.settimeout(GATEWAY_TCP_IDLE_TIMEOUT)
+            frames = DelimitedReader(conn)
             
-            if envelope:
+            for message_data in frames:
+                envelope = parse_envelope(message_data)
+                
                 if envelope.message_type == smart_city_pb2.MessageType.DEVICE_INFO:
                     register_device(envelope.device_info)
                     
                 elif envelope.message_type == smart_city_pb2.MessageType.CLIENT_REQUEST:
+                    if envelope.client_request.type == smart_city_pb2.ClientRequest.RequestType.SUBSCRIBE:
+                        # A partir daqui a conexão só transporta eventos
+                        stream_device_events(conn, addr, envelope.client_request)
+                        break
                     response = handle_client_request(envelope.client_request)
+                    conn.sendall(build_response_frame(response, envelope.client_request.request_id))
                     
-                    resp_envelope = smart_city_pb2.SmartCityMessage(
-                        message_type=smart_city_pb2.MessageType.GATEWAY_RESPONSE,
-                        gateway_response=response
-                    )
-                    
-                    data = resp_envelope.SerializeToString()
-                    conn.sendall(encode_varint(len(data)) + data)
-                    
+    except socket.timeout:
+        logger.debug(f"Conexão TCP de {addr} encerrada por inatividade")
     except Exception as e:
         logger.error(f"Erro na conexão TCP de {addr}: {e}")
 
-def handle_client_request(req):
-    if req.type == smart_city_pb2.ClientRequest.RequestType.LIST_DEVICES:
-        with device_lock:
-            devices = []
-            for dev_id, dev_data in connected_devices.items():
-                device_info = smart_city_pb2.DeviceInfo(
-                    device_id=dev_id,
-                    type=dev_data['type'],
-                    ip_address=dev_data['ip'],
-                    port=dev_data['port'],
-                    initial_state=dev_data['status'],
-                    is_actuator=dev_data['is_actuator'],
-                    is_sensor=dev_data['is_sensor']
-                )
-                devices.append(device_info)
-            
+def stream_device_events(conn, addr, client_request):
+    """Modo threaded: envia DeviceEvent até o cliente fechar a conexão ou ficar lento demais"""
+    subscriber = new_subscriber(ThreadSubscriber, f"{addr[0]}:{addr[1]}", client_request)
+    conn.sendall(build_response_frame(subscribed_response(subscriber), client_request.request_id))
+    device_subscriptions.add(subscriber)
+    try:
+        while not subscriber.closed:
+            subscriber.wait(1.0)
+            frames = subscriber.drain()
+            if frames:
+                # Bloqueia até GATEWAY_TCP_IDLE_TIMEOUT se o cliente não lê; enquanto
+                # isso o buffer do assinante enche e a detecção de lentidão atua
+                conn.sendall(b''.join(frames))
+            # Cliente fechou? (o que mais ele enviar é ignorado)
+            readable, _, _ = select.select([conn], [], [], 0)
+            if readable and not conn.recv(4096):
+                subscriber.close_reason = "cliente fechou a conexão"
+                break
+    except OSError as e:
+        subscriber.close_reason = f"erro de envio: {e}"
+    finally:
+        device_subscriptions.remove(subscriber)
+
+def registry_filters(req):
+    """Filtros filter_* de um ClientRequest como argumentos de DeviceRegistry.query"""
+    return {
+        'types': set(req.filter_types),
+        'statuses': set(req.filter_statuses),
+        'is_sensor': req.filter_is_sensor if req.HasField('filter_is_sensor') else None,
+        'is_actuator': req.filter_is_actuator if req.HasField('filter_is_actuator') else None,
+        'subnet': req.filter_subnet or None,
+    }
+
+def list_devices(req):
+    """LIST_DEVICES: filtros, página a partir do cursor e máscara de campos"""
+    fields = set(req.field_mask)
+    unknown = fields.difference(DEVICE_INFO_FIELDS)
+    if unknown:
         return smart_city_pb2.GatewayResponse(
-            type=smart_city_pb2.GatewayResponse.ResponseType.DEVICE_LIST,
-            message=f"Lista de {len(devices)} dispositivos",
-            devices=devices
+            type=smart_city_pb2.GatewayResponse.ResponseType.ERROR,
+            message=f"Campos inválidos em field_mask: {', '.join(sorted(unknown))}"
         )
     
-    elif req.type == smart_city_pb2.ClientRequest.RequestType.SEND_DEVICE_COMMAND:
-        result = send_command_to_device(req.target_device_id, req.command.command_type, req.command.command_value)
-        
+    try:
+        # Filtros resolvidos pelos índices secundários do registro
+        records, total, more = device_registry.query(
+            after=req.page_cursor,
+            limit=min(req.page_size, LIST_DEVICES_MAX_PAGE_SIZE) if req.page_size else 0,
+            **registry_filters(req)
+        )
+    except ValueError as e:
+        return smart_city_pb2.GatewayResponse(
+            type=smart_city_pb2.GatewayResponse.ResponseType.ERROR,
+            message=f"Sub-rede inválida: {e}"
+        )
+    devices = [device_record_to_info(dev, fields) for dev in records]
+    
+    return smart_city_pb2.GatewayResponse(
+        type=smart_city_pb2.GatewayResponse.ResponseType.DEVICE_LIST,
+        message=f"Lista de {len(devices)} de {total} dispositivos",
+        devices=devices,
+        total_devices=total,
+        # O cursor é o último device_id da página: estável mesmo com registros/remoções entre páginas
+        next_page_cursor=records[-1].id if more else ""
+    )
+
+def bulk_device_command(req, deadline=None):
+    """BULK_DEVICE_COMMAND: executa o comando em vários dispositivos com paralelismo limitado"""
+    error = None
+    if req.target_device_ids:
+        device_ids = list(dict.fromkeys(req.target_device_ids))  # sem repetidos, na ordem pedida
+    else:
+        filters = registry_filters(req)
+        if not (filters['types'] or filters['statuses'] or filters['subnet']
+                or filters['is_sensor'] is not None or filters['is_actuator'] is not None):
+            error = "Informe target_device_ids ou ao menos um filtro"
+        else:
+            try:
+                records, _, _ = device_registry.query(**filters)
+                device_ids = [record.id for record in records]
+            except ValueError as e:
+                error = f"Sub-rede inválida: {e}"
+    if error is None and len(device_ids) > BULK_COMMAND_MAX_DEVICES:
+        error = f"{len(device_ids)} dispositivos selecionados; o máximo é {BULK_COMMAND_MAX_DEVICES}"
+    if error is not None:
         return smart_city_pb2.GatewayResponse(
-            type=smart_city_pb2.GatewayResponse.ResponseType.COMMAND_ACK,
+            type=smart_city_pb2.GatewayResponse.ResponseType.ERROR,
+            message=error
+        )
+    
+    parallelism = min(req.max_parallelism or BULK_COMMAND_DEFAULT_PARALLELISM, BULK_COMMAND_MAX_PARALLELISM)
+    results = run_bulk_command(device_ids, req.command.command_type, req.command.command_value, parallelism, deadline)
+    succeeded = sum(1 for result in results if result.command_status == "SUCCESS")
+    if succeeded == len(results):
+        status = "SUCCESS"
+    elif succeeded:
+        status = "PARTIAL"
+    else:
+        status = "FAILED"
+    logger.info(f"[GATEWAY] Comando em massa {req.command.command_type}: {succeeded}/{len(results)} com sucesso (paralelismo {parallelism})")
+    
+    return smart_city_pb2.GatewayResponse(
+        type=smart_city_pb2.GatewayResponse.ResponseType.BULK_COMMAND_RESULT,
+        message=f"Comando {req.command.command_type} executado em {succeeded} de {len(results)} dispositivos",
+        command_status=status,
+        command_results=results
+    )
+
+def run_grpc_batch(device_ids, operation, parallelism, deadline=None):
+    """Atuadores de um comando em massa em uma única chamada ExecutarLote.
+
+    Retorna {device_id: DeviceCommandResult}, ou None se a ponte não
+    implementa ExecutarLote (o chamador volta aos RPCs unários). O deadline
+    do lote é o maior timeout adaptativo dos atuadores por rodada de
+    `parallelism` comandos na ponte, encurtado pelo prazo do cliente.
+    """
+    def failed(dev_ids, message):
+        return {dev_id: smart_city_pb2.DeviceCommandResult(device_id=dev_id, command_status="FAILED", message=message)
+                for dev_id in dev_ids}
+    
+    # Prazo vencido: falhar antes de allow(), que consome a sonda dos atuadores em HALF_OPEN
+    if deadline is not None and deadline <= time.monotonic():
+        return failed(device_ids, DEADLINE_EXPIRED["message"])
+    # Atuadores com circuito aberto falham na hora e ficam fora do lote
+    results = {}
+    allowed = []
+    for dev_id in device_ids:
+        if actuator_breakers.allow(dev_id):
+            allowed.append(dev_id)
+        else:
+            results[dev_id] = smart_city_pb2.DeviceCommandResult(
+                device_id=dev_id, command_status="FAILED", message="Atuador sem resposta (circuito aberto)")
+    if not allowed:
+        return results
+    rounds = -(-len(allowed) // parallelism)
+    adaptive_timeout = max(actuator_breakers.timeout_for(dev_id) for dev_id in allowed) * rounds
+    timeout = remaining_time(deadline, adaptive_timeout)
+    if timeout <= 0:
+        for dev_id in allowed:
+            actuator_breakers.release(dev_id)
+        results.update(failed(allowed, DEADLINE_EXPIRED["message"]))
+        return results
+    
+    commands = []
+    for command_id, dev_id in enumerate(allowed):
+        dev = device_registry.get(dev_id)
+        commands.append(actuator_service_pb2.CommandRequest(
+            command_id=command_id,
+            operacao=operation,
+            device=actuator_service_pb2.Request(device_id=dev_id, ip=dev.ip if dev else '', port=dev.port if dev else 0)
+        ))
+    try:
+        batch = grpc_channel_pool.call("ExecutarLote", actuator_service_pb2.BatchRequest(commands=commands, max_parallelism=parallelism),
+                                       timeout=timeout)
+    except grpc.RpcError as e:
+        if e.code() == StatusCode.UNIMPLEMENTED:
+            logger.warning("Ponte gRPC sem ExecutarLote; usando um RPC por atuador")
+            # Nenhum comando chegou aos atuadores: as sondas ficam para os RPCs unários
+            for dev_id in allowed:
+                actuator_breakers.release(dev_id)
+            return None
+        # Como no RPC unário: só o deadline estourado (sem o prazo do cliente encurtá-lo) conta contra os atuadores
+        for dev_id in allowed:
+            if e.code() == StatusCode.DEADLINE_EXCEEDED and timeout >= adaptive_timeout:
+                actuator_breakers.record_failure(dev_id)
+            else:
+                actuator_breakers.release(dev_id)
+        logger.error(f"Erro gRPC no lote de {len(allowed)} atuadores: {e}")
+        results.update(failed(allowed, f"Erro gRPC: {e.details()}"))
+        return results
+    
+    for item in batch.results:
+        if item.command_id >= len(allowed):
+            continue
+        dev_id = allowed[item.command_id]
+        result = apply_grpc_response(dev_id, item.response)
+        record_actuator_result(dev_id, item.response, result, item.latency_ms / 1000)
+        results[dev_id] = smart_city_pb2.DeviceCommandResult(
+            device_id=dev_id,
+            command_status=result["command_status"],
+            message=result["message"],
+            latency_ms=item.latency_ms
+        )
+    # Atuadores sem resultado no lote: nada se sabe sobre eles, devolver as sondas
+    unanswered = [dev_id for dev_id in allowed if dev_id not in results]
+    for dev_id in unanswered:
+        actuator_breakers.release(dev_id)
+    results.update(failed(unanswered, "Sem resposta da ponte gRPC"))
+    return results
+
+def run_bulk_command(device_ids, command_type, command_value, parallelism, deadline=None):
+    """Envia o comando a cada dispositivo no pool compartilhado, no máximo `parallelism` por vez.
+    
+    Os atuadores vão juntos em um único ExecutarLote para a ponte gRPC; os
+    demais dispositivos seguem individualmente, em paralelo com o lote. Os dois
+    dividem o mesmo limite de `parallelism` comandos, proporcionalmente ao
+    número de dispositivos de cada lado (com limite 1, o lote roda primeiro).
+    """
+    batch = None
+    individual = device_ids
+    grpc_command = GRPC_COMMANDS.get(command_type.upper())
+    if grpc_command is not None:
+        actuators = [dev_id for dev_id in device_ids if (dev := device_registry.get(dev_id)) is not None and dev.is_actuator]
+        if len(actuators) > 1:
+            batch = actuators
+            batched = set(actuators)
+            individual = [dev_id for dev_id in device_ids if dev_id not in batched]
+    
+    batch_parallelism = individual_parallelism = parallelism
+    if batch and individual and parallelism > 1:
+        batch_parallelism = min(parallelism - 1, max(1, parallelism * len(batch) // len(device_ids)))
+        individual_parallelism = parallelism - batch_parallelism
+    batch_future = None
+    if batch:
+        batch_future = bulk_command_executor.submit(run_grpc_batch, batch, grpc_command[1], batch_parallelism, deadline)
+        if individual and parallelism == 1:
+            batch_future.result()
+    
+    def run(dev_id, slots):
+        start = time.perf_counter()
+        try:
+            result = send_command_to_device(dev_id, command_type, command_value, deadline)
+        except Exception as e:
+            result = {"command_status": "FAILED", "message": f"Erro interno: {e}"}
+        finally:
+            slots.release()
+        return smart_city_pb2.DeviceCommandResult(
+            device_id=dev_id,
+            command_status=result["command_status"],
             message=result["message"],
-            command_status=result["command_status"]
+            latency_ms=(time.perf_counter() - start) * 1000
         )
     
+    def run_all(dev_ids, limit):
+        slots = threading.BoundedSemaphore(limit)
+        futures = {}
+        for dev_id in dev_ids:
+            slots.acquire()
+            futures[dev_id] = bulk_command_executor.submit(run, dev_id, slots)
+        return {dev_id: future.result() for dev_id, future in futures.items()}
+    
+    results = run_all(individual, individual_parallelism)
+    
+    if batch_future is not None:
+        batch_results = batch_future.result()
+        if batch_results is None:
+            # Ponte antiga: um RPC unário por atuador, já com todas as vagas livres
+            batch_results = run_all(batch, parallelism)
+        results.update(batch_results)
+    
+    return [
+        results[dev_id] if dev_id in results else smart_city_pb2.DeviceCommandResult(
+            device_id=dev_id, command_status="FAILED", message="Sem resposta da ponte gRPC")
+        for dev_id in device_ids
+    ]
+
+def deadline_expired_response():
+    return smart_city_pb2.GatewayResponse(
+        type=smart_city_pb2.GatewayResponse.ResponseType.ERROR,
+        message="Prazo da requisição esgotado antes do processamento"
+    )
+
+def command_ack(result):
+    return smart_city_pb2.GatewayResponse(
+        type=smart_city_pb2.GatewayResponse.ResponseType.COMMAND_ACK,
+        message=result["message"],
+        command_status=result["command_status"]
+    )
+
+def handle_client_request(req, received_at=None):
+    """Atende uma ClientRequest; `received_at` (time.monotonic()) marca o início do prazo do cliente"""
+    deadline = request_deadline(req, received_at)
+    if deadline is not None and time.monotonic() >= deadline:
+        return deadline_expired_response()
+    
+    if req.type == smart_city_pb2.ClientRequest.RequestType.LIST_DEVICES:
+        return list_devices(req)
+    
+    elif req.type == smart_city_pb2.ClientRequest.RequestType.SEND_DEVICE_COMMAND:
+        result = send_command_to_device(req.target_device_id, req.command.command_type, req.command.command_value, deadline)
+        return command_ack(result)
+    
+    elif req.type == smart_city_pb2.ClientRequest.RequestType.BULK_DEVICE_COMMAND:
+        return bulk_device_command(req, deadline)
+    
     elif req.type == smart_city_pb2.ClientRequest.RequestType.GET_DEVICE_STATUS:
         dev_id = req.target_device_id
-        with device_lock:
-            dev = connected_devices.get(dev_id)
+        dev = device_registry.get(dev_id)
         if not dev:
             return smart_city_pb2.GatewayResponse(
                 type=smart_city_pb2.GatewayResponse.ResponseType.ERROR,
@@ -514,23 +1050,11 @@ def handle_client_request(req):
             )
 
         # SENSOR: responder com último dado recebido via MQTT
-        if dev.get('is_sensor', False):
+        if dev.is_sensor:
             logger.info(f"[GATEWAY] Respondendo status do sensor {dev_id} com último dado MQTT recebido")
-            last_data = dev.get('last_data', {})
+            last_data = dev.last_data
             logger.info(f"[DEBUG] last_data recebido via MQTT: {last_data}")
-            status_str = last_data.get('status')
-            if status_str and hasattr(smart_city_pb2.DeviceStatus, status_str):
-                status_enum = getattr(smart_city_pb2.DeviceStatus, status_str)
-            else:
-                status_enum = smart_city_pb2.DeviceStatus.IDLE  # Valor padrão seguro
-            update = smart_city_pb2.DeviceUpdate(
-                device_id=dev_id,
-                type=dev['type'],
-                current_status=status_enum,
-            )
-            if 'temperature' in last_data and 'humidity' in last_data:
-                update.temperature_humidity.temperature = float(last_data['temperature'])
-                update.temperature_humidity.humidity = float(last_data['humidity'])
+            update = build_device_update(dev)
             return smart_city_pb2.GatewayResponse(
                 type=smart_city_pb2.GatewayResponse.ResponseType.DEVICE_STATUS_UPDATE,
                 device_status=update,
@@ -538,9 +1062,9 @@ def handle_client_request(req):
             )
 
         # ATUADOR: obter status via gRPC (mantém igual)
-        elif dev.get('is_actuator', False):
+        elif dev.is_actuator:
             logger.info(f"[GATEWAY] Consultando status do atuador {dev_id} via gRPC")
-            grpc_result = send_grpc_command(dev_id, "GET_STATUS")
+            grpc_result = send_grpc_command(dev_id, "GET_STATUS", deadline=deadline)
             logger.info(f"[DEBUG] grpc_result completo: {grpc_result}")
             if grpc_result["command_status"] == "SUCCESS":
                 status_from_grpc = grpc_result.get('status', 'UNKNOWN_STATUS')
@@ -556,7 +1080,7 @@ def handle_client_request(req):
                 
                 update = smart_city_pb2.DeviceUpdate(
                     device_id=dev_id,
-                    type=dev['type'],
+                    type=dev.type,
                     current_status=status_enum,
                 )
                 return smart_city_pb2.GatewayResponse(
@@ -581,14 +1105,22 @@ def handle_client_request(req):
         message="Tipo de requisição não suportada"
     )
 
-def listen_tcp_connections():
-    """Thread que escuta por conexões TCP"""
+async def handle_sensor_command_async(req, received_at):
+    """SEND_DEVICE_COMMAND para um sensor no modo asyncio, sem ocupar uma thread do executor"""
+    deadline = request_deadline(req, received_at)
+    if deadline is not None and time.monotonic() >= deadline:
+        return deadline_expired_response()
+    result = await send_sensor_command_async(req.target_device_id, req.command.command_type, req.command.command_value, deadline)
+    return command_ack(result)
+
+def listen_tcp_connections(host='0.0.0.0', port=GATEWAY_TCP_PORT, backlog=GATEWAY_TCP_BACKLOG):
+    """Thread que escuta por conexões TCP (modo legado: uma thread por conexão)"""
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind(('0.0.0.0', GATEWAY_TCP_PORT))
-    server_socket.listen(5)
+    server_socket.bind((host, port))
+    server_socket.listen(backlog)
     
-    logger.info(f"Gateway TCP ouvindo na porta {GATEWAY_TCP_PORT}")
+    logger.info(f"Gateway TCP ouvindo na porta {port} (modo threaded, backlog={backlog})")
     
     while True:
         try:
@@ -597,54 +1129,219 @@ def listen_tcp_connections():
         except Exception as e:
             logger.error(f"Erro ao aceitar conexão TCP: {e}")
 
+# === SERVIDOR TCP ASSÍNCRONO ===
+async def handle_tcp_connection_async(reader, writer, semaphore, executor):
+    """Gerencia uma conexão TCP persistente no event loop.
+    
+    O registro de dispositivos é rápido e roda direto no loop; requisições de
+    clientes podem bloquear (gRPC/MQTT) e por isso vão para o executor. Várias
+    requisições da mesma conexão são atendidas em paralelo (pipelining) e as
+    respostas voltam na ordem em que ficam prontas, identificadas pelo request_id.
+    """
+    addr = writer.get_extra_info('peername')
+    loop = asyncio.get_running_loop()
+    inflight = asyncio.Semaphore(GATEWAY_TCP_MAX_INFLIGHT_PER_CONN)
+    frames = AsyncDelimitedReader(reader)
+    pending = set()
+    
+    subscriber = None
+    stream_task = None
+    
+    async def stream_events():
+        try:
+            while not subscriber.closed:
+                await subscriber.wait()
+                frames = subscriber.drain()
+                if frames:
+                    writer.write(b''.join(frames))
+                    await writer.drain()
+        except Exception as e:
+            subscriber.close_reason = f"erro de envio: {e}"
+        # Assinante encerrado (lento ou gateway encerrando): derrubar a conexão
+        writer.close()
+    
+    async def process_request(client_request, received_at):
+        try:
+            dev = None
+            if client_request.type == smart_city_pb2.ClientRequest.RequestType.SEND_DEVICE_COMMAND:
+                dev = device_registry.get(client_request.target_device_id)
+            if dev is not None and dev.is_sensor:
+                # Comando MQTT: a espera pela resposta do sensor fica no event loop
+                response = await handle_sensor_command_async(client_request, received_at)
+            else:
+                # O prazo conta desde a chegada, incluindo a espera por uma thread do executor
+                response = await loop.run_in_executor(executor, handle_client_request, client_request, received_at)
+            writer.write(build_response_frame(response, client_request.request_id))
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Erro ao responder requisição {client_request.request_id} de {addr}: {e}")
+        finally:
+            inflight.release()
+    
+    async with semaphore:
+        logger.debug(f"Conexão TCP de {addr}")
+        try:
+            while True:
+                try:
+                    # Conexões assinantes podem passar muito tempo sem enviar nada
+                    idle_timeout = None if subscriber is not None else GATEWAY_TCP_IDLE_TIMEOUT
+                    message_data = await asyncio.wait_for(frames.read_message(), idle_timeout)
+                except asyncio.TimeoutError:
+                    logger.debug(f"Conexão TCP de {addr} encerrada por inatividade")
+                    break
+                if message_data is None:
+                    break
+                envelope = parse_envelope(message_data)
+                
+                if envelope.message_type == smart_city_pb2.MessageType.DEVICE_INFO:
+                    register_device(envelope.device_info)
+                    
+                elif (envelope.message_type == smart_city_pb2.MessageType.CLIENT_REQUEST
+                      and envelope.client_request.type == smart_city_pb2.ClientRequest.RequestType.SUBSCRIBE):
+                    client_request = envelope.client_request
+                    if subscriber is not None:
+                        response = smart_city_pb2.GatewayResponse(
+                            type=smart_city_pb2.GatewayResponse.ResponseType.ERROR,
+                            message="Conexão já possui uma assinatura ativa"
+                        )
+                        writer.write(build_response_frame(response, client_request.request_id))
+                        continue
+                    subscriber = new_subscriber(AsyncSubscriber, f"{addr[0]}:{addr[1]}", client_request, loop)
+                    # Confirmação antes de qualquer evento
+                    writer.write(build_response_frame(subscribed_response(subscriber), client_request.request_id))
+                    device_subscriptions.add(subscriber)
+                    stream_task = asyncio.create_task(stream_events())
+                    
+                elif envelope.message_type == smart_city_pb2.MessageType.CLIENT_REQUEST:
+                    received_at = time.monotonic()
+                    await inflight.acquire()
+                    task = asyncio.create_task(process_request(envelope.client_request, received_at))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    
+        except Exception as e:
+            logger.error(f"Erro na conexão TCP de {addr}: {e}")
+        finally:
+            if subscriber is not None:
+                subscriber.close_reason = subscriber.close_reason or "cliente fechou a conexão"
+                device_subscriptions.remove(subscriber)
+                stream_task.cancel()
+                await asyncio.gather(stream_task, return_exceptions=True)
+            # Cliente pode fechar o lado de escrita e ainda aguardar respostas
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+async def serve_tcp_async(host='0.0.0.0', port=GATEWAY_TCP_PORT, backlog=GATEWAY_TCP_BACKLOG,
+                          max_concurrency=GATEWAY_TCP_MAX_CONCURRENCY, workers=GATEWAY_TCP_WORKERS,
+                          started=None):
+    """Servidor TCP asyncio: registro e ClientRequest em um único event loop"""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tcp-request")
+    
+    server = await asyncio.start_server(
+        lambda r, w: handle_tcp_connection_async(r, w, semaphore, executor),
+        host, port, backlog=backlog, reuse_address=True
+    )
+    logger.info(f"Gateway TCP ouvindo na porta {port} (modo asyncio, backlog={backlog}, concorrência={max_concurrency})")
+    if started is not None:
+        started.set()
+    
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+def listen_tcp_connections_async(**kwargs):
+    """Thread que executa o event loop do servidor TCP asyncio"""
+    try:
+        asyncio.run(serve_tcp_async(**kwargs))
+    except Exception as e:
+        logger.error(f"Erro no servidor TCP asyncio: {e}")
+
 # === MAIN ===
 def main():
+    global sensor_history, sensor_rollups
     logger.info("=== SMART CITY GATEWAY (MQTT + gRPC) ===")
     
+    # Histórico e agregados antes do MQTT: os workers de ingestão gravam neles
+    sensor_history = HistoryStore(HISTORY_DIR, segment_capacity=HISTORY_SEGMENT_CAPACITY, retention=HISTORY_RETENTION)
+    sensor_rollups = RollupStore(ROLLUP_DIR, retention=ROLLUP_RETENTION)
+    
     # Configurar MQTT
     if not setup_mqtt():
         logger.error("Falha ao configurar MQTT, terminando...")
+        sensor_ingest.stop()
+        sensor_history.close()
+        sensor_rollups.close()
         return
     
     # Iniciar threads
     multicast_thread = threading.Thread(target=multicast_discovery, daemon=True)
-    tcp_thread = threading.Thread(target=listen_tcp_connections, daemon=True)
+    if GATEWAY_TCP_MODE == "asyncio":
+        tcp_thread = threading.Thread(target=listen_tcp_connections_async, daemon=True)
+    else:
+        tcp_thread = threading.Thread(target=listen_tcp_connections, daemon=True)
+    
+    # Abrir o canal com a ponte já na inicialização (o primeiro comando não paga o handshake)
+    if grpc_channel_pool.wait_until_ready(GRPC_STARTUP_READY_TIMEOUT):
+        logger.info(f"Canal gRPC com a ponte {GRPC_SERVER_HOST}:{GRPC_SERVER_PORT} pronto")
+    else:
+        logger.warning(f"Ponte gRPC {GRPC_SERVER_HOST}:{GRPC_SERVER_PORT} indisponível; o canal continua tentando reconectar")
     
     multicast_thread.start()
     tcp_thread.start()
     
     logger.info("Gateway iniciado com sucesso!")
     logger.info(f"- Descoberta multicast: {MULTICAST_GROUP}:{MULTICAST_PORT}")
-    logger.info(f"- Registro TCP: porta {GATEWAY_TCP_PORT}")
+    logger.info(f"- Registro TCP: porta {GATEWAY_TCP_PORT} (modo {GATEWAY_TCP_MODE})")
     logger.info(f"- MQTT Broker: {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}")
     logger.info("- Comandos para sensores: MQTT")
     logger.info("- Comandos para atuadores: gRPC")
     
+    last_metrics_log = time.time()
+    last_retention_check = 0
     try:
         while True:
             time.sleep(1)
             
-            # Limpeza periódica de dispositivos offline
             current_time = time.time()
-            with device_lock:
-                offline_devices = [
-                    dev_id for dev_id, dev_data in connected_devices.items()
-                    if current_time - dev_data['last_seen'] > 15  # 15 segundos
-                ]
-                
-                for dev_id in offline_devices:
-                    logger.info(f"Removendo dispositivo offline: {dev_id}")
-                    del connected_devices[dev_id]
             
-            # Limpeza de respostas MQTT antigas
-            with mqtt_response_lock:
-                old_responses = [
-                    req_id for req_id, resp_data in mqtt_responses.items()
-                    if current_time - resp_data.get('timestamp', 0) / 1000 > 15  # 15 segundos
-                ]
-                
-                for req_id in old_responses:
-                    del mqtt_responses[req_id]
+            if current_time - last_metrics_log >= METRICS_LOG_INTERVAL:
+                last_metrics_log = current_time
+                metrics = grpc_channel_pool.get_metrics()
+                if not grpc_channel_pool.is_healthy():
+                    logger.warning(f"Canal gRPC com a ponte sem conexão (estado {metrics['state']})")
+                if metrics['rpc_calls']:
+                    logger.info(f"Métricas gRPC: {metrics}")
+                    logger.info(f"Métricas dos circuitos de atuadores: {actuator_breakers.get_metrics()}")
+                logger.info(f"Métricas de ingestão MQTT: {sensor_ingest.get_metrics()}")
+                logger.info(f"Métricas do histórico: {sensor_history.get_metrics()}")
+                logger.info(f"Métricas dos agregados: {sensor_rollups.get_metrics()}")
+                if device_subscriptions.has_subscribers:
+                    logger.info(f"Métricas de assinaturas: {device_subscriptions.get_metrics()}")
+            
+            # Expiração de dispositivos offline (apenas os prazos vencidos são visitados)
+            device_registry.expire(current_time)
+            
+            # Expirar comandos MQTT abandonados (apenas os vencidos são visitados)
+            mqtt_pending.expire()
+            
+            # Retenção do histórico (remove segmentos inteiros antigos)
+            if current_time - last_retention_check >= HISTORY_RETENTION_CHECK_INTERVAL:
+                last_retention_check = current_time
+                try:
+                    removed = sensor_history.enforce_retention(current_time)
+                    removed += sensor_rollups.enforce_retention(current_time)
+                    if removed:
+                        logger.info(f"Retenção do histórico: {removed} segmentos removidos")
+                except OSError as e:
+                    logger.error(f"Erro na retenção do histórico: {e}")
     
     except KeyboardInterrupt:
         logger.info("Gateway interrompido pelo usuário")
@@ -654,6 +1351,12 @@ def main():
         if mqtt_client:
             mqtt_client.loop_stop()
             mqtt_client.disconnect()
+        sensor_ingest.stop()
+        bulk_command_executor.shutdown(wait=False)
+        device_subscriptions.close_all()
+        sensor_history.close()
+        sensor_rollups.close()
+        grpc_channel_pool.close()
         logger.info("Gateway finalizado")
 
 if __name__ == "__main__":
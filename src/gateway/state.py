@@ -1,5 +1,392 @@
+"""
+Estado dos dispositivos conectados ao Gateway
+
+DeviceRegistry substitui o antigo par connected_devices/device_lock. Os
+registros ficam em N partições (lock striping), cada uma com seu próprio lock
+de escrita, de modo que atualizações de dispositivos diferentes não disputam
+um lock global.
+
+Leituras não usam lock: cada partição publica um dicionário que nunca é
+alterado depois de publicado (copy-on-write). Inserções e remoções trocam o
+dicionário da partição por uma cópia; atualizações de campos (dados MQTT,
+status, last_seen) alteram o próprio DeviceRecord sob o lock da partição.
+Assim LIST_DEVICES e consultas de status nunca bloqueiam a ingestão.
+
+A expiração por inatividade usa um heap de prazos com remoção preguiçosa: cada
+dispositivo tem no máximo uma entrada no heap, atualizar last_seen não mexe no
+heap e expire() só visita entradas vencidas (reagendando as que receberam
+atividade nesse meio tempo). O TTL pode variar por tipo de dispositivo.
+Entradas e saídas de dispositivos são notificadas aos ouvintes registrados
+com add_listener() como eventos DEVICE_ONLINE / DEVICE_OFFLINE.
+
+Índices secundários (tipo, status, sensor/atuador e sub-rede do IP) são
+mantidos incrementalmente em registro, atualização e remoção: cada escrita
+compara os campos indexados antes e depois e só mexe nos índices quando algum
+mudou (o caso comum, uma leitura de sensor, custa uma comparação de tupla).
+query() parte do menor conjunto candidato, de modo que consultas filtradas
+custam O(tamanho do resultado) em vez de varrer todos os dispositivos.
+"""
+
+import heapq
+import ipaddress
+import itertools
+import logging
 import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Set, Tuple
+
+DEFAULT_STRIPES = 64  # Mais partições = cópias menores em inserções (copy-on-write)
+DEFAULT_TTL = 15.0  # Segundos sem atividade até o dispositivo ser considerado offline
+DEFAULT_SUBNET_PREFIX = 24  # Tamanho do prefixo das sub-redes no índice por IP (IPv4)
+
+# Eventos de ciclo de vida emitidos pelo registro
+DEVICE_ONLINE = "online"
+DEVICE_OFFLINE = "offline"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class DeviceRecord:
+    """Dados de um dispositivo registrado"""
+    id: str
+    type: int
+    ip: str
+    port: int
+    status: int
+    is_actuator: bool
+    is_sensor: bool
+    last_seen: float = field(default_factory=time.time)
+    capabilities: Dict[str, str] = field(default_factory=dict)
+    is_mqtt_sensor: bool = False
+    mqtt_command_topic: str = ""
+    mqtt_response_topic: str = ""
+    last_data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0  # Prazo agendado no heap de expiração
+
+
+class _Stripe:
+    __slots__ = ('lock', 'devices')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices: Dict[str, DeviceRecord] = {}
+
+
+# Campos preservados quando um dispositivo já registrado se registra de novo
+_PRESERVED_ON_REREGISTER = ('last_data', 'expires_at')
+_UPDATED_ON_REREGISTER = tuple(name for name in DeviceRecord.__slots__ if name not in _PRESERVED_ON_REREGISTER)
+
+
+class DeviceRegistry:
+    """Registro de dispositivos com locks por partição e leituras sem lock"""
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES, ttl_for: Optional[Callable[[DeviceRecord], float]] = None,
+                 subnet_prefix: int = DEFAULT_SUBNET_PREFIX):
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self.subnet_prefix = subnet_prefix
+        # Índices secundários: valor -> ids. Alterados só sob _index_lock, sempre
+        # depois do lock da partição (ordem fixa: partição -> índice)
+        self._index_lock = threading.Lock()
+        self._indexed: Dict[str, tuple] = {}  # device_id -> ((tipo, status, sensor, atuador, ip), sub-rede)
+        self._by_type: Dict[int, Set[str]] = {}
+        self._by_status: Dict[int, Set[str]] = {}
+        self._by_subnet: Dict[Any, Set[str]] = {}
+        self._sensors: Set[str] = set()
+        self._actuators: Set[str] = set()
+        self._ttl_for = ttl_for or (lambda record: DEFAULT_TTL)
+        self._expiry_lock = threading.Lock()
+        self._expiry_heap = []  # (prazo, seq, device_id)
+        self._expiry_seq = itertools.count()
+        self._listeners: List[Callable[[str, DeviceRecord], None]] = []
+
+    # === Eventos ===
+    def add_listener(self, listener: Callable[[str, DeviceRecord], None]):
+        """Registra um ouvinte chamado como listener(evento, registro)"""
+        self._listeners.append(listener)
+
+    def _emit(self, event: str, record: DeviceRecord):
+        for listener in self._listeners:
+            try:
+                listener(event, record)
+            except Exception as e:
+                logger.error(f"Erro no ouvinte de eventos do registro ({event} {record.id}): {e}")
+
+    def _schedule(self, record: DeviceRecord, deadline: float):
+        record.expires_at = deadline
+        with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, (deadline, next(self._expiry_seq), record.id))
+
+    # === Índices secundários ===
+    def _subnet(self, ip: str):
+        try:
+            return ipaddress.ip_network(f"{ip}/{self.subnet_prefix}", strict=False)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _index_add(index: Dict[Any, Set[str]], value, device_id: str):
+        ids = index.get(value)
+        if ids is None:
+            ids = index[value] = set()
+        ids.add(device_id)
+
+    @staticmethod
+    def _index_discard(index: Dict[Any, Set[str]], value, device_id: str):
+        ids = index.get(value)
+        if ids is not None:
+            ids.discard(device_id)
+            if not ids:
+                del index[value]
+
+    def _reindex(self, record: DeviceRecord, removed: bool = False):
+        """Atualiza os índices do dispositivo; chamado sob o lock da partição dele"""
+        key = None if removed else (record.type, record.status, record.is_sensor, record.is_actuator, record.ip)
+        old = self._indexed.get(record.id)
+        # Sem lock: só quem detém o lock da partição altera a entrada deste dispositivo
+        if (old[0] if old else None) == key:
+            return
+        device_id = record.id
+        with self._index_lock:
+            if old is not None:
+                (old_type, old_status, old_sensor, old_actuator, old_ip), old_subnet = old
+                self._index_discard(self._by_type, old_type, device_id)
+                self._index_discard(self._by_status, old_status, device_id)
+                self._index_discard(self._by_subnet, old_subnet, device_id)
+                self._sensors.discard(device_id)
+                self._actuators.discard(device_id)
+            if key is None:
+                self._indexed.pop(device_id, None)
+                return
+            subnet = old[1] if old is not None and old[0][4] == record.ip else self._subnet(record.ip)
+            self._indexed[device_id] = (key, subnet)
+            self._index_add(self._by_type, record.type, device_id)
+            self._index_add(self._by_status, record.status, device_id)
+            if subnet is not None:
+                self._index_add(self._by_subnet, subnet, device_id)
+            if record.is_sensor:
+                self._sensors.add(device_id)
+            if record.is_actuator:
+                self._actuators.add(device_id)
+
+    def _candidates(self, types, statuses, is_sensor, is_actuator, subnet) -> Optional[Set[str]]:
+        """Ids que podem atender aos filtros (None = sem filtro indexável, todos)"""
+        with self._index_lock:
+            sets = []
+            if types:
+                sets.append(set().union(*(self._by_type.get(t, ()) for t in types)))
+            if statuses:
+                sets.append(set().union(*(self._by_status.get(s, ()) for s in statuses)))
+            # is_sensor/is_actuator=False são o complemento: ficam para a verificação final
+            if is_sensor:
+                sets.append(self._sensors)
+            if is_actuator:
+                sets.append(self._actuators)
+            if subnet is not None:
+                if subnet.prefixlen >= self.subnet_prefix:
+                    sets.append(self._by_subnet.get(subnet.supernet(new_prefix=self.subnet_prefix), set()))
+                else:
+                    sets.append(set().union(*(ids for net, ids in self._by_subnet.items()
+                                              if net.version == subnet.version and net.subnet_of(subnet))))
+            if not sets:
+                return None
+            sets.sort(key=len)
+            result = set(sets[0])
+            for ids in sets[1:]:
+                result.intersection_update(ids)
+                if not result:
+                    break
+            return result
+
+    def _stripe(self, device_id: str) -> _Stripe:
+        return self._stripes[hash(device_id) % len(self._stripes)]
+
+    # === Leituras (sem lock) ===
+    def get(self, device_id: str) -> Optional[DeviceRecord]:
+        return self._stripe(device_id).devices.get(device_id)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._stripe(device_id).devices
+
+    def __len__(self) -> int:
+        return sum(len(stripe.devices) for stripe in self._stripes)
+
+    def __iter__(self) -> Iterator[DeviceRecord]:
+        for stripe in self._stripes:
+            yield from stripe.devices.values()
+
+    def snapshot(self) -> List[DeviceRecord]:
+        """Lista consistente por partição dos dispositivos registrados"""
+        records = []
+        for stripe in self._stripes:
+            records.extend(stripe.devices.values())
+        return records
+
+    def query(self, types: Optional[Collection[int]] = None, statuses: Optional[Collection[int]] = None,
+              is_sensor: Optional[bool] = None, is_actuator: Optional[bool] = None, subnet: Optional[str] = None,
+              after: str = "", limit: int = 0) -> Tuple[List[DeviceRecord], int, bool]:
+        """Dispositivos que atendem aos filtros, em ordem de device_id, a partir do cursor `after`.
+
+        `subnet` é uma rede em notação CIDR (ex.: "192.168.1.0/24"). Retorna
+        (página, total que atende aos filtros, há mais páginas). Com limit=0 a
+        página contém todos os dispositivos depois do cursor.
+        Levanta ValueError se `subnet` for inválida.
+        """
+        network = ipaddress.ip_network(subnet, strict=False) if subnet else None
+        candidates = self._candidates(types, statuses, is_sensor, is_actuator, network)
+        if candidates is None:
+            records = self
+        else:
+            records = (record for record in map(self.get, candidates) if record is not None)
+        # Verificação exata: os índices só reduzem os candidatos
+        matches = [
+            record for record in records
+            if (not types or record.type in types)
+            and (not statuses or record.status in statuses)
+            and (is_sensor is None or record.is_sensor == is_sensor)
+            and (is_actuator is None or record.is_actuator == is_actuator)
+            and (network is None or self._in_network(record.ip, network))
+        ]
+        total = len(matches)
+        if after:
+            matches = [record for record in matches if record.id > after]
+        if limit and len(matches) > limit:
+            # O(n log limit) em vez de ordenar todos os dispositivos
+            return heapq.nsmallest(limit, matches, key=lambda record: record.id), total, True
+        matches.sort(key=lambda record: record.id)
+        return matches, total, False
+
+    @staticmethod
+    def _in_network(ip: str, network) -> bool:
+        try:
+            return ipaddress.ip_address(ip) in network
+        except ValueError:
+            return False
+
+    # === Escritas (lock da partição) ===
+    def register(self, record: DeviceRecord) -> bool:
+        """Insere ou atualiza um dispositivo; retorna True se for um registro novo.
+
+        Em re-registros o mesmo DeviceRecord é atualizado, preservando last_data.
+        """
+        stripe = self._stripe(record.id)
+        with stripe.lock:
+            current = stripe.devices.get(record.id)
+            if current is None:
+                devices = dict(stripe.devices)
+                devices[record.id] = record
+                stripe.devices = devices
+                self._schedule(record, record.last_seen + self._ttl_for(record))
+                self._reindex(record)
+            else:
+                for name in _UPDATED_ON_REREGISTER:
+                    setattr(current, name, getattr(record, name))
+                if record.last_data:
+                    current.last_data = record.last_data
+                self._reindex(current)
+                return False
+        self._emit(DEVICE_ONLINE, record)
+        return True
+
+    def update(self, device_id: str, mutate: Callable[[DeviceRecord], None]) -> Optional[DeviceRecord]:
+        """Aplica `mutate` ao registro sob o lock da partição; None se não registrado"""
+        stripe = self._stripe(device_id)
+        with stripe.lock:
+            record = stripe.devices.get(device_id)
+            if record is not None:
+                mutate(record)
+                self._reindex(record)
+            return record
+
+    def update_many(self, updates: Dict[str, Callable[[DeviceRecord], None]]) -> List[str]:
+        """Aplica várias atualizações com um lock por partição; retorna os ids não registrados"""
+        by_stripe: Dict[int, List[str]] = {}
+        for device_id in updates:
+            by_stripe.setdefault(hash(device_id) % len(self._stripes), []).append(device_id)
+        missing = []
+        for stripe_index, device_ids in by_stripe.items():
+            stripe = self._stripes[stripe_index]
+            with stripe.lock:
+                devices = stripe.devices
+                for device_id in device_ids:
+                    record = devices.get(device_id)
+                    if record is None:
+                        missing.append(device_id)
+                    else:
+                        updates[device_id](record)
+                        self._reindex(record)
+        return missing
+
+    def remove(self, device_id: str) -> Optional[DeviceRecord]:
+        """Remove um dispositivo (a entrada no heap de expiração é descartada ao vencer)"""
+        stripe = self._stripe(device_id)
+        with stripe.lock:
+            if device_id not in stripe.devices:
+                return None
+            devices = dict(stripe.devices)
+            record = devices.pop(device_id)
+            stripe.devices = devices
+            self._reindex(record, removed=True)
+        self._emit(DEVICE_OFFLINE, record)
+        return record
+
+    def expire(self, now: Optional[float] = None) -> List[DeviceRecord]:
+        """Remove dispositivos cujo TTL venceu; custo proporcional às entradas vencidas"""
+        if now is None:
+            now = time.time()
+        due: Dict[int, List[tuple]] = {}
+        with self._expiry_lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                deadline, _, device_id = heapq.heappop(heap)
+                stripe_index = hash(device_id) % len(self._stripes)
+                due.setdefault(stripe_index, []).append((deadline, device_id))
+
+        removed = []
+        reschedule = []
+        # Uma aquisição de lock e uma cópia do dicionário por partição afetada
+        for stripe_index, entries in due.items():
+            stripe = self._stripes[stripe_index]
+            with stripe.lock:
+                devices = None
+                for deadline, device_id in entries:
+                    record = stripe.devices.get(device_id)
+                    # Entrada obsoleta: dispositivo removido ou reagendado depois
+                    if record is None or record.expires_at != deadline:
+                        continue
+                    actual = record.last_seen + self._ttl_for(record)
+                    if actual > now:
+                        # Houve atividade desde o agendamento: reagendar
+                        record.expires_at = actual
+                        reschedule.append((actual, device_id))
+                        continue
+                    if devices is None:
+                        devices = dict(stripe.devices)
+                    del devices[device_id]
+                    self._reindex(record, removed=True)
+                    removed.append(record)
+                if devices is not None:
+                    stripe.devices = devices
+
+        if reschedule:
+            with self._expiry_lock:
+                for deadline, device_id in reschedule:
+                    heapq.heappush(self._expiry_heap, (deadline, next(self._expiry_seq), device_id))
+        for record in removed:
+            self._emit(DEVICE_OFFLINE, record)
+        return removed
 
-# Estado global dos dispositivos
-connected_devices = {}
-device_lock = threading.Lock()
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.devices = {}
+        with self._expiry_lock:
+            self._expiry_heap = []
+        with self._index_lock:
+            self._indexed = {}
+            self._by_type = {}
+            self._by_status = {}
+            self._by_subnet = {}
+            self._sensors = set()
+            self._actuators = set()
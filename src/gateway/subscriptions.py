@@ -0,0 +1,221 @@
+"""
+Assinaturas de eventos de dispositivos (ClientRequest SUBSCRIBE)
+
+Um cliente que envia SUBSCRIBE mantém a conexão TCP aberta e passa a receber
+mensagens delimitadas DEVICE_EVENT (leituras/mudanças de status, registros e
+saídas por inatividade) em vez de consultar o gateway periodicamente.
+
+- Os eventos nascem em várias threads (workers de ingestão MQTT, requisições
+  gRPC, expiração do registro); cada evento é serializado UMA vez e o mesmo
+  quadro é entregue a todos os assinantes cujo filtro aceita o dispositivo
+- Filtros no servidor: conjunto de tipos de dispositivo e prefixo de device_id
+- Cada assinante tem um buffer limitado. Se ele não consome a tempo, o quadro
+  mais antigo é descartado (o próximo evento do dispositivo traz o estado
+  atual) e o assinante passa a ser considerado lento; se continuar com o
+  buffer cheio por mais de `slow_timeout` segundos, é desconectado
+- Sem assinantes, publish() não constrói nem serializa nada
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 1024
+DEFAULT_SLOW_TIMEOUT = 10.0
+
+
+class Subscriber:
+    """Buffer limitado de quadros de um assinante, com filtro por tipo e prefixo"""
+
+    def __init__(self, name: str, device_types: Iterable[int] = (), device_id_prefix: str = "",
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, slow_timeout: float = DEFAULT_SLOW_TIMEOUT):
+        self.name = name
+        self.device_types = frozenset(device_types)
+        self.device_id_prefix = device_id_prefix
+        self.buffer_size = buffer_size
+        self.slow_timeout = slow_timeout
+        self._lock = threading.Lock()
+        self._buffer = deque()
+        self._slow_since: Optional[float] = None
+        self.closed = False
+        self.close_reason = ""
+        self.slow_disconnect = False
+        self.delivered = 0
+        self.dropped = 0
+
+    def matches(self, device_type: int, device_id: str) -> bool:
+        if self.device_types and device_type not in self.device_types:
+            return False
+        return device_id.startswith(self.device_id_prefix)
+
+    def offer(self, frame: bytes, now: float) -> bool:
+        """Enfileira um quadro; retorna False se o assinante foi (ou já estava) desconectado"""
+        wake = False
+        with self._lock:
+            if self.closed:
+                return False
+            if len(self._buffer) >= self.buffer_size:
+                self._buffer.popleft()
+                self.dropped += 1
+                if self._slow_since is None:
+                    self._slow_since = now
+                    logger.warning(f"Assinante {self.name} lento: buffer de {self.buffer_size} eventos cheio, descartando os mais antigos")
+                elif now - self._slow_since > self.slow_timeout:
+                    self.closed = self.slow_disconnect = True
+                    self.close_reason = f"consumidor lento (buffer cheio há mais de {self.slow_timeout:.0f}s)"
+                    self._buffer.clear()
+                    wake = True
+                    frame = None
+            elif self._slow_since is not None and len(self._buffer) < self.buffer_size // 2:
+                self._slow_since = None
+            if frame is not None:
+                self._buffer.append(frame)
+                # Só acordar o consumidor na transição vazio -> não vazio
+                wake = len(self._buffer) == 1
+        if wake:
+            self._notify()
+        return not self.closed
+
+    def drain(self) -> List[bytes]:
+        """Retira todos os quadros pendentes"""
+        with self._lock:
+            frames = list(self._buffer)
+            self._buffer.clear()
+            self._slow_since = None
+            self.delivered += len(frames)
+        return frames
+
+    def close(self, reason: str = ""):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.close_reason = reason
+            self._buffer.clear()
+        self._notify()
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def _notify(self):
+        pass
+
+
+class ThreadSubscriber(Subscriber):
+    """Assinante consumido por uma thread (modo TCP threaded)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ready = threading.Event()
+
+    def _notify(self):
+        self._ready.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Aguarda quadros (ou o fechamento); retorna False no timeout"""
+        if self._ready.wait(timeout):
+            self._ready.clear()
+            return True
+        return False
+
+
+class AsyncSubscriber(Subscriber):
+    """Assinante consumido por uma corrotina (modo TCP asyncio)
+
+    offer() é chamado de outras threads, então o acordar passa por
+    call_soon_threadsafe para o loop dono da conexão.
+    """
+
+    def __init__(self, loop, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # Loop já encerrado
+
+    async def wait(self):
+        await self._ready.wait()
+        self._ready.clear()
+
+
+class SubscriptionManager:
+    """Registro de assinantes e distribuição dos eventos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Tuple[Subscriber, ...] = ()  # copy-on-write: publish() itera sem lock
+        self._sequence = itertools.count(1)
+        self.published = 0
+        self.delivered_frames = 0
+        self.slow_disconnects = 0
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def add(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers = self._subscribers + (subscriber,)
+        logger.info(f"Assinante {subscriber.name} conectado ({len(self._subscribers)} ativos)")
+
+    def remove(self, subscriber: Subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+            if subscriber.slow_disconnect:
+                self.slow_disconnects += 1
+        subscriber.close(subscriber.close_reason or "desconectado")
+        logger.info(f"Assinante {subscriber.name} removido: {subscriber.close_reason} "
+                    f"(entregues={subscriber.delivered}, descartados={subscriber.dropped})")
+
+    def publish(self, device_type: int, device_id: str, build_frame: Callable[[int], bytes]) -> int:
+        """Entrega um evento aos assinantes interessados.
+
+        `build_frame(sequence)` só é chamado se algum assinante aceitar o
+        dispositivo. Retorna quantos assinantes receberam o evento.
+        """
+        subscribers = self._subscribers
+        if not subscribers:
+            return 0
+        targets = [s for s in subscribers if s.matches(device_type, device_id)]
+        if not targets:
+            return 0
+        sequence = next(self._sequence)
+        frame = build_frame(sequence)
+        now = time.monotonic()
+        delivered = 0
+        for subscriber in targets:
+            if subscriber.offer(frame, now):
+                delivered += 1
+            elif subscriber.slow_disconnect:
+                self.remove(subscriber)
+        self.published += 1
+        self.delivered_frames += delivered
+        return delivered
+
+    def get_metrics(self) -> dict:
+        subscribers = self._subscribers
+        return {
+            'subscribers': len(subscribers),
+            'published': self.published,
+            'delivered_frames': self.delivered_frames,
+            'pending': sum(s.pending() for s in subscribers),
+            'dropped': sum(s.dropped for s in subscribers),
+            'slow_disconnects': self.slow_disconnects,
+        }
+
+    def close_all(self, reason: str = "gateway encerrando"):
+        for subscriber in self._subscribers:
+            subscriber.close_reason = reason
+            self.remove(subscriber)
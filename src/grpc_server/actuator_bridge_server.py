@@ -9,8 +9,25 @@ TCP que são enviados diretamente aos dispositivos.
 Funcionalidades:
 - Recebe chamadas gRPC do Gateway
 - Traduz comandos gRPC para mensagens Protocol Buffers
-- Estabelece conexões TCP com atuadores
+- Estabelece conexões TCP com atuadores, reaproveitadas entre comandos por um
+  pool por dispositivo (sonda de vida, expiração por ociosidade, reconexão)
 - Retorna status das operações
+- Comandos em lote (ExecutarLote) e em fluxo bidirecional (FluxoComandos),
+  executados em paralelo por um pool de threads compartilhado
+- Fila por dispositivo: comandos para o mesmo relé são enviados um de cada
+  vez, em ordem, e cliques repetidos pendentes se reduzem ao último
+- Circuit breaker por dispositivo: após falhas seguidas os comandos são
+  recusados na hora até uma sonda voltar a ter resposta; o timeout de cada
+  dispositivo acompanha as latências observadas (até TIMEOUT_TCP)
+- Cache de estado: ConsultarEstado logo após um comando é respondido com o
+  DeviceUpdate que o próprio comando trouxe (Request.force_refresh força a
+  leitura no dispositivo)
+- Deadlines: o prazo do RPC (definido pelo gateway a partir do prazo do
+  cliente) limita a espera na fila e o I/O com o dispositivo; no modo
+  grpc.aio o I/O é cancelado quando o RPC expira
+- Modo grpc.aio (GRPC_SERVER_MODE = "asyncio"): RPCs e I/O TCP com os
+  dispositivos no mesmo event loop, sem uma thread bloqueada por comando;
+  o modo "threaded" mantém o servidor com pool de threads
 
 Arquitetura:
 Gateway (gRPC Client) -> Servidor gRPC (Raspberry Pi) -> Atuadores TCP
@@ -19,10 +36,11 @@ Uso:
     python3 grpc_actuator_server.py
 """
 
+import asyncio
 import grpc
 from concurrent import futures
-import socket
 import logging
+import queue
 import sys
 import os
 import time
@@ -41,6 +59,10 @@ try:
     import smart_city_pb2
     import actuator_service_pb2
     import actuator_service_pb2_grpc
+    from device_connection_pool import AsyncDeviceConnectionPool, DeviceConnectionPool
+    from device_state_cache import DeviceStateCache
+    from device_command_queue import AsyncDeviceCommandQueue, DeviceCommandQueue
+    from circuit_breaker import DeviceCircuitBreakers
 except ImportError as e:
     print(f"Erro ao importar proto files: {e}")
     print("Execute: ")
@@ -58,25 +80,118 @@ logger = logging.getLogger(__name__)
 
 # Configurações do servidor
 GRPC_PORT = 50051
-TIMEOUT_TCP = 5  # Timeout para conexões TCP com dispositivos
+GRPC_SERVER_MODE = "asyncio"  # "asyncio" (grpc.aio + asyncio streams) ou "threaded" (pool de threads, legado)
+TIMEOUT_TCP = 5  # Timeout máximo para conexões TCP com dispositivos (o efetivo se adapta à latência de cada um)
+GRPC_MAX_WORKERS = 10           # Threads do servidor gRPC (um fluxo FluxoComandos ocupa uma enquanto aberto)
+COMMAND_WORKERS = 32            # Threads que executam os comandos de lotes e fluxos
+BATCH_DEFAULT_PARALLELISM = 16  # Comandos simultâneos por lote quando max_parallelism = 0
+STREAM_MAX_INFLIGHT = 64        # Comandos em andamento por fluxo antes de parar de ler (contrapressão)
+POOL_IDLE_TIMEOUT = 60          # Segundos que uma conexão ociosa com um dispositivo fica aberta
+POOL_MAX_IDLE_PER_DEVICE = 2    # Conexões ociosas guardadas por dispositivo
+POOL_PRUNE_INTERVAL = 15        # Intervalo da limpeza/sonda das conexões ociosas
+METRICS_LOG_INTERVAL = 60       # Intervalo do log de métricas (pool de conexões, cache de estado e fila de comandos)
+GRPC_AIO_MAX_CONCURRENT_RPCS = 10000  # RPCs simultâneos aceitos no modo asyncio
+ASYNC_MAX_INFLIGHT_COMMANDS = 4096    # Comandos com I/O em andamento nos dispositivos (sockets abertos)
+# Aceitar o keepalive do canal do gateway (ping a cada 30 s, inclusive ocioso); sem isso
+# a política padrão responde GOAWAY too_many_pings e o canal é derrubado
+GRPC_SERVER_OPTIONS = [
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_recv_ping_interval_without_data_ms', 20000),
+    ('grpc.http2.max_ping_strikes', 0),
+]
+COMMAND_QUEUE_MAX_PENDING = 8   # Comandos pendentes (após a coalescência) por dispositivo antes de recusar
+BREAKER_FAILURE_THRESHOLD = 3   # Falhas seguidas até abrir o circuito de um dispositivo
+BREAKER_OPEN_TIMEOUT = 5        # Segundos com o circuito aberto antes da sonda (dobra a cada sonda que falha)
+BREAKER_MAX_OPEN_TIMEOUT = 60   # Limite da espera entre sondas
+DEVICE_MIN_TIMEOUT = 0.3        # Piso do timeout adaptativo (p99 das latências do dispositivo x 4)
+STATE_CACHE_MAX_AGE = 2.0       # Segundos em que o último estado recebido responde ConsultarEstado sem ir ao dispositivo
 
 # Cache de dispositivos descobertos (pode ser populado via discovery)
 device_cache: Dict[str, Dict[str, Any]] = {}
 
-def encode_varint(value: int) -> bytes:
-    """Codifica um inteiro como varint (formato Protocol Buffers)"""
-    result = b""
-    while True:
-        bits = value & 0x7F
-        value >>= 7
-        if value:
-            result += bytes([bits | 0x80])
-        else:
-            result += bytes([bits])
-            break
-    return result
+# Pool compartilhado pelos comandos de ExecutarLote e FluxoComandos
+command_executor = futures.ThreadPoolExecutor(max_workers=COMMAND_WORKERS, thread_name_prefix="actuator-command")
+
+# Conexões TCP reaproveitadas com os atuadores (uma instância por modo de servidor)
+connection_pool = DeviceConnectionPool(
+    connect_timeout=TIMEOUT_TCP, idle_timeout=POOL_IDLE_TIMEOUT, max_idle_per_device=POOL_MAX_IDLE_PER_DEVICE
+)
+async_connection_pool = AsyncDeviceConnectionPool(
+    connect_timeout=TIMEOUT_TCP, idle_timeout=POOL_IDLE_TIMEOUT, max_idle_per_device=POOL_MAX_IDLE_PER_DEVICE
+)
+
+# Um comando por vez por dispositivo, com coalescência dos pendentes (uma fila por modo de servidor)
+command_queue = DeviceCommandQueue(max_pending=COMMAND_QUEUE_MAX_PENDING)
+async_command_queue = AsyncDeviceCommandQueue(max_pending=COMMAND_QUEUE_MAX_PENDING)
+
+# Circuito e timeout adaptativo de cada dispositivo (comum aos dois modos)
+device_breakers = DeviceCircuitBreakers(
+    failure_threshold=BREAKER_FAILURE_THRESHOLD, open_timeout=BREAKER_OPEN_TIMEOUT,
+    max_open_timeout=BREAKER_MAX_OPEN_TIMEOUT, min_timeout=DEVICE_MIN_TIMEOUT, max_timeout=TIMEOUT_TCP
+)
+
+# Último estado recebido de cada atuador (alimentado pelas respostas dos comandos)
+state_cache = DeviceStateCache(max_age=STATE_CACHE_MAX_AGE)
+
+def build_command_envelope(command: smart_city_pb2.DeviceCommand) -> smart_city_pb2.SmartCityMessage:
+    """Envelope SmartCityMessage com o ClientRequest que leva o comando ao dispositivo"""
+    envelope = smart_city_pb2.SmartCityMessage()
+    envelope.message_type = smart_city_pb2.MessageType.CLIENT_REQUEST
+    
+    # Criar ClientRequest com o comando
+    client_request = smart_city_pb2.ClientRequest()
+    client_request.type = smart_city_pb2.ClientRequest.RequestType.SEND_DEVICE_COMMAND
+    client_request.target_device_id = command.device_id
+    client_request.command.CopyFrom(command)
+    
+    envelope.client_request.CopyFrom(client_request)
+    return envelope
+
+def parse_device_response(command: smart_city_pb2.DeviceCommand, response_data: bytes) -> smart_city_pb2.DeviceUpdate:
+    """Decodifica a resposta do dispositivo; espera um DeviceUpdate"""
+    response_envelope = smart_city_pb2.SmartCityMessage()
+    response_envelope.ParseFromString(response_data)
+    
+    if response_envelope.message_type == smart_city_pb2.MessageType.DEVICE_UPDATE:
+        logger.info(f"Status recebido do dispositivo {command.device_id}: {smart_city_pb2.DeviceStatus.Name(response_envelope.device_update.current_status)}")
+        return response_envelope.device_update
+    raise Exception(f"Tipo de resposta inesperado: {response_envelope.message_type}")
+
+class DeviceCommunicationError(Exception):
+    """Falha de conexão, escrita ou leitura com o dispositivo: o estado dele fica incerto"""
+
+    def __init__(self, message: str, device_fault: bool = True):
+        super().__init__(message)
+        self.device_fault = device_fault  # False: timeout encurtado pelo prazo do RPC, não diz nada sobre o dispositivo
+
+def communication_error(error: Exception, timeout: float, truncated: bool) -> DeviceCommunicationError:
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return DeviceCommunicationError(f"Timeout de {timeout:.1f}s aguardando o dispositivo", device_fault=not truncated)
+    return DeviceCommunicationError(f"Falha de comunicação com o dispositivo: {error}")
 
-def send_tcp_command_to_device(device_ip: str, device_port: int, command: smart_city_pb2.DeviceCommand) -> smart_city_pb2.DeviceUpdate:
+def rpc_deadline(context):
+    """Instante (time.monotonic()) em que o chamador do RPC desiste, a partir do deadline gRPC, ou None"""
+    if context is None:
+        return None
+    remaining = context.time_remaining()
+    if remaining is None:
+        return None
+    return time.monotonic() + remaining
+
+def device_timeout(device_id: str, deadline):
+    """Timeout adaptativo do dispositivo encurtado pelo prazo do RPC; retorna (timeout, encurtado?)"""
+    timeout = device_breakers.timeout_for(device_id)
+    if deadline is None:
+        return timeout, False
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Prazo do RPC esgotado antes do envio ao dispositivo")
+    if remaining < timeout:
+        return remaining, True
+    return timeout, False
+
+def send_tcp_command_to_device(device_ip: str, device_port: int, command: smart_city_pb2.DeviceCommand,
+                               deadline=None) -> smart_city_pb2.DeviceUpdate:
     """
     Envia um comando TCP para um dispositivo atuador e aguarda resposta
     
@@ -84,6 +199,7 @@ def send_tcp_command_to_device(device_ip: str, device_port: int, command: smart_
         device_ip: IP do dispositivo
         device_port: Porta TCP do dispositivo
         command: Comando a ser enviado
+        deadline: Prazo do RPC (time.monotonic()); o I/O com o dispositivo não passa dele
         
     Returns:
         DeviceUpdate com o status atualizado
@@ -91,152 +207,450 @@ def send_tcp_command_to_device(device_ip: str, device_port: int, command: smart_
     Raises:
         Exception: Se houver erro na comunicação
     """
+    timeout, truncated = device_timeout(command.device_id, deadline)
+    # Dispositivo que vem falhando: recusar na hora em vez de esperar o timeout
+    device_breakers.check(command.device_id)
     try:
-        logger.info(f"Conectando ao dispositivo {device_ip}:{device_port} para comando {command.command_type}")
+        logger.info(f"Enviando comando {command.command_type} ao dispositivo {device_ip}:{device_port}")
         
-        with socket.create_connection((device_ip, device_port), timeout=TIMEOUT_TCP) as sock:
-            # Criar envelope SmartCityMessage
-            envelope = smart_city_pb2.SmartCityMessage()
-            envelope.message_type = smart_city_pb2.MessageType.CLIENT_REQUEST
-            
-            # Criar ClientRequest com o comando
-            client_request = smart_city_pb2.ClientRequest()
-            client_request.type = smart_city_pb2.ClientRequest.RequestType.SEND_DEVICE_COMMAND
-            client_request.target_device_id = command.device_id
-            client_request.command.CopyFrom(command)
-            
-            envelope.client_request.CopyFrom(client_request)
-            
-            # Enviar mensagem com delimitador varint
-            data = envelope.SerializeToString()
-            sock.sendall(encode_varint(len(data)) + data)
-            
-            logger.info(f"Comando enviado para {device_ip}:{device_port}")
-            
-            # Ler resposta
-            sock_file = sock.makefile('rb')
-            
-            # Ler tamanho da resposta (varint)
-            def read_varint(stream):
-                shift = 0
-                result = 0
-                while True:
-                    b = stream.read(1)
-                    if not b:
-                        raise EOFError("Stream fechado")
-                    b = b[0]
-                    result |= (b & 0x7f) << shift
-                    if not (b & 0x80):
-                        return result
-                    shift += 7
-            
-            response_size = read_varint(sock_file)
-            response_data = sock_file.read(response_size)
-            
-            if len(response_data) != response_size:
-                raise Exception("Resposta TCP incompleta")
-            
-            # Decodificar resposta
-            response_envelope = smart_city_pb2.SmartCityMessage()
-            response_envelope.ParseFromString(response_data)
+        # Enviar pela conexão do pool (nova ou reaproveitada) e ler a resposta
+        start = time.perf_counter()
+        try:
+            response_data = connection_pool.request((device_ip, device_port), build_command_envelope(command), timeout)
+        except Exception as e:
+            error = communication_error(e, timeout, truncated)
+            if error.device_fault:
+                device_breakers.record_failure(command.device_id)
+            else:
+                # Não foi o dispositivo (ex.: prazo do RPC): devolver a sonda do HALF_OPEN
+                device_breakers.release(command.device_id)
+            raise error from e
+        device_breakers.record_success(command.device_id, time.perf_counter() - start)
+        return parse_device_response(command, response_data)
             
-            if response_envelope.message_type == smart_city_pb2.MessageType.DEVICE_UPDATE:
-                logger.info(f"Status recebido do dispositivo {command.device_id}: {smart_city_pb2.DeviceStatus.Name(response_envelope.device_update.current_status)}")
-                return response_envelope.device_update
+    except Exception as e:
+        logger.error(f"Erro ao comunicar com dispositivo {device_ip}:{device_port}: {e}")
+        raise
+
+async def send_tcp_command_to_device_async(device_ip: str, device_port: int, command: smart_city_pb2.DeviceCommand,
+                                           deadline=None) -> smart_city_pb2.DeviceUpdate:
+    """Mesmo que send_tcp_command_to_device, com asyncio streams (modo grpc.aio)"""
+    timeout, truncated = device_timeout(command.device_id, deadline)
+    device_breakers.check(command.device_id)
+    try:
+        logger.info(f"Enviando comando {command.command_type} ao dispositivo {device_ip}:{device_port}")
+        start = time.perf_counter()
+        try:
+            response_data = await async_connection_pool.request((device_ip, device_port), build_command_envelope(command), timeout)
+        except asyncio.CancelledError:
+            # RPC cancelado/abandonado: nada se sabe sobre o dispositivo
+            device_breakers.release(command.device_id)
+            raise
+        except Exception as e:
+            error = communication_error(e, timeout, truncated)
+            if error.device_fault:
+                device_breakers.record_failure(command.device_id)
             else:
-                raise Exception(f"Tipo de resposta inesperado: {response_envelope.message_type}")
-                
+                # Não foi o dispositivo (ex.: prazo do RPC): devolver a sonda do HALF_OPEN
+                device_breakers.release(command.device_id)
+            raise error from e
+        device_breakers.record_success(command.device_id, time.perf_counter() - start)
+        return parse_device_response(command, response_data)
     except Exception as e:
         logger.error(f"Erro ao comunicar com dispositivo {device_ip}:{device_port}: {e}")
         raise
 
 
+def device_command(request, command_type: str) -> smart_city_pb2.DeviceCommand:
+    command = smart_city_pb2.DeviceCommand()
+    command.device_id = request.device_id
+    command.command_type = command_type
+    command.command_value = ""
+    return command
+
+def command_response(command_type: str, device_id: str, device_update: smart_city_pb2.DeviceUpdate):
+    """Response de sucesso de LigarDispositivo/DesligarDispositivo/ConsultarEstado"""
+    device_status_name = smart_city_pb2.DeviceStatus.Name(device_update.current_status)
+    if command_type == "TURN_ON":
+        return actuator_service_pb2.Response(
+            status="ON",
+            message=f"Dispositivo {device_id} ligado com sucesso. Status: {device_status_name}"
+        )
+    if command_type == "TURN_OFF":
+        return actuator_service_pb2.Response(
+            status="OFF",
+            message=f"Dispositivo {device_id} desligado com sucesso. Status: {device_status_name}"
+        )
+    # Para GET_STATUS, retornar o status real do dispositivo no campo status
+    return actuator_service_pb2.Response(
+        status=device_status_name,
+        message=f"Status do dispositivo {device_id}: {device_status_name}"
+    )
+
+def command_error(command_type: str, device_id: str, error: Exception):
+    """Response de erro (e log) de um comando que falhou"""
+    if command_type == "TURN_ON":
+        logger.error(f"Erro ao ligar dispositivo {device_id}: {error}")
+        message = f"Erro ao ligar dispositivo: {str(error)}"
+    elif command_type == "TURN_OFF":
+        logger.error(f"Erro ao desligar dispositivo {device_id}: {error}")
+        message = f"Erro ao desligar dispositivo: {str(error)}"
+    else:
+        logger.error(f"Erro ao consultar estado do dispositivo {device_id}: {error}")
+        message = f"Erro ao consultar estado: {str(error)}"
+    # device_error: só falhas do próprio dispositivo contam no circuito do gateway
+    device_error = isinstance(error, DeviceCommunicationError) and error.device_fault
+    return actuator_service_pb2.Response(status="ERROR", message=message, device_error=device_error)
+
+def cached_status(request, command_type: str):
+    """Response de ConsultarEstado a partir do cache, se o estado for recente e não houver force_refresh"""
+    if command_type != "GET_STATUS" or request.force_refresh:
+        return None
+    device_update = state_cache.get(request.device_id)
+    if device_update is None:
+        return None
+    logger.info(f"Estado do dispositivo {request.device_id} respondido pelo cache")
+    return command_response(command_type, request.device_id, device_update)
+
+def queued_response_type(command_type: str, executed: str) -> str:
+    """Tipo de Response para quem pediu `command_type` quando a fila executou `executed`
+
+    Um TURN_ON/TURN_OFF substituído por outro recebe a resposta do comando que
+    de fato foi ao dispositivo; um GET_STATUS continua sendo uma consulta.
+    """
+    return command_type if command_type == "GET_STATUS" else executed
+
+# Operação de lote/fluxo -> tipo de comando TCP
+OPERATION_COMMANDS = {
+    actuator_service_pb2.LIGAR: "TURN_ON",
+    actuator_service_pb2.DESLIGAR: "TURN_OFF",
+    actuator_service_pb2.CONSULTAR: "GET_STATUS",
+}
+
+
 class ActuatorServiceServicer(actuator_service_pb2_grpc.ActuatorServiceServicer):
     """Implementação do serviço gRPC para controle de atuadores (novo .proto)"""
 
-    def LigarDispositivo(self, request, context):
-        device_id = request.device_id
-        logger.info(f"[gRPC] Comando LIGAR para dispositivo {device_id}")
-        ip = request.ip
-        port = request.port
+    def run_command(self, request, command_type: str, deadline=None):
+        cached = cached_status(request, command_type)
+        if cached is not None:
+            return cached
+        sent_at = time.monotonic()
         try:
-            command = smart_city_pb2.DeviceCommand()
-            command.device_id = device_id
-            command.command_type = "TURN_ON"
-            command.command_value = ""
-            device_update = send_tcp_command_to_device(ip, port, command)
-            return actuator_service_pb2.Response(
-                status="ON",
-                message=f"Dispositivo {device_id} ligado com sucesso. Status: {smart_city_pb2.DeviceStatus.Name(device_update.current_status)}"
+            executed, device_update = command_queue.submit(
+                request.device_id, command_type,
+                lambda queued_type: send_tcp_command_to_device(request.ip, request.port, device_command(request, queued_type), deadline),
+                deadline
             )
+            state_cache.update(request.device_id, device_update, sent_at)
+            return command_response(queued_response_type(command_type, executed), request.device_id, device_update)
         except Exception as e:
-            logger.error(f"Erro ao ligar dispositivo {device_id}: {e}")
-            return actuator_service_pb2.Response(
-                status="ERROR",
-                message=f"Erro ao ligar dispositivo: {str(e)}"
-            )
+            # Fila cheia, circuito aberto ou prazo vencido antes do envio: o estado em cache continua válido
+            if isinstance(e, DeviceCommunicationError):
+                state_cache.invalidate(request.device_id, sent_at)
+            return command_error(command_type, request.device_id, e)
+
+    def LigarDispositivo(self, request, context):
+        logger.info(f"[gRPC] Comando LIGAR para dispositivo {request.device_id}")
+        return self.run_command(request, "TURN_ON", rpc_deadline(context))
 
     def DesligarDispositivo(self, request, context):
-        device_id = request.device_id
-        logger.info(f"[gRPC] Comando DESLIGAR para dispositivo {device_id}")
-        ip = request.ip
-        port = request.port
-        try:
-            command = smart_city_pb2.DeviceCommand()
-            command.device_id = device_id
-            command.command_type = "TURN_OFF"
-            command.command_value = ""
-            device_update = send_tcp_command_to_device(ip, port, command)
-            return actuator_service_pb2.Response(
-                status="OFF",
-                message=f"Dispositivo {device_id} desligado com sucesso. Status: {smart_city_pb2.DeviceStatus.Name(device_update.current_status)}"
-            )
-        except Exception as e:
-            logger.error(f"Erro ao desligar dispositivo {device_id}: {e}")
-            return actuator_service_pb2.Response(
-                status="ERROR",
-                message=f"Erro ao desligar dispositivo: {str(e)}"
-            )
+        logger.info(f"[gRPC] Comando DESLIGAR para dispositivo {request.device_id}")
+        return self.run_command(request, "TURN_OFF", rpc_deadline(context))
 
     def ConsultarEstado(self, request, context):
-        device_id = request.device_id
-        logger.info(f"[gRPC] Consulta de estado para dispositivo {device_id}")
-        ip = request.ip
-        port = request.port
+        logger.info(f"[gRPC] Consulta de estado para dispositivo {request.device_id}")
+        return self.run_command(request, "GET_STATUS", rpc_deadline(context))
+
+    # === Lote e fluxo ===
+    def execute_command(self, command, deadline=None):
+        """Executa um CommandRequest com o mesmo caminho dos RPCs unários"""
+        start = time.perf_counter()
+        command_type = OPERATION_COMMANDS.get(command.operacao)
+        if command_type is None:
+            response = actuator_service_pb2.Response(status="ERROR", message=f"Operação desconhecida: {command.operacao}")
+        else:
+            try:
+                response = self.run_command(command.device, command_type, deadline)
+            except Exception as e:
+                response = actuator_service_pb2.Response(status="ERROR", message=f"Erro interno: {e}")
+        return actuator_service_pb2.CommandResponse(
+            command_id=command.command_id,
+            device_id=command.device.device_id,
+            response=response,
+            latency_ms=(time.perf_counter() - start) * 1000
+        )
+
+    def ExecutarLote(self, request, context):
+        parallelism = request.max_parallelism or BATCH_DEFAULT_PARALLELISM
+        logger.info(f"[gRPC] Lote de {len(request.commands)} comandos (paralelismo {parallelism})")
+        slots = threading.BoundedSemaphore(parallelism)
+        deadline = rpc_deadline(context)
+
+        def run(command):
+            try:
+                return self.execute_command(command, deadline)
+            finally:
+                slots.release()
+
+        pending = []
+        for command in request.commands:
+            slots.acquire()
+            pending.append(command_executor.submit(run, command))
+        return actuator_service_pb2.BatchResponse(results=[future.result() for future in pending])
+
+    def FluxoComandos(self, request_iterator, context):
+        """Lê comandos numa thread auxiliar e devolve cada resultado assim que fica pronto"""
+        results = queue.Queue()
+        slots = threading.BoundedSemaphore(STREAM_MAX_INFLIGHT)
+        submitted = [0, False]  # comandos recebidos, fim da entrada
+        deadline = rpc_deadline(context)  # Prazo do fluxo inteiro
+
+        def on_done(future):
+            slots.release()
+            results.put(future.result())
+
+        def consume():
+            try:
+                for command in request_iterator:
+                    slots.acquire()
+                    submitted[0] += 1
+                    command_executor.submit(self.execute_command, command, deadline).add_done_callback(on_done)
+            except Exception as e:
+                # Cliente cancelou ou a conexão caiu
+                logger.debug(f"[gRPC] Fluxo de comandos encerrado pelo cliente: {e}")
+            finally:
+                submitted[1] = True
+                results.put(None)
+
+        threading.Thread(target=consume, daemon=True, name="actuator-stream-reader").start()
+        delivered = 0
+        while context.is_active():
+            if submitted[1] and delivered == submitted[0]:
+                break
+            try:
+                result = results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if result is not None:
+                delivered += 1
+                yield result
+        logger.info(f"[gRPC] Fluxo de comandos finalizado: {delivered} resultados enviados")
+
+class AsyncActuatorServiceServicer(actuator_service_pb2_grpc.ActuatorServiceServicer):
+    """Mesmo serviço para o servidor grpc.aio: o I/O com os dispositivos não ocupa threads
+
+    Um comando aguardando um relé lento é só uma corrotina suspensa, então
+    milhares de comandos em andamento cabem em um processo; o limite é
+    ASYNC_MAX_INFLIGHT_COMMANDS (sockets abertos com dispositivos).
+    """
+
+    def __init__(self):
+        self.inflight = asyncio.Semaphore(ASYNC_MAX_INFLIGHT_COMMANDS)
+
+    async def run_command(self, request, command_type: str, deadline=None):
+        cached = cached_status(request, command_type)
+        if cached is not None:
+            return cached
+        sent_at = time.monotonic()
+
+        async def execute(queued_type):
+            async with self.inflight:
+                return await send_tcp_command_to_device_async(request.ip, request.port, device_command(request, queued_type), deadline)
+
         try:
-            command = smart_city_pb2.DeviceCommand()
-            command.device_id = device_id
-            command.command_type = "GET_STATUS"
-            command.command_value = ""
-            device_update = send_tcp_command_to_device(ip, port, command)
-            # Para GET_STATUS, retornar o status real do dispositivo no campo status
-            device_status_name = smart_city_pb2.DeviceStatus.Name(device_update.current_status)
-            return actuator_service_pb2.Response(
-                status=device_status_name,  # Usar o status real do dispositivo
-                message=f"Status do dispositivo {device_id}: {device_status_name}"
-            )
+            # Deadline do RPC vencido: grpc.aio cancela esta corrotina e a fila cancela o I/O se ninguém mais aguarda
+            executed, device_update = await async_command_queue.submit(request.device_id, command_type, execute, deadline)
+            state_cache.update(request.device_id, device_update, sent_at)
+            return command_response(queued_response_type(command_type, executed), request.device_id, device_update)
         except Exception as e:
-            logger.error(f"Erro ao consultar estado do dispositivo {device_id}: {e}")
-            return actuator_service_pb2.Response(
-                status="ERROR",
-                message=f"Erro ao consultar estado: {str(e)}"
-            )
+            # Fila cheia, circuito aberto ou prazo vencido antes do envio: o estado em cache continua válido
+            if isinstance(e, DeviceCommunicationError):
+                state_cache.invalidate(request.device_id, sent_at)
+            return command_error(command_type, request.device_id, e)
 
-def serve():
-    """Inicia o servidor gRPC"""
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    async def LigarDispositivo(self, request, context):
+        logger.info(f"[gRPC] Comando LIGAR para dispositivo {request.device_id}")
+        return await self.run_command(request, "TURN_ON", rpc_deadline(context))
+
+    async def DesligarDispositivo(self, request, context):
+        logger.info(f"[gRPC] Comando DESLIGAR para dispositivo {request.device_id}")
+        return await self.run_command(request, "TURN_OFF", rpc_deadline(context))
+
+    async def ConsultarEstado(self, request, context):
+        logger.info(f"[gRPC] Consulta de estado para dispositivo {request.device_id}")
+        return await self.run_command(request, "GET_STATUS", rpc_deadline(context))
+
+    async def execute_command(self, command, deadline=None):
+        start = time.perf_counter()
+        command_type = OPERATION_COMMANDS.get(command.operacao)
+        if command_type is None:
+            response = actuator_service_pb2.Response(status="ERROR", message=f"Operação desconhecida: {command.operacao}")
+        else:
+            try:
+                response = await self.run_command(command.device, command_type, deadline)
+            except Exception as e:
+                response = actuator_service_pb2.Response(status="ERROR", message=f"Erro interno: {e}")
+        return actuator_service_pb2.CommandResponse(
+            command_id=command.command_id,
+            device_id=command.device.device_id,
+            response=response,
+            latency_ms=(time.perf_counter() - start) * 1000
+        )
+
+    async def ExecutarLote(self, request, context):
+        parallelism = request.max_parallelism or BATCH_DEFAULT_PARALLELISM
+        logger.info(f"[gRPC] Lote de {len(request.commands)} comandos (paralelismo {parallelism})")
+        slots = asyncio.Semaphore(parallelism)
+        deadline = rpc_deadline(context)
+
+        async def run(command):
+            async with slots:
+                return await self.execute_command(command, deadline)
+
+        results = await asyncio.gather(*(run(command) for command in request.commands))
+        return actuator_service_pb2.BatchResponse(results=results)
+
+    async def FluxoComandos(self, request_iterator, context):
+        """Lê comandos numa tarefa auxiliar e devolve cada resultado assim que fica pronto"""
+        results: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(STREAM_MAX_INFLIGHT)
+        tasks = set()
+        deadline = rpc_deadline(context)  # Prazo do fluxo inteiro
+
+        async def run(command):
+            try:
+                await results.put(await self.execute_command(command, deadline))
+            finally:
+                slots.release()
+
+        async def consume():
+            try:
+                async for command in request_iterator:
+                    await slots.acquire()
+                    task = asyncio.create_task(run(command))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except Exception as e:
+                logger.debug(f"[gRPC] Fluxo de comandos encerrado pelo cliente: {e}")
+            finally:
+                # Fim da entrada: aguardar os comandos em andamento antes de sinalizar
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                await results.put(None)
+
+        reader = asyncio.create_task(consume())
+        delivered = 0
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                delivered += 1
+                yield result
+        finally:
+            reader.cancel()
+            for task in list(tasks):
+                task.cancel()
+        logger.info(f"[gRPC] Fluxo de comandos finalizado: {delivered} resultados enviados")
+
+def log_bridge_metrics(pool, commands):
+    metrics = pool.get_metrics()
+    logger.info(
+        f"Pool de conexões: acertos={metrics['hits']} faltas={metrics['misses']} "
+        f"taxa={metrics['hit_rate']:.1%} ociosas={metrics['idle_connections']} "
+        f"mortas={metrics['stale']} reenvios={metrics['retries']} erros_conexao={metrics['connect_errors']}"
+    )
+    cache = state_cache.get_metrics()
+    logger.info(
+        f"Cache de estado: dispositivos={cache['devices']} acertos={cache['hits']} "
+        f"faltas={cache['misses']} taxa={cache['hit_rate']:.1%} expirados={cache['expired']}"
+    )
+    breakers = device_breakers.get_metrics()
+    logger.info(
+        f"Circuitos: abertos={breakers['open']} meio_abertos={breakers['half_open']} "
+        f"aberturas={breakers['opened']} recusados={breakers['rejected']} sondas={breakers['probes']}"
+    )
+    queued = commands.get_metrics()
+    logger.info(
+        f"Fila de comandos: recebidos={queued['submitted']} executados={queued['executed']} "
+        f"coalescidos={queued['coalesced']} recusados={queued['rejected']} pendentes={queued['pending']}"
+    )
+
+def pool_maintenance(stop: threading.Event):
+    """Fecha conexões ociosas expiradas/mortas e registra as métricas do pool"""
+    last_log = time.monotonic()
+    while not stop.wait(POOL_PRUNE_INTERVAL):
+        closed = connection_pool.prune()
+        if closed:
+            logger.debug(f"Pool de conexões: {closed} conexões ociosas fechadas")
+        if time.monotonic() - last_log >= METRICS_LOG_INTERVAL:
+            last_log = time.monotonic()
+            log_bridge_metrics(connection_pool, command_queue)
+
+async def pool_maintenance_async():
+    """pool_maintenance para o pool asyncio, rodando no event loop do servidor"""
+    last_log = time.monotonic()
+    while True:
+        await asyncio.sleep(POOL_PRUNE_INTERVAL)
+        closed = async_connection_pool.prune()
+        if closed:
+            logger.debug(f"Pool de conexões: {closed} conexões ociosas fechadas")
+        if time.monotonic() - last_log >= METRICS_LOG_INTERVAL:
+            last_log = time.monotonic()
+            log_bridge_metrics(async_connection_pool, async_command_queue)
+
+def start_threaded_server(port: int = GRPC_PORT):
+    """Cria e inicia o servidor gRPC com pool de threads"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=GRPC_MAX_WORKERS), options=GRPC_SERVER_OPTIONS)
     actuator_service_pb2_grpc.add_ActuatorServiceServicer_to_server(ActuatorServiceServicer(), server)
-    listen_addr = f'[::]:{GRPC_PORT}'
-    server.add_insecure_port(listen_addr)
+    server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    return server
+
+async def start_aio_server(port: int = GRPC_PORT):
+    """Cria e inicia o servidor grpc.aio (deve ser chamado dentro do event loop)"""
+    server = grpc.aio.server(maximum_concurrent_rpcs=GRPC_AIO_MAX_CONCURRENT_RPCS, options=GRPC_SERVER_OPTIONS)
+    actuator_service_pb2_grpc.add_ActuatorServiceServicer_to_server(AsyncActuatorServiceServicer(), server)
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    return server
+
+async def serve_async():
+    server = await start_aio_server(GRPC_PORT)
+    logger.info(f"Servidor gRPC (grpc.aio) iniciado na porta {GRPC_PORT}")
+    logger.info("Aguardando chamadas gRPC do Gateway...")
+    maintenance = asyncio.create_task(pool_maintenance_async())
+    try:
+        await server.wait_for_termination()
+    finally:
+        maintenance.cancel()
+        await server.stop(0)
+        async_connection_pool.close()
+
+def serve():
+    """Inicia o servidor gRPC no modo configurado em GRPC_SERVER_MODE"""
+    if GRPC_SERVER_MODE == "asyncio":
+        try:
+            asyncio.run(serve_async())
+        except KeyboardInterrupt:
+            logger.info("Servidor gRPC encerrado por Ctrl+C")
+        return
+
+    server = start_threaded_server(GRPC_PORT)
     logger.info(f"Servidor gRPC iniciado na porta {GRPC_PORT}")
     logger.info("Aguardando chamadas gRPC do Gateway...")
-    server.start()
+    stop_maintenance = threading.Event()
+    threading.Thread(target=pool_maintenance, args=(stop_maintenance,), daemon=True, name="device-pool-maintenance").start()
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         logger.info("Servidor gRPC encerrado por Ctrl+C")
         server.stop(0)
+        command_executor.shutdown(wait=False)
+        stop_maintenance.set()
+        connection_pool.close()
 
 if __name__ == '__main__':
     serve()
@@ -0,0 +1,230 @@
+"""
+Fila de comandos por dispositivo na ponte gRPC
+
+Cliques repetidos no botão do relé viravam comandos simultâneos competindo
+pelo mesmo ESP8266, sem garantia de ordem. Aqui cada dispositivo tem uma fila:
+
+- Ordem: um comando por vez por dispositivo, na ordem de chegada
+- Coalescência: enquanto um comando está no dispositivo, os que chegam ficam
+  pendentes e um TURN_ON/TURN_OFF novo substitui o último TURN_ON/TURN_OFF
+  pendente (ON, OFF, ON vira um único ON); quem pediu o comando substituído
+  recebe o resultado do que foi executado
+- GET_STATUS pendente pega carona no último comando pendente: a resposta dele
+  já traz o estado do dispositivo depois do comando
+- Profundidade limitada (`max_pending`): além disso o comando é recusado com
+  QueueFullError em vez de acumular espera
+- Prazo: quem passa `deadline` desiste com TimeoutError quando ele vence; um
+  comando que ninguém mais aguarda sai da fila e, no modo asyncio, o I/O em
+  andamento com o dispositivo é cancelado
+
+DeviceCommandQueue executa o comando na thread de quem o aguarda (servidor
+com threads); AsyncDeviceCommandQueue usa uma tarefa por dispositivo com fila
+ativa (servidor grpc.aio) e deve ser usada apenas a partir do event loop.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+DEFAULT_MAX_PENDING = 8
+
+# Comandos que definem o estado do relé: só o último pendente importa
+SET_STATE_COMMANDS = ("TURN_ON", "TURN_OFF")
+
+
+class QueueFullError(Exception):
+    """Fila de comandos do dispositivo no limite"""
+
+
+class _Entry:
+    """Comando pendente, possivelmente compartilhado por vários solicitantes"""
+
+    __slots__ = ('command_type', 'execute', 'readers', 'waiters', 'abandoned', 'done', 'result', 'error', 'future', 'task')
+
+    def __init__(self, command_type: str, execute):
+        self.command_type = command_type
+        self.execute = execute
+        self.readers = False  # Algum GET_STATUS aguarda este comando
+        self.waiters = 0      # Solicitantes ainda aguardando o resultado
+        self.abandoned = False
+        self.done = False
+        self.result = None
+        self.error = None
+        self.future = None
+        self.task = None      # Execução em andamento (modo asyncio)
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.command_type, self.result
+
+
+class _DeviceQueue:
+    __slots__ = ('pending', 'busy', 'cond')
+
+    def __init__(self, cond=None):
+        self.pending = deque()
+        self.busy = False
+        self.cond = cond
+
+
+class _CommandQueueBase:
+    """Coalescência e métricas, comuns às duas filas"""
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        self._devices: Dict[str, _DeviceQueue] = {}
+        self.submitted = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.abandoned = 0
+
+    def _enqueue(self, device_id: str, queue: _DeviceQueue, command_type: str, execute) -> _Entry:
+        self.submitted += 1
+        last = queue.pending[-1] if queue.pending else None
+        if last is not None:
+            if command_type == "GET_STATUS":
+                last.readers = True
+                last.waiters += 1
+                self.coalesced += 1
+                return last
+            if command_type == last.command_type or (
+                    command_type in SET_STATE_COMMANDS and last.command_type in SET_STATE_COMMANDS and not last.readers):
+                # Um GET_STATUS já aguarda `last`: trocar ON por OFF mudaria o que ele deve ver
+                last.command_type = command_type
+                last.execute = execute
+                last.waiters += 1
+                self.coalesced += 1
+                return last
+        if len(queue.pending) >= self.max_pending:
+            self.rejected += 1
+            raise QueueFullError(f"Fila de comandos do dispositivo {device_id} cheia ({self.max_pending} pendentes)")
+        entry = _Entry(command_type, execute)
+        entry.waiters = 1
+        queue.pending.append(entry)
+        return entry
+
+    def _abandon(self, device_id: str, queue: _DeviceQueue, entry: _Entry) -> bool:
+        """Um solicitante desistiu; retorna True se ninguém mais aguarda o comando"""
+        entry.waiters -= 1
+        if entry.waiters > 0 or entry.done:
+            return False
+        entry.abandoned = True
+        self.abandoned += 1
+        if entry in queue.pending:
+            queue.pending.remove(entry)
+            if not queue.pending and not queue.busy:
+                del self._devices[device_id]
+        return True
+
+    def get_metrics(self) -> dict:
+        return {
+            'devices': len(self._devices),
+            'pending': sum(len(queue.pending) for queue in list(self._devices.values())),
+            'submitted': self.submitted,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'rejected': self.rejected,
+            'abandoned': self.abandoned,
+        }
+
+
+class DeviceCommandQueue(_CommandQueueBase):
+    """Fila por dispositivo para o servidor com threads"""
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING):
+        super().__init__(max_pending)
+        self._lock = threading.Lock()
+
+    def submit(self, device_id: str, command_type: str, execute: Callable[[str], object],
+               deadline: Optional[float] = None) -> Tuple[str, object]:
+        """Enfileira o comando e aguarda; retorna (comando executado, resultado de `execute`)
+
+        `execute(command_type)` é chamado na thread de algum solicitante
+        quando o comando chega ao início da fila. `deadline` (time.monotonic())
+        limita a espera na fila.
+        """
+        with self._lock:
+            queue = self._devices.get(device_id)
+            if queue is None:
+                queue = self._devices[device_id] = _DeviceQueue(threading.Condition(self._lock))
+            entry = self._enqueue(device_id, queue, command_type, execute)
+            while not entry.done:
+                if not queue.busy and queue.pending[0] is entry:
+                    queue.busy = True
+                    queue.pending.popleft()
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._abandon(device_id, queue, entry)
+                    # Outro comando pode ter chegado ao início da fila
+                    queue.cond.notify_all()
+                    raise TimeoutError(f"Prazo esgotado aguardando a fila de comandos do dispositivo {device_id}")
+                queue.cond.wait(remaining)
+            else:
+                return entry.outcome()
+
+        try:
+            entry.result = entry.execute(entry.command_type)
+        except Exception as e:
+            entry.error = e
+        with self._lock:
+            entry.done = True
+            queue.busy = False
+            self.executed += 1
+            if not queue.pending:
+                del self._devices[device_id]
+            queue.cond.notify_all()
+        return entry.outcome()
+
+
+class AsyncDeviceCommandQueue(_CommandQueueBase):
+    """Fila por dispositivo para o servidor grpc.aio"""
+
+    async def submit(self, device_id: str, command_type: str, execute: Callable[[str], Awaitable[object]],
+                     deadline: Optional[float] = None) -> Tuple[str, object]:
+        """Enfileira o comando e aguarda; retorna (comando executado, resultado de `execute`)
+
+        Se o chamador é cancelado (ex.: deadline do RPC grpc.aio) ou `deadline`
+        vence, desiste do comando; se era o último interessado, o comando sai
+        da fila ou tem a execução cancelada.
+        """
+        queue = self._devices.get(device_id)
+        if queue is None:
+            queue = self._devices[device_id] = _DeviceQueue()
+        entry = self._enqueue(device_id, queue, command_type, execute)
+        if entry.future is None:
+            entry.future = asyncio.get_running_loop().create_future()
+        if not queue.busy:
+            queue.busy = True
+            asyncio.create_task(self._drain(device_id, queue))
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            # shield: um RPC cancelado não interrompe o comando que outros aguardam
+            await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if self._abandon(device_id, queue, entry) and entry.task is not None:
+                entry.task.cancel()
+            raise
+        return entry.outcome()
+
+    async def _drain(self, device_id: str, queue: _DeviceQueue):
+        while queue.pending:
+            entry = queue.pending.popleft()
+            entry.task = asyncio.ensure_future(entry.execute(entry.command_type))
+            try:
+                entry.result = await entry.task
+            except asyncio.CancelledError:
+                if not entry.abandoned:
+                    raise
+                entry.error = TimeoutError("Comando cancelado: nenhum solicitante aguarda mais a resposta")
+            except Exception as e:
+                entry.error = e
+            entry.done = True
+            self.executed += 1
+            entry.future.set_result(None)
+        queue.busy = False
+        del self._devices[device_id]
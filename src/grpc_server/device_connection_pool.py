@@ -0,0 +1,310 @@
+"""
+Pool de conexões TCP da ponte gRPC com os atuadores
+
+Cada comando abria um socket novo (handshake TCP pelo Wi-Fi até o ESP8266) e o
+fechava logo depois. O pool mantém conexões ociosas por dispositivo
+(endereço ip:porta) e as reutiliza nos comandos seguintes:
+
+- Verificação de vida ao retirar uma conexão do pool: se o dispositivo fechou
+  o lado dele (FIN pendente) ou enviou dados não solicitados, a conexão é
+  descartada e outra é aberta
+- Se uma conexão reaproveitada falha ao enviar/receber (reset, EOF), o
+  comando é repetido uma vez em uma conexão nova; timeouts não são repetidos,
+  pois o dispositivo pode ter executado o comando
+- Conexões ociosas além de `idle_timeout` são fechadas por prune(), que
+  também verifica as restantes (chamado periodicamente pelo servidor)
+- Dispositivos que ainda fecham a conexão após cada resposta continuam
+  funcionando: a conexão morta é detectada ao ser retirada do pool
+- Métricas de acerto do pool, reconexões e conexões abertas
+- O `timeout` de request() vale para o comando inteiro: connect, envio,
+  leitura da resposta e a eventual repetição dividem o mesmo prazo
+
+DeviceConnectionPool usa sockets bloqueantes (servidor gRPC com threads);
+AsyncDeviceConnectionPool faz o mesmo com asyncio streams (servidor grpc.aio),
+e deve ser usado apenas a partir do event loop.
+"""
+
+import asyncio
+import logging
+import select
+import socket
+import threading
+import time
+from typing import Dict, Tuple
+
+from framing import AsyncDelimitedReader, DelimitedReader, encode_delimited, write_delimited
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_IDLE_TIMEOUT = 60.0         # Segundos que uma conexão ociosa fica no pool
+DEFAULT_MAX_IDLE_PER_DEVICE = 2     # Conexões ociosas guardadas por dispositivo
+
+
+def _remaining(deadline: float) -> float:
+    """Tempo até o prazo do comando; TimeoutError se já venceu"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Prazo do comando esgotado")
+    return remaining
+
+
+class PooledConnection:
+    """Socket de um dispositivo e o leitor de mensagens delimitadas associado"""
+
+    __slots__ = ('address', 'sock', 'reader', 'created', 'last_used', 'uses')
+
+    def __init__(self, address: Tuple[str, int], sock: socket.socket):
+        self.address = address
+        self.sock = sock
+        self.reader = DelimitedReader(sock, buffer_size=4096)
+        self.created = self.last_used = time.monotonic()
+        self.uses = 0
+
+    def is_alive(self) -> bool:
+        """Sonda sem bloquear: conexão ociosa não deve ter nada para ler"""
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                return True
+            # FIN (b'') ou dados fora de hora: em ambos os casos não serve mais
+            self.sock.recv(1, socket.MSG_PEEK)
+            return False
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _ConnectionPoolBase:
+    """Conexões ociosas por dispositivo e métricas, comuns aos dois pools"""
+
+    def __init__(self, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 max_idle_per_device: int = DEFAULT_MAX_IDLE_PER_DEVICE):
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_device = max_idle_per_device
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, int], list] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0          # Conexões ociosas mortas detectadas na retirada
+        self.retries = 0        # Comandos repetidos após falha em conexão reaproveitada
+        self.connects = 0
+        self.connect_errors = 0
+        self.idle_closed = 0
+
+    def _checkout(self, address: Tuple[str, int]):
+        """Retira uma conexão ociosa viva do pool, ou None (conta acerto/falta)"""
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                idle = self._idle.get(address)
+                conn = idle.pop() if idle else None  # LIFO: a mais recente tem mais chance de estar viva
+                if idle is not None and not idle:
+                    del self._idle[address]
+            if conn is None:
+                break
+            if now - conn.last_used <= self.idle_timeout and conn.is_alive():
+                with self._lock:
+                    self.hits += 1
+                return conn
+            with self._lock:
+                self.stale += 1
+            conn.close()
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def release(self, conn):
+        """Devolve uma conexão saudável ao pool"""
+        conn.last_used = time.monotonic()
+        conn.uses += 1
+        with self._lock:
+            idle = self._idle.setdefault(conn.address, [])
+            if len(idle) < self.max_idle_per_device:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def prune(self) -> int:
+        """Fecha conexões ociosas expiradas ou mortas; retorna quantas foram fechadas"""
+        now = time.monotonic()
+        with self._lock:
+            pools = list(self._idle.items())
+        closed = 0
+        for address, idle in pools:
+            with self._lock:
+                candidates = list(idle)
+            dead = [conn for conn in candidates if now - conn.last_used > self.idle_timeout or not conn.is_alive()]
+            if not dead:
+                continue
+            with self._lock:
+                current = self._idle.get(address)
+                for conn in dead:
+                    if current is not None and conn in current:
+                        current.remove(conn)
+                        conn.close()
+                        closed += 1
+                if current is not None and not current:
+                    del self._idle[address]
+        with self._lock:
+            self.idle_closed += closed
+        return closed
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'devices': len(self._idle),
+                'idle_connections': sum(len(idle) for idle in self._idle.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stale': self.stale,
+                'retries': self.retries,
+                'connects': self.connects,
+                'connect_errors': self.connect_errors,
+                'idle_closed': self.idle_closed,
+            }
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+
+class DeviceConnectionPool(_ConnectionPoolBase):
+    """Conexões TCP reutilizáveis, agrupadas por dispositivo"""
+
+    def _connect(self, address: Tuple[str, int], timeout: float) -> PooledConnection:
+        try:
+            sock = socket.create_connection(address, timeout=min(self.connect_timeout, timeout))
+        except OSError:
+            self._count('connect_errors')
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._count('connects')
+        return PooledConnection(address, sock)
+
+    def acquire(self, address: Tuple[str, int], timeout: float = DEFAULT_CONNECT_TIMEOUT) -> Tuple[PooledConnection, bool]:
+        """Retorna (conexão, reaproveitada?) para o dispositivo; conexões novas usam até `timeout` no connect"""
+        conn = self._checkout(address)
+        if conn is not None:
+            return conn, True
+        return self._connect(address, timeout), False
+
+    def request(self, address: Tuple[str, int], message, timeout: float) -> bytes:
+        """Envia uma mensagem delimitada e retorna os bytes da resposta, em até `timeout` segundos no total"""
+        deadline = time.monotonic() + timeout
+        for attempt in range(2):
+            conn, reused = self.acquire(address, _remaining(deadline))
+            try:
+                conn.sock.settimeout(_remaining(deadline))
+                write_delimited(conn.sock, message)
+                data = conn.reader.read_message(deadline)
+                if data is None:
+                    raise ConnectionError("Conexão encerrada pelo dispositivo antes da resposta")
+            except socket.timeout:
+                conn.close()
+                raise
+            except (OSError, EOFError) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    # Conexão do pool morreu entre a sonda e o envio: uma nova tentativa
+                    self._count('retries')
+                    logger.debug(f"Conexão reaproveitada com {address[0]}:{address[1]} falhou ({e}); reconectando")
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            self.release(conn)
+            return data
+
+
+class AsyncPooledConnection:
+    """Streams asyncio de um dispositivo e o leitor de mensagens delimitadas"""
+
+    __slots__ = ('address', 'reader', 'writer', 'frames', 'created', 'last_used', 'uses')
+
+    def __init__(self, address: Tuple[str, int], reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.address = address
+        self.reader = reader
+        self.writer = writer
+        self.frames = AsyncDelimitedReader(reader, chunk_size=4096)
+        self.created = self.last_used = time.monotonic()
+        self.uses = 0
+
+    def is_alive(self) -> bool:
+        # O loop já leu o FIN (at_eof) ou o transporte foi fechado
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncDeviceConnectionPool(_ConnectionPoolBase):
+    """Versão asyncio do pool: milhares de comandos em andamento sem uma thread por comando"""
+
+    async def _connect(self, address: Tuple[str, int], timeout: float) -> AsyncPooledConnection:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), min(self.connect_timeout, timeout))
+        except (OSError, asyncio.TimeoutError):
+            self._count('connect_errors')
+            raise
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._count('connects')
+        return AsyncPooledConnection(address, reader, writer)
+
+    async def acquire(self, address: Tuple[str, int], timeout: float = DEFAULT_CONNECT_TIMEOUT) -> Tuple[AsyncPooledConnection, bool]:
+        """Retorna (conexão, reaproveitada?) para o dispositivo; conexões novas usam até `timeout` no connect"""
+        conn = self._checkout(address)
+        if conn is not None:
+            return conn, True
+        return await self._connect(address, timeout), False
+
+    async def request(self, address: Tuple[str, int], message, timeout: float) -> bytes:
+        """Envia uma mensagem delimitada e retorna os bytes da resposta, em até `timeout` segundos no total"""
+        frame = encode_delimited(message)
+        deadline = time.monotonic() + timeout
+        for attempt in range(2):
+            conn, reused = await self.acquire(address, _remaining(deadline))
+            try:
+                conn.writer.write(frame)
+                # Relé com a janela TCP cheia não pode segurar o comando (e a vaga em ASYNC_MAX_INFLIGHT_COMMANDS)
+                await asyncio.wait_for(conn.writer.drain(), _remaining(deadline))
+                data = await asyncio.wait_for(conn.frames.read_message(), _remaining(deadline))
+                if data is None:
+                    raise ConnectionError("Conexão encerrada pelo dispositivo antes da resposta")
+            except asyncio.TimeoutError:
+                # Sem repetição: o dispositivo pode ter executado o comando
+                conn.close()
+                raise
+            except (OSError, EOFError) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    self._count('retries')
+                    logger.debug(f"Conexão reaproveitada com {address[0]}:{address[1]} falhou ({e}); reconectando")
+                    continue
+                raise
+            except BaseException:
+                # Cancelamento: a resposta pode chegar depois e desalinhar a conexão
+                conn.close()
+                raise
+            self.release(conn)
+            return data
@@ -0,0 +1,76 @@
+"""
+Cache de estado dos atuadores na ponte gRPC
+
+LigarDispositivo/DesligarDispositivo já recebem do relé um DeviceUpdate com o
+estado resultante; ConsultarEstado logo em seguida abria outra conexão só para
+ler o mesmo valor. O cache guarda o último DeviceUpdate de cada dispositivo:
+
+- write-through: toda resposta de dispositivo (comando ou consulta) atualiza
+  a entrada; uma falha de comunicação a remove, pois o estado fica incerto
+- ConsultarEstado é respondido localmente se a entrada tem até `max_age`
+  segundos; Request.force_refresh ignora o cache e consulta o dispositivo
+- Cada entrada guarda quando a requisição que a produziu foi enviada, para
+  que uma resposta lenta de uma consulta antiga não sobrescreva o estado de
+  um comando mais recente
+"""
+
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MAX_AGE = 2.0
+
+
+class DeviceStateCache:
+    """Último DeviceUpdate conhecido de cada atuador, com limite de idade"""
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, object]] = {}  # device_id -> (enviado_em, DeviceUpdate)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    def get(self, device_id: str) -> Optional[object]:
+        """DeviceUpdate em cache se tiver até `max_age` segundos, senão None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if now - entry[0] > self.max_age:
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def update(self, device_id: str, device_update, sent_at: float):
+        """Grava a resposta de uma requisição enviada em `sent_at` (time.monotonic())"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None or entry[0] <= sent_at:
+                self._entries[device_id] = (sent_at, device_update)
+
+    def invalidate(self, device_id: str, sent_at: float):
+        """Remove a entrada após uma falha, exceto se outra resposta mais recente já a regravou"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None and entry[0] <= sent_at:
+                del self._entries[device_id]
+                self.invalidations += 1
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'devices': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expired': self.expired,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,172 @@
+"""
+Circuit breaker e timeouts adaptativos por dispositivo
+
+Um relé fora do ar custava o timeout inteiro (5 s de connect na ponte, e o
+gateway esperando junto) em cada comando e consulta. Usado pela ponte gRPC
+(I/O TCP com o dispositivo) e pelo gateway (RPCs para a ponte):
+
+- CLOSED: chamadas normais. Após `failure_threshold` falhas seguidas o
+  circuito abre
+- OPEN: chamadas recusadas na hora (allow() retorna False) durante
+  `open_timeout` segundos
+- HALF_OPEN: passado o tempo, UMA chamada de sonda é liberada; sucesso fecha
+  o circuito, falha o reabre com o tempo de espera dobrado (até
+  `max_open_timeout`). Uma sonda sem resultado em `max_timeout` (ex.: RPC
+  cancelado) libera outra; release() devolve a sonda de uma chamada que não
+  chegou a testar o dispositivo
+- Timeout adaptativo: com amostras suficientes, o timeout do dispositivo é o
+  p99 das latências recentes vezes `timeout_multiplier`, limitado a
+  [min_timeout, max_timeout] e dobrado a cada falha seguida (um dispositivo
+  que ficou mais lento volta a ter tempo de responder); sondas usam
+  max_timeout
+"""
+
+import collections
+import logging
+import threading
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_OPEN_TIMEOUT = 5.0
+DEFAULT_MAX_OPEN_TIMEOUT = 60.0
+DEFAULT_MIN_TIMEOUT = 0.3
+DEFAULT_MAX_TIMEOUT = 5.0
+DEFAULT_TIMEOUT_MULTIPLIER = 4.0
+RTT_WINDOW = 64       # Latências recentes mantidas por dispositivo
+MIN_RTT_SAMPLES = 8   # Abaixo disso o timeout é max_timeout
+
+
+class CircuitOpenError(Exception):
+    """Chamada recusada: circuito do dispositivo aberto"""
+
+
+class DeviceCircuit:
+    """Estado do circuito e latências recentes de um dispositivo"""
+
+    __slots__ = ('state', 'failures', 'opened_at', 'open_timeout', 'probe_started', 'rtts')
+
+    def __init__(self, open_timeout: float):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_timeout = open_timeout
+        self.probe_started = None  # Sonda em andamento desde (None: nenhuma)
+        self.rtts = collections.deque(maxlen=RTT_WINDOW)
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.rtts)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class DeviceCircuitBreakers:
+    """Circuitos por device_id, compartilhados por todas as threads (ou pelo event loop)"""
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, open_timeout: float = DEFAULT_OPEN_TIMEOUT,
+                 max_open_timeout: float = DEFAULT_MAX_OPEN_TIMEOUT, min_timeout: float = DEFAULT_MIN_TIMEOUT,
+                 max_timeout: float = DEFAULT_MAX_TIMEOUT, timeout_multiplier: float = DEFAULT_TIMEOUT_MULTIPLIER):
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self._lock = threading.Lock()
+        self._circuits: Dict[str, DeviceCircuit] = {}
+        self.rejected = 0
+        self.opened = 0
+        self.probes = 0
+
+    def _circuit(self, device_id: str) -> DeviceCircuit:
+        circuit = self._circuits.get(device_id)
+        if circuit is None:
+            circuit = self._circuits[device_id] = DeviceCircuit(self.open_timeout)
+        return circuit
+
+    def allow(self, device_id: str) -> bool:
+        """True se a chamada pode ir ao dispositivo (inclui a sonda do HALF_OPEN)"""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(device_id)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN and now - circuit.opened_at >= circuit.open_timeout:
+                circuit.state = HALF_OPEN
+            elif circuit.state == OPEN or (circuit.probe_started is not None
+                                           and now - circuit.probe_started < self.max_timeout):
+                self.rejected += 1
+                return False
+            circuit.probe_started = now
+            self.probes += 1
+            return True
+
+    def check(self, device_id: str):
+        """Como allow(), mas levanta CircuitOpenError se a chamada for recusada"""
+        if not self.allow(device_id):
+            raise CircuitOpenError(f"Dispositivo {device_id} sem resposta (circuito aberto); nova tentativa em breve")
+
+    def release(self, device_id: str):
+        """Devolve a sonda do HALF_OPEN liberada por allow() a uma chamada que não foi ao dispositivo"""
+        with self._lock:
+            circuit = self._circuits.get(device_id)
+            if circuit is not None and circuit.state == HALF_OPEN:
+                circuit.probe_started = None
+
+    def timeout_for(self, device_id: str) -> float:
+        """Timeout da próxima chamada ao dispositivo, em segundos"""
+        with self._lock:
+            circuit = self._circuits.get(device_id)
+            if circuit is None or circuit.state != CLOSED or len(circuit.rtts) < MIN_RTT_SAMPLES:
+                return self.max_timeout
+            timeout = circuit.percentile(0.99) * self.timeout_multiplier * (2 ** circuit.failures)
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def record_success(self, device_id: str, rtt: float):
+        """Registra uma resposta do dispositivo após `rtt` segundos"""
+        with self._lock:
+            circuit = self._circuit(device_id)
+            circuit.rtts.append(rtt)
+            circuit.failures = 0
+            if circuit.state != CLOSED:
+                circuit.state = CLOSED
+                circuit.open_timeout = self.open_timeout
+                logger.info(f"Circuito do dispositivo {device_id} fechado: voltou a responder")
+
+    def record_failure(self, device_id: str):
+        """Registra uma falha (timeout, conexão recusada/encerrada)"""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuit(device_id)
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN:
+                circuit.open_timeout = min(circuit.open_timeout * 2, self.max_open_timeout)
+            elif circuit.state == OPEN or circuit.failures < self.failure_threshold:
+                return
+            else:
+                self.opened += 1
+            circuit.state = OPEN
+            circuit.opened_at = now
+            logger.warning(f"Circuito do dispositivo {device_id} aberto após {circuit.failures} falhas seguidas; "
+                           f"nova sonda em {circuit.open_timeout:.1f}s")
+
+    def state(self, device_id: str) -> str:
+        circuit = self._circuits.get(device_id)
+        return circuit.state if circuit is not None else CLOSED
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            states = collections.Counter(circuit.state for circuit in self._circuits.values())
+            return {
+                'devices': len(self._circuits),
+                'open': states[OPEN],
+                'half_open': states[HALF_OPEN],
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'probes': self.probes,
+            }
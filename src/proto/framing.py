@@ -0,0 +1,248 @@
+"""
+Enquadramento de mensagens Protocol Buffers delimitadas por tamanho
+
+Todas as trocas TCP do sistema (dispositivos, gateway, API e servidor ponte
+gRPC) usam o formato [varint_tamanho][dados_protobuf], o mesmo de
+writeDelimitedTo/parseDelimitedFrom do Java e do pb_encode_delimited do nanopb.
+
+Este módulo concentra a codificação e a decodificação desse formato:
+- encode_varint / encode_delimited: montam o prefixo e o quadro completo
+- FrameDecoder: buffer de recepção que extrai várias mensagens de uma vez,
+  usando fatias de memoryview em vez de leituras byte a byte
+- DelimitedReader: leitor síncrono sobre socket (recv_into direto no buffer)
+- AsyncDelimitedReader: leitor para asyncio.StreamReader
+
+As funções trabalham com bytes; a conversão para mensagens fica com quem chama
+(ParseFromString), para que o módulo não dependa dos arquivos gerados.
+"""
+
+import time
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024  # Proteção contra tamanhos corrompidos
+MAX_VARINT_BYTES = 10
+
+_SINGLE_BYTE_VARINTS = [bytes((i,)) for i in range(0x80)]
+
+
+def encode_varint(value: int) -> bytes:
+    """Codifica um inteiro não negativo como varint protobuf"""
+    if value < 0x80:
+        return _SINGLE_BYTE_VARINTS[value]
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(data, offset: int = 0, end: int | None = None):
+    """Decodifica um varint de data[offset:end].
+
+    Retorna (valor, offset_seguinte), ou None se os bytes disponíveis ainda não
+    contêm o varint completo.
+    """
+    if end is None:
+        end = len(data)
+    result = 0
+    shift = 0
+    i = offset
+    while i < end:
+        byte = data[i]
+        result |= (byte & 0x7F) << shift
+        i += 1
+        if not byte & 0x80:
+            return result, i
+        shift += 7
+        if i - offset >= MAX_VARINT_BYTES:
+            raise ValueError("Varint muito longo.")
+    return None
+
+
+def _payload(message) -> bytes:
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return message
+    return message.SerializeToString()
+
+
+def encode_delimited(message) -> bytes:
+    """Retorna o quadro [varint_tamanho][dados] de uma mensagem protobuf ou de bytes"""
+    data = _payload(message)
+    return encode_varint(len(data)) + data
+
+
+def write_delimited(sock, message):
+    """Envia uma mensagem delimitada por um socket"""
+    sock.sendall(encode_delimited(message))
+
+
+class FrameDecoder:
+    """Buffer de recepção que decodifica mensagens delimitadas incrementalmente.
+
+    Os bytes recebidos são escritos diretamente na área livre do buffer
+    (writable()/advance(), para recv_into) ou copiados com feed(). Cada chamada
+    a next_frame() consome uma mensagem completa, se houver, sem copiar o
+    restante do buffer.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE, max_message_size: int = MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # Início dos bytes ainda não consumidos
+        self._end = 0    # Fim dos bytes válidos
+        self._frame_size = None  # Tamanho da mensagem em andamento, se o prefixo já foi lido
+
+    @property
+    def buffered(self) -> int:
+        """Quantidade de bytes recebidos e ainda não consumidos"""
+        return self._end - self._start
+
+    def _reserve(self, needed: int):
+        """Garante espaço livre para pelo menos `needed` bytes após _end"""
+        if len(self._buffer) - self._end >= needed:
+            return
+        pending = self._end - self._start
+        if len(self._buffer) - pending >= needed:
+            # Compactar: mover os bytes pendentes para o início
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            size = len(self._buffer)
+            while size - pending < needed:
+                size *= 2
+            buffer = bytearray(size)
+            buffer[:pending] = self._view[self._start:self._end]
+            self._view.release()
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        self._start = 0
+        self._end = pending
+
+    def writable(self, min_size: int = 4096) -> memoryview:
+        """Área livre do buffer, para uso com sock.recv_into(); confirme com advance()"""
+        if self._start == self._end:
+            self._start = self._end = 0
+        needed = min_size
+        if self._frame_size is not None:
+            needed = max(needed, self._frame_size - self.buffered)
+        self._reserve(needed)
+        return self._view[self._end:]
+
+    def advance(self, count: int):
+        """Confirma `count` bytes escritos na área retornada por writable()"""
+        self._end += count
+
+    def feed(self, data):
+        """Copia bytes recebidos para o buffer"""
+        size = len(data)
+        self._reserve(size)
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def next_frame(self) -> bytes | None:
+        """Retorna a próxima mensagem completa do buffer, ou None se ainda faltam bytes"""
+        start = self._start
+        end = self._end
+        size = self._frame_size
+        if size is None:
+            if start >= end:
+                return None
+            first = self._buffer[start]
+            if first < 0x80:
+                # Caso comum: mensagens de até 127 bytes têm prefixo de um byte
+                size = first
+                start += 1
+            else:
+                decoded = decode_varint(self._buffer, start, end)
+                if decoded is None:
+                    return None
+                size, start = decoded
+                if size > self.max_message_size:
+                    raise ValueError(f"Mensagem de {size} bytes excede o limite de {self.max_message_size}")
+        if end - start < size:
+            self._start = start
+            self._frame_size = size
+            return None
+        self._start = start + size
+        self._frame_size = None
+        return self._view[start:start + size].tobytes()
+
+    def frames(self):
+        """Itera sobre todas as mensagens completas já recebidas"""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def check_eof(self):
+        """Valida o estado do buffer quando o outro lado encerra a conexão"""
+        if self._frame_size is not None or self._start != self._end:
+            raise EOFError("Conexão encerrada no meio de uma mensagem")
+
+
+class DelimitedReader:
+    """Lê mensagens delimitadas de um socket com recv_into em um buffer único"""
+
+    def __init__(self, sock, buffer_size: int = DEFAULT_BUFFER_SIZE, max_message_size: int = MAX_MESSAGE_SIZE):
+        self.sock = sock
+        self.decoder = FrameDecoder(buffer_size, max_message_size)
+
+    def read_message(self, deadline: float | None = None) -> bytes | None:
+        """Retorna os bytes da próxima mensagem, ou None se a conexão foi encerrada
+
+        Com `deadline` (time.monotonic()), a leitura inteira termina até ele
+        (TimeoutError), mesmo que o outro lado envie a mensagem aos poucos.
+        """
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Prazo esgotado aguardando a mensagem")
+                self.sock.settimeout(remaining)
+            count = self.sock.recv_into(self.decoder.writable())
+            if count == 0:
+                self.decoder.check_eof()
+                return None
+            self.decoder.advance(count)
+
+    def __iter__(self):
+        while True:
+            frame = self.read_message()
+            if frame is None:
+                return
+            yield frame
+
+
+class AsyncDelimitedReader:
+    """Lê mensagens delimitadas de um asyncio.StreamReader em blocos"""
+
+    def __init__(self, reader, chunk_size: int = DEFAULT_BUFFER_SIZE, max_message_size: int = MAX_MESSAGE_SIZE):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.decoder = FrameDecoder(chunk_size, max_message_size)
+
+    async def read_message(self) -> bytes | None:
+        """Retorna os bytes da próxima mensagem, ou None se a conexão foi encerrada"""
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+            chunk = await self.reader.read(self.chunk_size)
+            if not chunk:
+                self.decoder.check_eof()
+                return None
+            self.decoder.feed(chunk)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        frame = await self.read_message()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
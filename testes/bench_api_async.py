@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga da API FastAPI (rotas async + AsyncGatewayClient)
+
+Sobe três partes em processos separados:
+- um gateway simulado que responde LIST_DEVICES pelo protocolo TCP real
+  (mensagens delimitadas), com um atraso configurável que imita a ida e volta
+  ao gateway/dispositivos;
+- a API (src/api/src/api_server.py) no Uvicorn, apontada para esse gateway;
+- o gerador de carga: N clientes HTTP/1.1 keep-alive simultâneos repetindo
+  GET /devices durante alguns segundos.
+
+Mostra requisições/s e latências p50/p95/p99. Com rotas síncronas cada
+requisição em andamento prenderia uma thread do pool do Uvicorn (40 por
+padrão); com rotas async a concorrência fica limitada só pelo event loop.
+
+Uso (a partir da raiz do repositório):
+    python3 testes/bench_api_async.py [clientes_simultaneos] [duracao_s] [atraso_gateway_ms]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from src.proto import smart_city_pb2
+from src.proto.framing import AsyncDelimitedReader, encode_delimited
+
+API_PORT = 28000
+FAKE_GATEWAY_PORT = 28345
+NUM_DEVICES = 20
+
+
+def raise_fd_limit():
+    """1k clientes = milhares de sockets entre os processos"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# === Gateway simulado ===
+def build_device_list():
+    return smart_city_pb2.GatewayResponse(
+        type=smart_city_pb2.GatewayResponse.ResponseType.DEVICE_LIST,
+        message="Lista de dispositivos",
+        devices=[
+            smart_city_pb2.DeviceInfo(
+                device_id=f"bench_device_{i:03d}",
+                type=smart_city_pb2.DeviceType.RELAY,
+                ip_address="127.0.0.1",
+                port=9000 + i,
+                initial_state=smart_city_pb2.DeviceStatus.ON,
+                is_actuator=True,
+            )
+            for i in range(NUM_DEVICES)
+        ],
+    )
+
+
+async def fake_gateway(delay):
+    template = build_device_list()
+
+    async def respond(writer, request_id):
+        if delay:
+            await asyncio.sleep(delay)
+        response = smart_city_pb2.GatewayResponse()
+        response.CopyFrom(template)
+        response.request_id = request_id
+        envelope = smart_city_pb2.SmartCityMessage(
+            message_type=smart_city_pb2.MessageType.GATEWAY_RESPONSE,
+            gateway_response=response,
+        )
+        writer.write(encode_delimited(envelope))
+
+    async def handle(reader, writer):
+        # Como o gateway real: várias requisições em andamento por conexão
+        async for data in AsyncDelimitedReader(reader):
+            envelope = smart_city_pb2.SmartCityMessage()
+            envelope.ParseFromString(data)
+            asyncio.create_task(respond(writer, envelope.client_request.request_id))
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", FAKE_GATEWAY_PORT, backlog=1024)
+    async with server:
+        await server.serve_forever()
+
+
+def run_fake_gateway(delay):
+    asyncio.run(fake_gateway(delay))
+
+
+# === API ===
+def run_api():
+    raise_fd_limit()
+    import uvicorn
+    from src.api.src import api_server
+    from src.api.src.gateway_client import AsyncGatewayClient
+
+    api_server.gateway_client = AsyncGatewayClient(
+        "127.0.0.1", FAKE_GATEWAY_PORT, pool_size=api_server.GATEWAY_POOL_SIZE, timeout=api_server.GATEWAY_TIMEOUT
+    )
+    uvicorn.run(api_server.app, host="127.0.0.1", port=API_PORT, log_level="warning", backlog=4096)
+
+
+# === Gerador de carga ===
+REQUEST = (f"GET /devices HTTP/1.1\r\nHost: 127.0.0.1:{API_PORT}\r\nConnection: keep-alive\r\n\r\n").encode()
+
+
+async def http_client(deadline, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", API_PORT)
+    except OSError:
+        errors.append(1)
+        return
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(REQUEST)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in headers.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            if not headers.startswith(b"HTTP/1.1 200"):
+                errors.append(1)
+                continue
+            latencies.append(time.perf_counter() - start)
+    except (OSError, asyncio.IncompleteReadError):
+        errors.append(1)
+    finally:
+        writer.close()
+
+
+async def wait_for_api(timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", API_PORT)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.2)
+    return False
+
+
+async def run_load(concurrency, duration):
+    if not await wait_for_api():
+        print("API não iniciou")
+        return
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(http_client(deadline, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+    print(f"Clientes simultâneos: {concurrency}, duração: {elapsed:.1f}s")
+    print(f"Requisições OK: {len(latencies)}  erros: {len(errors)}")
+    print(f"Vazão: {len(latencies) / elapsed:,.0f} req/s")
+    print(f"Latência p50 {percentile(0.50):.1f} ms  p95 {percentile(0.95):.1f} ms  p99 {percentile(0.99):.1f} ms")
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    delay = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+    raise_fd_limit()
+
+    processes = [
+        multiprocessing.Process(target=run_fake_gateway, args=(delay,), daemon=True),
+        multiprocessing.Process(target=run_api, daemon=True),
+    ]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(run_load(concurrency, duration))
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark do enquadramento varint (src/proto/framing.py)
+
+Compara os helpers antigos (varint lido byte a byte com makefile().read(1) e
+prefixo montado com `bytes +=`) com o FrameDecoder/DelimitedReader, que decodifica
+várias mensagens de um único buffer preenchido com recv_into.
+
+Uso:
+    python3 testes/bench_framing.py [num_mensagens] [tamanho_mensagem]
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'proto'))
+
+from framing import AsyncDelimitedReader, DelimitedReader, FrameDecoder, encode_varint
+
+# === Helpers antigos (cópia do gateway / api_server antes do framing.py) ===
+def legacy_encode_varint(value):
+    result = b""
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            result += bytes([bits | 0x80])
+        else:
+            result += bytes([bits])
+            break
+    return result
+
+def legacy_read_delimited(sock_file):
+    size = 0
+    shift = 0
+    while True:
+        byte_data = sock_file.read(1)
+        if not byte_data:
+            return None
+        byte = byte_data[0]
+        size |= (byte & 0x7F) << shift
+        if (byte & 0x80) == 0:
+            break
+        shift += 7
+    message_data = sock_file.read(size)
+    if len(message_data) != size:
+        raise ValueError(f"Expected {size} bytes, got {len(message_data)}")
+    return message_data
+
+async def legacy_read_delimited_async(reader):
+    """Versão asyncio usada pelo gateway antes do framing.py (read(1) por byte)"""
+    size = 0
+    shift = 0
+    while True:
+        byte_data = await reader.read(1)
+        if not byte_data:
+            return None
+        byte = byte_data[0]
+        size |= (byte & 0x7F) << shift
+        if (byte & 0x80) == 0:
+            break
+        shift += 7
+    return await reader.readexactly(size)
+
+# === Medições ===
+def bench_encode(label, encoder, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        encoder(len(payload)) + payload
+    elapsed = time.perf_counter() - start
+    print(f"  encode {label:<10} {len(payloads) / elapsed:>14,.0f} msg/s")
+
+def bench_socket(label, read_all, stream):
+    reader_sock, writer_sock = socket.socketpair()
+
+    def writer():
+        with writer_sock:
+            writer_sock.sendall(stream)
+
+    thread = threading.Thread(target=writer)
+    start = time.perf_counter()
+    thread.start()
+    with reader_sock:
+        count = read_all(reader_sock)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    print(f"  socket {label:<10} {count / elapsed:>14,.0f} msg/s ({len(stream) / elapsed / 1e6:,.1f} MB/s)")
+
+def legacy_read_all(sock):
+    sock_file = sock.makefile('rb')
+    count = 0
+    while legacy_read_delimited(sock_file) is not None:
+        count += 1
+    return count
+
+def framing_read_all(sock):
+    count = 0
+    for _ in DelimitedReader(sock):
+        count += 1
+    return count
+
+def bench_asyncio(label, read_all, stream):
+    async def run():
+        async def handler(reader, writer):
+            writer.write(stream)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handler, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        count = await read_all(reader)
+        elapsed = time.perf_counter() - start
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return count, elapsed
+
+    count, elapsed = asyncio.run(run())
+    print(f"  async  {label:<10} {count / elapsed:>14,.0f} msg/s ({len(stream) / elapsed / 1e6:,.1f} MB/s)")
+
+async def legacy_async_read_all(reader):
+    count = 0
+    while await legacy_read_delimited_async(reader) is not None:
+        count += 1
+    return count
+
+async def framing_async_read_all(reader):
+    count = 0
+    async for _ in AsyncDelimitedReader(reader):
+        count += 1
+    return count
+
+def bench_decode_buffer(stream, num_messages):
+    decoder = FrameDecoder(buffer_size=len(stream))
+    decoder.feed(stream)
+    start = time.perf_counter()
+    count = sum(1 for _ in decoder.frames())
+    elapsed = time.perf_counter() - start
+    assert count == num_messages
+    print(f"  buffer framing    {count / elapsed:>14,.0f} msg/s (decodificação pura, sem syscalls)")
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    message_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    payloads = [os.urandom(message_size) for _ in range(1000)] * (num_messages // 1000)
+    stream = b"".join(encode_varint(len(p)) + p for p in payloads)
+
+    print(f"=== Framing varint: {len(payloads)} mensagens de {message_size} bytes ===")
+    bench_encode("legado", legacy_encode_varint, payloads)
+    bench_encode("framing", encode_varint, payloads)
+    bench_socket("legado", legacy_read_all, stream)
+    bench_socket("framing", framing_read_all, stream)
+    bench_asyncio("legado", legacy_async_read_all, stream)
+    bench_asyncio("framing", framing_async_read_all, stream)
+    bench_decode_buffer(stream, len(payloads))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark do front end TCP do Gateway (porta de registro)
+
+Compara conexões/segundo entre o modo legado (uma thread por conexão) e o modo
+asyncio (event loop único com backlog e limite de concorrência configuráveis).
+Cada conexão simula um dispositivo se registrando com um DeviceInfo, como
+acontece quando muitos dispositivos respondem à mesma janela de descoberta.
+
+Uso:
+    python3 testes/bench_gateway_tcp.py [num_conexoes] [clientes_simultaneos]
+"""
+
+import logging
+import socket
+import sys
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'gateway'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'proto'))
+
+import smart_city_pb2
+import smart_city_gateway as gateway
+from framing import encode_delimited
+
+THREADED_PORT = 22345
+ASYNC_PORT = 22355
+
+def build_registration(index):
+    """Cria o envelope DeviceInfo de um dispositivo simulado"""
+    envelope = smart_city_pb2.SmartCityMessage(
+        message_type=smart_city_pb2.MessageType.DEVICE_INFO,
+        device_info=smart_city_pb2.DeviceInfo(
+            device_id=f"bench_relay_{index:06d}",
+            type=smart_city_pb2.DeviceType.RELAY,
+            ip_address="127.0.0.1",
+            port=8000 + (index % 1000),
+            initial_state=smart_city_pb2.DeviceStatus.OFF,
+            is_actuator=True,
+            is_sensor=False
+        )
+    )
+    return encode_delimited(envelope)
+
+def register_once(port, payload):
+    """Abre uma conexão, envia o registro e aguarda o fechamento pelo gateway"""
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+            sock.sendall(payload)
+            sock.shutdown(socket.SHUT_WR)
+            sock.recv(1)
+        return True
+    except OSError:
+        return False
+
+def run_benchmark(label, port, num_connections, concurrency):
+    payloads = [build_registration(i) for i in range(num_connections)]
+    gateway.device_registry.clear()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda p: register_once(port, p), payloads))
+    elapsed = time.perf_counter() - start
+
+    ok = sum(results)
+    print(f"{label:<10} {ok:>7}/{num_connections:<7} {elapsed:>8.2f}s {ok / elapsed:>12.0f} conexões/s")
+    return ok / elapsed
+
+def main():
+    num_connections = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    # O registro loga cada dispositivo em INFO; silenciar para medir só o I/O
+    logging.getLogger().setLevel(logging.WARNING)
+    gateway.logger.setLevel(logging.WARNING)
+
+    threading.Thread(
+        target=gateway.listen_tcp_connections,
+        kwargs={"host": "127.0.0.1", "port": THREADED_PORT},
+        daemon=True
+    ).start()
+
+    started = threading.Event()
+    threading.Thread(
+        target=gateway.listen_tcp_connections_async,
+        kwargs={"host": "127.0.0.1", "port": ASYNC_PORT, "started": started},
+        daemon=True
+    ).start()
+    started.wait(5)
+    time.sleep(0.5)
+
+    print(f"=== Benchmark TCP do Gateway: {num_connections} conexões, {concurrency} clientes simultâneos ===")
+    print(f"{'MODO':<10} {'OK/TOTAL':<15} {'TEMPO':>9} {'TAXA':>22}")
+    threaded = run_benchmark("threaded", THREADED_PORT, num_connections, concurrency)
+    asynchronous = run_benchmark("asyncio", ASYNC_PORT, num_connections, concurrency)
+    print(f"Ganho asyncio/threaded: {asynchronous / threaded:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark da ponte gRPC de atuadores: servidor com threads x grpc.aio
+
+Sobe relés simulados que demoram para responder (Wi-Fi ruim, ESP8266 ocupado),
+os dois modos do servidor da ponte em portas diferentes e dispara muitos
+LigarDispositivo simultâneos contra cada um. No modo threaded cada comando
+ocupa uma das GRPC_MAX_WORKERS threads enquanto espera o relé; no modo asyncio
+os comandos aguardam o relé no mesmo event loop.
+
+Uso:
+    python3 testes/bench_grpc_bridge.py [num_comandos] [num_reles] [atraso_rele_s]
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'grpc_server'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'proto'))
+
+import grpc
+import smart_city_pb2
+import actuator_service_pb2
+import actuator_service_pb2_grpc
+import actuator_bridge_server as bridge
+from framing import AsyncDelimitedReader, encode_delimited
+
+THREADED_PORT = 50151
+ASYNC_PORT = 50152
+RELAY_BASE_PORT = 26000
+
+def start_fake_relays(num_relays, delay):
+    """Relés que respondem cada comando com um DeviceUpdate após `delay` segundos"""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    async def handle(reader, writer):
+        try:
+            async for data in AsyncDelimitedReader(reader):
+                request = smart_city_pb2.SmartCityMessage()
+                request.ParseFromString(data)
+                await asyncio.sleep(delay)
+                status = smart_city_pb2.DeviceStatus.ON
+                if request.client_request.command.command_type == "TURN_OFF":
+                    status = smart_city_pb2.DeviceStatus.OFF
+                writer.write(encode_delimited(smart_city_pb2.SmartCityMessage(
+                    message_type=smart_city_pb2.MessageType.DEVICE_UPDATE,
+                    device_update=smart_city_pb2.DeviceUpdate(
+                        device_id=request.client_request.target_device_id,
+                        type=smart_city_pb2.DeviceType.RELAY,
+                        current_status=status
+                    )
+                )))
+                await writer.drain()
+        except (OSError, EOFError):
+            pass
+        finally:
+            writer.close()
+
+    async def run():
+        for i in range(num_relays):
+            await asyncio.start_server(handle, "127.0.0.1", RELAY_BASE_PORT + i, backlog=1024)
+        started.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True).start()
+    started.wait(10)
+
+def start_aio_bridge(port):
+    """Roda o servidor grpc.aio da ponte no event loop de uma thread própria"""
+    started = threading.Event()
+
+    async def run():
+        server = await bridge.start_aio_server(port)
+        started.set()
+        await server.wait_for_termination()
+
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+    started.wait(10)
+
+async def run_benchmark(label, port, num_commands, num_relays):
+    async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+        stub = actuator_service_pb2_grpc.ActuatorServiceStub(channel)
+        await channel.channel_ready()
+
+        async def command(index):
+            request = actuator_service_pb2.Request(
+                device_id=f"bench_relay_{index % num_relays:04d}",
+                ip="127.0.0.1",
+                port=RELAY_BASE_PORT + index % num_relays
+            )
+            start = time.perf_counter()
+            response = await stub.LigarDispositivo(request, timeout=600)
+            return response.status == "ON", time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(command(i) for i in range(num_commands)))
+        elapsed = time.perf_counter() - start
+
+    ok = sum(1 for success, _ in results if success)
+    latencies = sorted(latency for _, latency in results)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{label:<10} {ok:>6}/{num_commands:<6} {elapsed:>8.2f}s {ok / elapsed:>10.0f} cmd/s {p50:>10.0f} ms {p99:>10.0f} ms")
+    return ok / elapsed
+
+def main():
+    num_commands = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_relays = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    # A ponte loga cada comando em INFO; silenciar para medir só o I/O
+    logging.getLogger().setLevel(logging.WARNING)
+    bridge.logger.setLevel(logging.WARNING)
+
+    start_fake_relays(num_relays, delay)
+    threaded_server = bridge.start_threaded_server(THREADED_PORT)
+    start_aio_bridge(ASYNC_PORT)
+
+    print(f"=== Benchmark da ponte gRPC: {num_commands} comandos, {num_relays} relés, "
+          f"{delay * 1000:.0f} ms por resposta ===")
+    print(f"{'MODO':<10} {'OK/TOTAL':<13} {'TEMPO':>9} {'TAXA':>16} {'P50':>13} {'P99':>13}")
+    threaded = asyncio.run(run_benchmark("threaded", THREADED_PORT, num_commands, num_relays))
+    asynchronous = asyncio.run(run_benchmark("asyncio", ASYNC_PORT, num_commands, num_relays))
+    print(f"Ganho asyncio/threaded: {asynchronous / threaded:.2f}x")
+    threaded_server.stop(0)
+
+if __name__ == "__main__":
+    main()
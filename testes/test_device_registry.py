@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# test_device_registry.py - Índices secundários do DeviceRegistry sem gateway nem broker
+#
+# Registra muitos dispositivos sintéticos, compara consultas filtradas com uma
+# varredura completa e mede o custo de uma consulta seletiva, depois confere
+# que mudanças de status e expirações mantêm os índices consistentes.
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'gateway'))
+from state import DeviceRecord, DeviceRegistry
+
+DEVICES = 50000
+TYPES = 8
+RELAY = 3
+
+
+def brute_force(registry, predicate):
+    return sorted(record.id for record in registry if predicate(record))
+
+
+def main():
+    registry = DeviceRegistry(ttl_for=lambda record: 3600)
+    for i in range(DEVICES):
+        registry.register(DeviceRecord(
+            id=f"device_{i:06d}", type=i % TYPES, ip=f"10.{i % 4}.{(i // 4) % 256}.{i % 200 + 1}", port=9000,
+            status=i % 3, is_actuator=i % TYPES == RELAY, is_sensor=i % TYPES != RELAY
+        ))
+
+    cases = {
+        "tipo RELAY": (dict(types={RELAY}), lambda r: r.type == RELAY),
+        "atuadores ligados": (dict(is_actuator=True, statuses={1}), lambda r: r.is_actuator and r.status == 1),
+        "não sensores": (dict(is_sensor=False), lambda r: not r.is_sensor),
+        "sub-rede /24": (dict(subnet="10.1.7.0/24"), lambda r: r.ip.startswith("10.1.7.")),
+        "sub-rede /16 + tipo": (dict(subnet="10.2.0.0/16", types={2, 3}), lambda r: r.ip.startswith("10.2.") and r.type in (2, 3)),
+    }
+    for name, (filters, predicate) in cases.items():
+        records, total, _ = registry.query(**filters)
+        expected = brute_force(registry, predicate)
+        assert [r.id for r in records] == expected and total == len(expected), name
+        print(f"[OK] {name}: {total} dispositivos")
+
+    # Paginação sobre o índice
+    seen, cursor = [], ""
+    while True:
+        page, total, more = registry.query(types={RELAY}, after=cursor, limit=1000)
+        seen.extend(r.id for r in page)
+        if not more:
+            break
+        cursor = page[-1].id
+    assert seen == brute_force(registry, lambda r: r.type == RELAY)
+    print(f"[OK] Paginação: {len(seen)} relés em páginas de 1000")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        registry.query(subnet="10.1.7.0/24", is_actuator=True)
+    indexed = (time.perf_counter() - start) * 10
+    start = time.perf_counter()
+    for _ in range(100):
+        brute_force(registry, lambda r: r.is_actuator and r.ip.startswith("10.1.7."))
+    scan = (time.perf_counter() - start) * 10
+    print(f"[OK] Consulta seletiva: {indexed:.3f} ms com índices, {scan:.3f} ms varrendo {DEVICES} dispositivos")
+
+    # Mudança de status e remoção atualizam os índices
+    def turn_on(record):
+        record.status = 7
+    registry.update("device_000003", turn_on)
+    assert [r.id for r in registry.query(statuses={7})[0]] == ["device_000003"]
+    registry.remove("device_000003")
+    assert registry.query(statuses={7})[1] == 0
+    registry.update_many({f"device_{i:06d}": turn_on for i in range(10)})
+    assert registry.query(statuses={7})[1] == 9
+    print("[OK] Índices acompanham mudanças de status e remoções")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,9 +13,10 @@ import os
 import time
 
 # Adicionar diretório proto ao path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src', 'proto'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'proto'))
 
 import smart_city_pb2
+from framing import DelimitedReader, write_delimited
 
 class DeviceSimulator:
     def __init__(self, device_id, device_type, ip="127.0.0.1", port=8080):
@@ -26,33 +27,6 @@ class DeviceSimulator:
         self.status = smart_city_pb2.DeviceStatus.OFF
         self.running = False
         
-    def encode_varint(self, value):
-        """Codifica um inteiro como varint (formato Protocol Buffers)"""
-        result = b""
-        while True:
-            bits = value & 0x7F
-            value >>= 7
-            if value:
-                result += bytes([bits | 0x80])
-            else:
-                result += bytes([bits])
-                break
-        return result
-    
-    def read_varint(self, stream):
-        """Lê um varint do stream"""
-        shift = 0
-        result = 0
-        while True:
-            b = stream.read(1)
-            if not b:
-                raise EOFError("Stream fechado")
-            b = b[0]
-            result |= (b & 0x7f) << shift
-            if not (b & 0x80):
-                return result
-            shift += 7
-    
     def handle_command(self, command):
         """Processa um comando recebido"""
         print(f"Dispositivo {self.device_id} recebeu comando: {command.command_type}")
@@ -83,22 +57,15 @@ class DeviceSimulator:
         print(f"Conexao aceita de {client_address}")
         
         try:
-            client_file = client_socket.makefile('rb')
+            frames = DelimitedReader(client_socket)
             
             while True:
-                # Ler tamanho da mensagem (varint)
-                try:
-                    message_size = self.read_varint(client_file)
-                except EOFError:
+                # Ler próxima mensagem delimitada
+                message_data = frames.read_message()
+                if message_data is None:
                     print(f"Cliente {client_address} desconectou")
                     break
                 
-                # Ler mensagem
-                message_data = client_file.read(message_size)
-                if len(message_data) != message_size:
-                    print(f"Mensagem incompleta de {client_address}")
-                    break
-                
                 # Decodificar mensagem
                 envelope = smart_city_pb2.SmartCityMessage()
                 envelope.ParseFromString(message_data)
@@ -111,8 +78,7 @@ class DeviceSimulator:
                         response = self.handle_command(envelope.client_request.command)
                         
                         # Enviar resposta
-                        response_data = response.SerializeToString()
-                        client_socket.sendall(self.encode_varint(len(response_data)) + response_data)
+                        write_delimited(client_socket, response)
                         print(f"Resposta enviada para {client_address}")
                 
         except Exception as e:
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# test_history_store.py - Histórico de sensores (segmentos mmap) sem gateway nem broker
+#
+# Grava leituras sintéticas com HistoryStore e RollupStore, consulta intervalos
+# e agregados por instâncias somente leitura (como a API faz) e aplica a retenção.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'gateway'))
+from history import HistoryStore, sample_values
+from rollup import RollupStore
+
+DEVICES = 100
+READINGS_PER_DEVICE = 3600  # Uma leitura por segundo durante 1 h
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix="history_test_")
+    try:
+        writer = HistoryStore(directory, segment_capacity=1024, retention=1800)
+        reader = HistoryStore(directory, readonly=True)
+        rollups = RollupStore(os.path.join(directory, "rollups"))
+        t0 = time.time() - READINGS_PER_DEVICE
+        rollup_time = 0.0
+
+        start = time.perf_counter()
+        for second in range(0, READINGS_PER_DEVICE, 60):
+            # Lotes como os do pipeline de ingestão: várias leituras por dispositivo
+            batch = [
+                (f"temp_sensor_{d:03d}", t0 + second + i,
+                 sample_values({"temperature": 20 + (second + i) / 1000, "humidity": 50.0, "status": "ACTIVE"}))
+                for d in range(DEVICES) for i in range(60)
+            ]
+            writer.append_many(batch)
+            rollup_start = time.perf_counter()
+            rollups.add_many(batch)
+            rollup_time += time.perf_counter() - rollup_start
+        elapsed = time.perf_counter() - start - rollup_time
+        total = DEVICES * READINGS_PER_DEVICE * 2
+        print(f"[OK] {total} valores gravados em {elapsed:.2f}s ({total / elapsed:,.0f} valores/s)")
+
+        start = time.perf_counter()
+        timestamps, values = reader.query("temp_sensor_042", "temperature", t0 + 600, t0 + 659.5)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert len(timestamps) == 60 and timestamps[0] == t0 + 600, (len(timestamps), timestamps[:1])
+        assert abs(values[0] - 20.6) < 1e-9
+        print(f"[OK] Consulta de 60 amostras em {elapsed:.2f} ms")
+        assert reader.metrics("temp_sensor_042") == ["humidity", "temperature"]
+        print(f"[OK] Agregados 1m/1h/1d atualizados em {rollup_time:.2f}s")
+
+        rollup_reader = RollupStore(os.path.join(directory, "rollups"), readonly=True)
+        start = time.perf_counter()
+        buckets = rollup_reader.query("temp_sensor_042", "temperature", "1m", t0, time.time())
+        elapsed = (time.perf_counter() - start) * 1000
+        assert sum(b['count'] for b in buckets) == READINGS_PER_DEVICE
+        assert min(b['min'] for b in buckets) == 20.0
+        minute = next(b for b in buckets if b['count'] == 60)
+        assert minute['min'] <= minute['mean'] <= minute['max']
+        print(f"[OK] Consulta de {len(buckets)} baldes de 1m em {elapsed:.2f} ms")
+        rollups.close()
+
+        # Lote fora de ordem: o agregado acompanha o histórico bruto, que leva a leitura atrasada ao instante anterior
+        late = t0 - (t0 % 3600)
+        writer.append_many([("late_sensor", late + 100, {"t": 1.0}), ("late_sensor", late + 250, {"t": 2.0}),
+                            ("late_sensor", late + 130, {"t": 3.0})])
+        late_rollups = RollupStore(os.path.join(directory, "late_rollups"))
+        late_rollups.add_many([("late_sensor", late + 100, {"t": 1.0}), ("late_sensor", late + 250, {"t": 2.0}),
+                               ("late_sensor", late + 130, {"t": 3.0})])
+        timestamps, _ = reader.query("late_sensor", "t", late, late + 3600)
+        assert timestamps == [late + 100, late + 250, late + 250], timestamps
+        buckets = late_rollups.query("late_sensor", "t", "1m", late, late + 3600)
+        assert [(b['count'], b['min'], b['max']) for b in buckets] == [(1, 1.0, 1.0), (2, 2.0, 3.0)], buckets
+        late_rollups.close()
+        print("[OK] Lote fora de ordem agregado nos mesmos instantes do histórico bruto")
+
+        removed = writer.enforce_retention()
+        timestamps, _ = reader.query("temp_sensor_042", "temperature", 0, time.time())
+        assert timestamps[0] <= time.time() - 1800 and timestamps[-1] == t0 + READINGS_PER_DEVICE - 1
+        print(f"[OK] Retenção removeu {removed} segmentos; {len(timestamps)} amostras restantes no dispositivo 42")
+        writer.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# test_mqtt_protobuf_sensor.py - Telemetria MQTT em protobuf (DeviceUpdate) x JSON
+#
+# Sem argumentos: compara tamanho e custo de decodificação dos dois formatos
+# usando o mesmo decodificador do gateway (sensor_codec).
+# Com --publish: publica leituras protobuf em smart_city/sensors_pb/<id>
+# (o sensor precisa estar registrado no gateway para os dados aparecerem).
+
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'proto'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src', 'gateway'))
+import smart_city_pb2
+from sensor_codec import decode_sensor_payload, FORMAT_JSON, FORMAT_PROTOBUF
+
+MQTT_BROKER_HOST = "localhost"  # <--- Altere aqui para o IP do seu broker MQTT
+MQTT_BROKER_PORT = 1883
+MQTT_USERNAME = "smartcity"
+MQTT_PASSWORD = "smartcity123"
+DEVICE_ID = "temp_sensor_pb_001"
+ITERATIONS = 100000
+
+
+def build_payloads(device_id, temperature, humidity):
+    update = smart_city_pb2.DeviceUpdate(
+        device_id=device_id,
+        type=smart_city_pb2.DeviceType.TEMPERATURE_SENSOR,
+        current_status=smart_city_pb2.DeviceStatus.ACTIVE,
+    )
+    update.temperature_humidity.temperature = temperature
+    update.temperature_humidity.humidity = humidity
+    json_payload = json.dumps({
+        "device_id": device_id,
+        "temperature": temperature,
+        "humidity": humidity,
+        "status": "ACTIVE",
+        "timestamp": int(time.time() * 1000),
+        "version": "mqtt",
+    }).encode('utf-8')
+    return json_payload, update.SerializeToString()
+
+
+def check_decoding():
+    json_payload, pb_payload = build_payloads(DEVICE_ID, 25.3, 60.2)
+
+    data, fmt = decode_sensor_payload(json_payload)
+    assert fmt == FORMAT_JSON and data['temperature'] == 25.3
+    data, fmt = decode_sensor_payload(pb_payload)
+    assert fmt == FORMAT_PROTOBUF and data['device_id'] == DEVICE_ID
+    assert data['temperature'] == 25.3 and data['humidity'] == 60.2 and data['status'] == "ACTIVE"
+    # JSON publicado no namespace protobuf (dispositivo antigo mal configurado)
+    data, fmt = decode_sensor_payload(json_payload, FORMAT_PROTOBUF)
+    assert fmt == FORMAT_JSON
+    print("[OK] Detecção de formato e decodificação JSON/protobuf")
+
+    print(f"Tamanho: JSON {len(json_payload)} bytes, protobuf {len(pb_payload)} bytes")
+    for name, payload in (("JSON", json_payload), ("protobuf", pb_payload)):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            decode_sensor_payload(payload)
+        elapsed = time.perf_counter() - start
+        print(f"Decodificação {name}: {elapsed / ITERATIONS * 1e6:.2f} us/mensagem")
+
+
+def publish(count=10, interval=1.0):
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(f"pb_sensor_tester_{int(time.time())}")
+    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
+    client.loop_start()
+    topic = f"smart_city/sensors_pb/{DEVICE_ID}"
+    for i in range(count):
+        _, pb_payload = build_payloads(DEVICE_ID, 20.0 + i * 0.5, 50.0 + i)
+        client.publish(topic, pb_payload, qos=0)
+        print(f"Publicado em {topic}: {len(pb_payload)} bytes")
+        time.sleep(interval)
+    client.loop_stop()
+    client.disconnect()
+
+
+if __name__ == "__main__":
+    if "--publish" in sys.argv:
+        publish()
+    else:
+        check_decoding()